@@ -0,0 +1,391 @@
+"""
+LLM answer cache with single-flight de-duplication.
+
+Answers are keyed by the normalized query, the ids of the documents used as
+context, the model name and a hash of the prompt template, so a change to any
+of them produces a fresh answer. Concurrent identical requests are coalesced:
+only the first one calls the LLM, the others wait for its result, whether they
+come from threads or from the event loop.
+
+Two storage backends are available:
+- "memory": in-process LRU (fast, per worker)
+- "sqlite": on-disk table (survives restarts, shared by workers on one host)
+  behind an in-process tier of recent answers; lookups never write, and the
+  async API runs its file I/O in a thread pool rather than on the event loop
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Optional, Tuple
+
+from RAG.cache import LRUCache, normalize_query
+
+
+def template_hash(template: str) -> str:
+    """Short hash of a prompt template"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def answer_key(query: str, doc_ids: Iterable[str], model: str, prompt_hash: str) -> str:
+    """Cache key for an LLM answer"""
+    payload = json.dumps([normalize_query(query), list(doc_ids), model, prompt_hash])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryAnswerBackend:
+    def __init__(self, max_entries: int = 4096, ttl_s: Optional[float] = None):
+        self._cache = LRUCache(max_entries=max_entries, ttl_s=ttl_s)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    def put(self, key: str, answer: str):
+        self._cache.put(key, answer)
+
+    def size(self) -> int:
+        return len(self._cache)
+
+
+class SQLiteAnswerBackend:
+    """
+    On-disk answers behind a small in-process tier of recently used ones.
+
+    Lookups only read: last_used updates are collected in memory and written in
+    batches (with the next put, or once `touch_batch` have piled up), and the
+    entry count is a counter, re-synced whenever old rows are trimmed. `peek`
+    answers from the in-process tier alone, without any I/O.
+    """
+
+    blocking = True  # get/put do file I/O: async callers run them off the event loop
+
+    def __init__(self, path, max_entries: int = 50000, ttl_s: Optional[float] = None,
+                 recent_entries: int = 1024, touch_batch: int = 256):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.touch_batch = touch_batch
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                cache_key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.commit()
+        self._size = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        conn.close()
+        self._puts = 0
+        self._recent = LRUCache(max_entries=recent_entries)  # key -> (answer, created)
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last use not written yet
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _expired(self, created: float, now: float) -> bool:
+        return bool(self.ttl_s) and created + self.ttl_s < now
+
+    def peek(self, key: str) -> Optional[str]:
+        """Answer from the in-process tier (no I/O); a hit counts as a use"""
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        answer, created = entry
+        now = time.time()
+        if self._expired(created, now):
+            return None
+        with self._lock:
+            self._touched[key] = now
+        return answer
+
+    def _flush_touches(self, conn, force: bool = False):
+        with self._lock:
+            if not self._touched or (not force and len(self._touched) < self.touch_batch):
+                return
+            touched, self._touched = self._touched, {}
+        conn.executemany("UPDATE answers SET last_used = ? WHERE cache_key = ?",
+                         [(used, key) for key, used in touched.items()])
+        conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        answer = self.peek(key)
+        if answer is not None:
+            return answer
+        conn = self._connect()
+        try:
+            self._flush_touches(conn)
+            row = conn.execute("SELECT answer, created FROM answers WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            answer, created = row
+            now = time.time()
+            if self._expired(created, now):
+                conn.execute("DELETE FROM answers WHERE cache_key = ?", (key,))
+                conn.commit()
+                self._size = max(0, self._size - 1)
+                return None
+            self._recent.put(key, (answer, created))
+            with self._lock:
+                self._touched[key] = now
+            return answer
+        finally:
+            conn.close()
+
+    def put(self, key: str, answer: str):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("""
+                INSERT INTO answers (cache_key, answer, created, last_used) VALUES (?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET answer=excluded.answer,
+                                                     created=excluded.created,
+                                                     last_used=excluded.last_used
+            """, (key, answer, now, now))
+            self._size += 1  # keys are content-addressed, so a put is almost always a new row
+            # Trim least recently used rows every so often rather than on every write
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._flush_touches(conn, force=True)
+                conn.execute("""
+                    DELETE FROM answers WHERE cache_key IN (
+                        SELECT cache_key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+                self._size = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            conn.commit()
+            self._flush_touches(conn)
+        finally:
+            conn.close()
+        self._recent.put(key, (answer, now))
+
+    def size(self) -> int:
+        """Rows in the table, as counted by this process (exact after each trim)"""
+        return self._size
+
+
+class _Flight:
+    """One upstream call in progress for a key, shared by threads and the event loop"""
+
+    __slots__ = ("future", "task", "waiters")
+
+    def __init__(self):
+        self.future = Future()  # settled with the answer (or error) for every waiter
+        self.task = None        # the asyncio task running the call, when an async caller leads
+        self.waiters = 0        # callers besides a sync leader that are waiting on it
+
+
+class AnswerCache:
+    """
+    Answer cache front-end with sync and async single-flight lookups.
+
+    Threads (get_or_compute) and the event loop (aget_or_compute) share one map
+    of in-flight calls, so concurrent identical requests trigger one upstream
+    call whichever way they come in. A thread waiting on a call blocks until it
+    finishes, so the sync methods must not be called on the event loop's thread.
+    With a blocking backend (sqlite), the async methods do their I/O in the
+    default thread pool; hits on its in-process tier never leave the loop.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.blocking = getattr(backend, "blocking", False)
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+
+    def _peek(self, key: str) -> Optional[str]:
+        """Lookup without I/O"""
+        return self.backend.peek(key) if self.blocking else self.backend.get(key)
+
+    def _count(self, answer: Optional[str]) -> Optional[str]:
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def get(self, key: str) -> Optional[str]:
+        """Plain blocking lookup, for callers that cannot share a result"""
+        return self._count(self.backend.get(key))
+
+    def put(self, key: str, answer: str):
+        self.backend.put(key, answer)
+
+    async def _aget(self, key: str) -> Optional[str]:
+        answer = self._peek(key)
+        if answer is None and self.blocking:
+            answer = await asyncio.to_thread(self.backend.get, key)
+        return answer
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Plain lookup from the event loop (e.g. streaming, which cannot share a result)"""
+        return self._count(await self._aget(key))
+
+    async def aput(self, key: str, answer: str):
+        if self.blocking:
+            await asyncio.to_thread(self.backend.put, key, answer)
+        else:
+            self.backend.put(key, answer)
+
+    def contains(self, key: str) -> bool:
+        """
+        Whether an answer is cached, without I/O or counting a lookup (e.g. for a
+        routing decision). For the sqlite backend only answers this process has
+        recently read or written are seen.
+        """
+        return self._peek(key) is not None
+
+    def _join(self, key: str) -> Tuple[Optional[_Flight], Optional[str], bool]:
+        """
+        Join the key's flight, or start one: returns (flight, cached answer, leader).
+        The cache is checked again under the lock, so a call that finished since
+        the caller's lookup is not repeated. Caller holds self._lock.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight, None, False
+        cached = self._peek(key)
+        if cached is not None:
+            self.hits += 1
+            return None, cached, False
+        self.misses += 1
+        self.upstream_calls += 1
+        flight = self._flights[key] = _Flight()
+        return flight, None, True
+
+    def _settle(self, key: str, flight: _Flight, answer: Optional[str] = None,
+                error: Optional[BaseException] = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if isinstance(error, asyncio.CancelledError):
+            flight.future.cancel()
+        elif error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(answer)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[str]]) -> Optional[str]:
+        """Blocking lookup; `compute` runs at most once per key across threads and the event loop"""
+        cached = self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        with self._lock:
+            flight, cached, leader = self._join(key)
+            if flight is not None and not leader:
+                flight.waiters += 1
+        if flight is None:
+            return cached
+
+        if not leader:
+            try:
+                return flight.future.result()
+            finally:
+                with self._lock:
+                    flight.waiters -= 1
+
+        try:
+            answer = compute()
+            if answer is not None:
+                self.backend.put(key, answer)
+        except BaseException as e:
+            self._settle(key, flight, error=e)
+            raise
+        self._settle(key, flight, answer)
+        return answer
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        Async lookup; `compute` runs at most once per key, shared with threads.
+
+        The upstream call runs in its own task. A waiter that is cancelled does
+        not cancel it for the others, but once nobody is waiting it is cancelled.
+        """
+        cached = await self._aget(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        with self._lock:
+            flight, cached, leader = self._join(key)
+            if leader:
+                flight.task = asyncio.ensure_future(self._run_async(key, flight, compute))
+            if flight is not None:
+                flight.waiters += 1
+        if flight is None:
+            return cached
+
+        task = flight.task
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            waitable = task
+        else:
+            waitable = asyncio.wrap_future(flight.future)  # a thread (or another loop) is making the call
+        try:
+            return await asyncio.shield(waitable)
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = (flight.waiters == 0 and task is not None and not task.done()
+                             and self._flights.get(key) is flight)
+                if abandoned:
+                    del self._flights[key]  # nobody can join a call that is about to be cancelled
+            if abandoned:
+                task.cancel()
+
+    async def _run_async(self, key: str, flight: _Flight, compute):
+        try:
+            answer = await compute()
+            if answer is not None:
+                await self.aput(key, answer)
+        except BaseException as e:
+            self._settle(key, flight, error=e)
+            raise
+        self._settle(key, flight, answer)
+        return answer
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "in_flight": len(self._flights),
+        }
+
+
+def make_answer_cache(cache_config: Optional[dict]) -> AnswerCache:
+    """Build an AnswerCache from the `answer_cache` section of settings.yaml"""
+    cache_config = cache_config or {}
+    backend_name = cache_config.get("backend", "memory")
+    max_entries = cache_config.get("max_entries", 4096)
+    ttl_s = cache_config.get("ttl_s")
+
+    if backend_name == "sqlite":
+        backend = SQLiteAnswerBackend(cache_config.get("path", "Database_SQL/answer_cache.db"), max_entries, ttl_s,
+                                      recent_entries=cache_config.get("recent_entries", 1024))
+    elif backend_name == "memory":
+        backend = MemoryAnswerBackend(max_entries, ttl_s)
+    else:
+        raise ValueError(f"Unknown answer_cache backend: {backend_name}")
+    return AnswerCache(backend)
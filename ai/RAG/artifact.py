@@ -0,0 +1,408 @@
+"""
+Versioned, memory-mapped index artifact.
+
+Replaces the pickled LangChain docstore (`index.pkl`) with files that can be
+opened without deserializing anything:
+
+    RAG/store/
+        manifest.json   small: format version, build id, model, dim, counts, last build
+        vectors.npy     float32 (or float16) [count, dim], opened with mmap
+        index.faiss     FAISS index over the same rows (flat, HNSW, IVF or IVF-PQ; see
+                        RAG/faiss_index.py), opened with mmap where supported
+        docs.sqlite     one row per vector: doc_id, content hash, text, JSON metadata
+                        and precomputed display fields
+        lexical.npz     BM25 inverted index over the same rows (RAG/lexical.py)
+
+Loading only maps the files, so it is near-instant and the pages are shared by
+every worker through the OS page cache. Document text and metadata are read
+lazily, only for the top-k hits of a search.
+
+Stores built before this format (index.faiss + index.pkl) are still loaded
+through LegacyFAISSStore.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from RAG.cache import index_version
+from RAG.documents import document_id
+from RAG.faiss_index import build_index, index_bytes, index_spec, set_search_params
+from RAG.hits import DocView, SearchHit, display_fields
+from RAG.lexical import BM25Index, document_text, lexical_distance, rrf
+
+FORMAT_VERSION = 2
+SUPPORTED_FORMATS = (1, 2)  # 1: no display column, fields are derived on first access
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.sqlite"
+LEXICAL_FILE = "lexical.npz"
+
+
+def is_artifact(store_path) -> bool:
+    manifest_path = Path(store_path) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return False
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("format_version") in SUPPORTED_FORMATS
+
+
+def read_manifest(store_path) -> Optional[dict]:
+    if not is_artifact(store_path):
+        return None
+    with open(Path(store_path) / MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ----------------------
+# Writing
+# ----------------------
+
+def build_faiss_index(vectors: np.ndarray, spec: Optional[dict] = None):
+    """L2 index over `vectors` (same metric as the LangChain store); exact unless `spec` says otherwise"""
+    return build_index(vectors, spec or index_spec(vectors.shape[1], len(vectors)))
+
+
+def write_artifact(store_path, docs: Sequence[Document], vectors: np.ndarray, embedding_model: str,
+                   extra: Optional[dict] = None, lexical: Optional[dict] = None, index: Optional[dict] = None,
+                   embedding_revision: Optional[str] = None) -> dict:
+    """
+    Write a complete artifact for `docs` (row i <-> vectors[i]); `index` holds
+    the retrieval.index settings (type, storage, training and search knobs).
+    `embedding_revision` is the cache_revision() of the vectors (model revision,
+    backend and quantization), so they are never mixed with another backend's.
+
+    Files go to a temporary sibling directory that then replaces `store_path`,
+    so readers never see a half-written store; processes that still map the
+    old files keep working until they reload.
+    """
+    store_path = Path(store_path)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(docs), -1)
+    tmp_path = store_path.with_name(f"{store_path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    index = index or {}
+    np.save(tmp_path / VECTORS_FILE, vectors.astype(np.float16) if index.get("storage") == "float16" else vectors)
+    spec = index_spec(vectors.shape[1], len(docs), index)
+    faiss_index = build_faiss_index(vectors, spec)
+    faiss.write_index(faiss_index, str(tmp_path / INDEX_FILE))
+
+    lexical = lexical or {}
+    lexical_index = BM25Index.build(
+        [document_text(d.page_content, d.metadata) for d in docs],
+        k1=lexical.get("k1", 1.2), b=lexical.get("b", 0.75),
+    )
+    lexical_index.save(tmp_path / LEXICAL_FILE)
+
+    conn = sqlite3.connect(tmp_path / DOCS_FILE)
+    conn.execute("""
+        CREATE TABLE docs (
+            row INTEGER PRIMARY KEY,
+            doc_id TEXT NOT NULL UNIQUE,
+            content_hash TEXT,
+            content TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            display TEXT
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO docs (row, doc_id, content_hash, content, metadata, display) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (row, d.metadata["doc_id"], d.metadata.get("content_hash"), d.page_content,
+             json.dumps(d.metadata, default=str), json.dumps(display_fields(d.page_content, d.metadata)))
+            for row, d in enumerate(docs)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "build_id": uuid.uuid4().hex[:12],
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embedding_model": embedding_model,
+        "embedding_revision": embedding_revision,
+        "dim": int(vectors.shape[1]) if vectors.size else 0,
+        "count": len(docs),
+        "metric": "l2",
+        "index": {**spec, "bytes": index_bytes(faiss_index)},
+        "lexical": {"terms": len(lexical_index.terms), "k1": lexical_index.k1, "b": lexical_index.b},
+        **(extra or {}),
+    }
+    with open(tmp_path / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    old_path = store_path.with_name(f"{store_path.name}.old-{os.getpid()}")
+    if store_path.exists():
+        store_path.rename(old_path)
+    tmp_path.rename(store_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+# ----------------------
+# Reading
+# ----------------------
+
+class _LexicalSearch:
+    """Lexical and hybrid search shared by both store types (needs get_views, search_hits and _vector)"""
+
+    lexical: Optional[BM25Index] = None
+
+    def lexical_hits(self, query: str, k: int) -> List[SearchHit]:
+        """BM25 hits, best first; scores are mapped onto the L2 scale (see lexical_distance)"""
+        if self.lexical is None:
+            return []
+        ranked = self.lexical.search(query, k)
+        views = self.get_views([row for row, _ in ranked])
+        return [SearchHit(views[row], lexical_distance(score)) for row, score in ranked if row in views]
+
+    def hybrid_hits(self, queries: Sequence[str], matrix: np.ndarray, k: int,
+                    candidates: int = 20, rrf_k: int = 60) -> List[List[SearchHit]]:
+        """
+        Dense and BM25 candidates fused with reciprocal-rank fusion. Hits keep
+        their L2 distance to the query, computed from the stored vector for
+        documents that only the lexical side found.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(len(queries), -1)
+        dense_per_query = self.search_hits(matrix, max(k, candidates))
+        results = []
+        for query, vector, dense in zip(queries, matrix, dense_per_query):
+            lexical = self.lexical.search(query, max(k, candidates)) if self.lexical is not None else []
+            distances = {hit.doc.row: hit.score for hit in dense}
+            fused = [row for row, _ in rrf([[hit.doc.row for hit in dense], [row for row, _ in lexical]], rrf_k)[:k]]
+            views = self.get_views(fused)
+            for row in fused:
+                if row not in distances:
+                    distances[row] = float(np.sum((np.asarray(self._vector(row), dtype=np.float32) - vector) ** 2))
+            results.append([SearchHit(views[row], distances[row]) for row in fused if row in views])
+        return results
+
+
+def _read_index_mmap(path: Path):
+    """Open a FAISS index without copying its data into the heap where FAISS allows it"""
+    flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", None), getattr(faiss, "IO_FLAG_MMAP", None)]
+    for flag in flags:
+        if flag is None:
+            continue
+        try:
+            return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            continue
+    return faiss.read_index(str(path))
+
+
+class ArtifactStore(_LexicalSearch):
+    """Read-only vector store over an on-disk artifact"""
+
+    def __init__(self, store_path, embedding=None, search_params: Optional[dict] = None):
+        self.path = Path(store_path)
+        self.embedding = embedding
+        with open(self.path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported artifact format: {self.manifest.get('format_version')}")
+
+        self.version = self.manifest["build_id"]
+        self.vectors = np.load(self.path / VECTORS_FILE, mmap_mode="r")
+        self.index = _read_index_mmap(self.path / INDEX_FILE)
+        # nprobe / efSearch: from the build settings, overridden by the caller's
+        params = {**(self.manifest.get("index") or {}), **{k: v for k, v in (search_params or {}).items() if v}}
+        set_search_params(self.index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+        self._docs_uri = f"file:{(self.path / DOCS_FILE).resolve()}?mode=ro&immutable=1"
+        self._local = threading.local()
+        self._has_display = self.manifest["format_version"] >= 2
+        self._views: Dict[int, DocView] = {}  # row -> DocView, filled as rows are hit
+        lexical_path = self.path / LEXICAL_FILE
+        self.lexical = BM25Index.load(lexical_path) if lexical_path.exists() else None
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def _conn(self):
+        # One read-only connection per thread; SQLite caches pages in the OS page cache
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self._docs_uri, uri=True, check_same_thread=False)
+        return conn
+
+    # --- Lazy document access ---
+    def get_documents(self, rows: Sequence[int]) -> Dict[int, Document]:
+        rows = [int(r) for r in rows if r >= 0]
+        if not rows:
+            return {}
+        placeholders = ",".join("?" * len(rows))
+        fetched = self._conn().execute(
+            f"SELECT row, content, metadata FROM docs WHERE row IN ({placeholders})", rows
+        ).fetchall()
+        return {row: Document(page_content=content, metadata=json.loads(metadata)) for row, content, metadata in fetched}
+
+    def get_by_doc_id(self, doc_ids: Sequence[str]) -> Dict[str, Tuple[int, Document]]:
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        fetched = self._conn().execute(
+            f"SELECT row, doc_id, content, metadata FROM docs WHERE doc_id IN ({placeholders})", list(doc_ids)
+        ).fetchall()
+        return {
+            doc_id: (row, Document(page_content=content, metadata=json.loads(metadata)))
+            for row, doc_id, content, metadata in fetched
+        }
+
+    def get_views(self, rows: Sequence[int]) -> Dict[int, DocView]:
+        """DocViews for `rows`; each row is read from docs.sqlite at most once"""
+        views = {}
+        missing = []
+        for row in rows:
+            row = int(row)
+            if row < 0:
+                continue
+            view = self._views.get(row)
+            if view is None:
+                missing.append(row)
+            else:
+                views[row] = view
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            display_column = "display" if self._has_display else "NULL"
+            fetched = self._conn().execute(
+                f"SELECT row, doc_id, content, metadata, {display_column} FROM docs WHERE row IN ({placeholders})",
+                missing,
+            ).fetchall()
+            for row, doc_id, content, metadata, display in fetched:
+                view = DocView(row, doc_id, content, json.loads(metadata), json.loads(display) if display else None)
+                views[row] = self._views[row] = view
+        return views
+
+    def _vector(self, row: int) -> np.ndarray:
+        return self.vectors[row]
+
+    def iter_rows(self):
+        """(row, doc_id, content_hash) for every document, in row order"""
+        return self._conn().execute("SELECT row, doc_id, content_hash FROM docs ORDER BY row").fetchall()
+
+    def doc_rows(self) -> Dict[str, int]:
+        """doc_id -> row for every document"""
+        return {doc_id: row for row, doc_id in self._conn().execute("SELECT row, doc_id FROM docs")}
+
+    # --- Search ---
+    def search_hits(self, matrix: np.ndarray, k: int) -> List[List[SearchHit]]:
+        """Like search_batch, returning SearchHits (best first) instead of Documents"""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        scores, indices = self.index.search(matrix, min(k, max(1, self.index.ntotal)))
+        views = self.get_views(np.unique(indices).tolist())
+        return [
+            [SearchHit(views[int(idx)], float(score)) for score, idx in zip(row_scores, row_indices) if int(idx) in views]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def search_batch(self, matrix: np.ndarray, k: int) -> List[List[Tuple[Document, float]]]:
+        """Search many query vectors at once; documents are fetched for the hits only"""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        scores, indices = self.index.search(matrix, min(k, max(1, self.index.ntotal)))
+        docs = self.get_documents(np.unique(indices).tolist())
+        return [
+            [(docs[int(idx)], float(score)) for score, idx in zip(row_scores, row_indices) if int(idx) in docs]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4) -> List[Tuple[Document, float]]:
+        return self.search_batch(np.asarray(embedding, dtype=np.float32), k)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+class LegacyFAISSStore(_LexicalSearch):
+    """Same interface over a pickled LangChain FAISS store (index.faiss + index.pkl)"""
+
+    def __init__(self, store_path, embedding):
+        from langchain_community.vectorstores import FAISS
+
+        self.path = Path(store_path)
+        self.embedding = embedding
+        self.store = FAISS.load_local(str(self.path), embedding, allow_dangerous_deserialization=True)
+        self.index = self.store.index
+        self.version = index_version(self.path)
+
+        # The docstore is fully in memory already, so display fields are derived up front
+        self._views = {}
+        for row, docstore_id in self.store.index_to_docstore_id.items():
+            doc = self.store.docstore.search(docstore_id)
+            self._views[row] = DocView(row, document_id(doc.metadata, doc.page_content), doc.page_content, doc.metadata)
+        self.lexical = BM25Index.build([
+            document_text(self._views[row].content, self._views[row].metadata) for row in range(self.index.ntotal)
+        ])
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def get_views(self, rows: Sequence[int]) -> Dict[int, DocView]:
+        return {int(row): self._views[int(row)] for row in rows if int(row) in self._views}
+
+    def doc_rows(self) -> Dict[str, int]:
+        return {view.doc_id: row for row, view in self._views.items()}
+
+    def _vector(self, row: int) -> np.ndarray:
+        return self.index.reconstruct(int(row))
+
+    def search_hits(self, matrix: np.ndarray, k: int) -> List[List[SearchHit]]:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        scores, indices = self.index.search(matrix, k)
+        return [
+            [SearchHit(self._views[int(idx)], float(score)) for score, idx in zip(row_scores, row_indices) if idx != -1]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def search_batch(self, matrix: np.ndarray, k: int) -> List[List[Tuple[Document, float]]]:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        scores, indices = self.index.search(matrix, k)
+        return [
+            [
+                (self.store.docstore.search(self.store.index_to_docstore_id[int(idx)]), float(score))
+                for score, idx in zip(row_scores, row_indices) if idx != -1
+            ]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4):
+        return self.store.similarity_search_with_score_by_vector(embedding, k=k)
+
+    def similarity_search_with_score(self, query: str, k: int = 4):
+        return self.store.similarity_search_with_score(query, k=k)
+
+    def similarity_search(self, query: str, k: int = 4):
+        return self.store.similarity_search(query, k=k)
+
+
+def load_vector_store(store_path, embedding=None, search_params: Optional[dict] = None):
+    """
+    Open the store at `store_path`: the mmap artifact if present, else the legacy pickle.
+    `search_params` (nprobe, ef_search) override the ones the artifact was built with.
+    """
+    if is_artifact(store_path):
+        return ArtifactStore(store_path, embedding, search_params)
+    return LegacyFAISSStore(store_path, embedding)
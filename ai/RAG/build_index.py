@@ -1,14 +1,19 @@
 # build_index.py
+import os
+import sys
 import json
+import time
 import yaml
 import sqlite3
-import torch
+import argparse
 from pathlib import Path
+import numpy as np
 from langchain.schema import Document
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 
-device = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RAG.artifact import MANIFEST_FILE, ArtifactStore, read_manifest, write_artifact
+from RAG.documents import content_hash, document_id
+from RAG.embeddings import cache_revision, load_embeddings
 
 
 # --------------------
@@ -21,7 +26,11 @@ DB_PATH = Path(config["paths"]['params_db'])
 hf_retrieval_model = config["retrieval"]["embedding_model"]
 
 STORE_PATH = Path(config["paths"]["rag_store"])
-STORE_PATH.mkdir(parents=True, exist_ok=True)
+
+
+def get_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
 
 
 def fetch_and_build(cur, query, section, row_parser):
@@ -31,10 +40,18 @@ def fetch_and_build(cur, query, section, row_parser):
     for row in cur.fetchall():
         semantic_text, metadata = row_parser(row, section)
         if semantic_text:  # skip empty docs
-            docs.append(Document(page_content=semantic_text, metadata=metadata))
+            docs.append(Document(page_content=semantic_text, metadata=with_identity(semantic_text, metadata)))
     return docs
 
 
+def with_identity(semantic_text, metadata):
+    """Add a stable doc_id and a hash of everything that ends up in the index"""
+    metadata = dict(metadata)
+    metadata["doc_id"] = document_id(metadata)
+    metadata["content_hash"] = content_hash(semantic_text + json.dumps(metadata, sort_keys=True, default=str))
+    return metadata
+
+
 # ----------------------
 # Row Parsers
 # ----------------------
@@ -139,19 +156,120 @@ def load_sql_as_docs(db_path: str):
     return docs
 
 
+# ----------------------
+# Incremental index build
+# ----------------------
+
+def build_index(docs, store_path, embedding_model, model_name, full=False, timings=None, lexical=None, index=None,
+                embedding_revision=None):
+    """
+    Build or update the index artifact at `store_path` (see RAG/artifact.py),
+    including the BM25 index over the same documents (`lexical`: k1/b settings).
+    `index` selects the FAISS index type and storage (retrieval.index).
+    `embedding_revision` identifies how the vectors are produced (see
+    RAG.embeddings.cache_revision: model revision, backend, quantization).
+
+    Documents are compared with the previous build by doc_id and content hash:
+    only new or changed documents are embedded, vectors of unchanged ones are
+    reused from the mapped vectors file, and deleted ones are dropped. A full
+    rebuild happens when asked for, when there is no artifact yet, or when the
+    embedding model or its revision changed (e.g. torch -> ONNX int8), since
+    vectors from different backends must not share an index.
+    """
+    store_path = Path(store_path)
+    timings = dict(timings or {})
+
+    t = time.perf_counter()
+    current = {d.metadata["doc_id"]: d.metadata["content_hash"] for d in docs}
+    if len(current) != len(docs):
+        raise ValueError("Duplicate doc_id in params.db documents")
+
+    manifest = read_manifest(store_path)
+    incremental = (
+        not full and manifest is not None
+        and manifest.get("embedding_model") == model_name
+        and manifest.get("embedding_revision") == embedding_revision
+    )
+    previous_rows = {}
+    previous = ArtifactStore(store_path) if incremental else None
+    if previous is not None:
+        previous_rows = {doc_id: (row, h) for row, doc_id, h in previous.iter_rows()}
+
+    added = sorted(doc_id for doc_id in current if doc_id not in previous_rows)
+    removed = sorted(doc_id for doc_id in previous_rows if doc_id not in current)
+    updated = sorted(
+        doc_id for doc_id in current
+        if doc_id in previous_rows and previous_rows[doc_id][1] != current[doc_id]
+    )
+    changed = set(added) | set(updated)
+    to_embed = [d for d in docs if d.metadata["doc_id"] in changed]
+    timings["diff"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    new_vectors = dict(zip(
+        (d.metadata["doc_id"] for d in to_embed),
+        embedding_model.embed_documents([d.page_content for d in to_embed]) if to_embed else [],
+    ))
+    timings["embed"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    vectors = np.asarray([
+        new_vectors[d.metadata["doc_id"]] if d.metadata["doc_id"] in changed
+        else previous.vectors[previous_rows[d.metadata["doc_id"]][0]]
+        for d in docs
+    ], dtype=np.float32)
+    timings["assemble_vectors"] = time.perf_counter() - t
+
+    change_log = {
+        "mode": "incremental" if incremental else "full",
+        "added": added,
+        "updated": updated,
+        "removed": removed,
+        "unchanged": len(current) - len(changed),
+    }
+
+    t = time.perf_counter()
+    manifest = write_artifact(store_path, docs, vectors, model_name, extra={"last_build": change_log},
+                              lexical=lexical, index=index, embedding_revision=embedding_revision)
+    timings["write_artifact"] = time.perf_counter() - t
+
+    # Record the timings, including the write itself, in the manifest
+    change_log["timings_s"] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+    manifest["last_build"] = change_log
+    with open(store_path / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest, change_log
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the FAISS index from params.db")
+    parser.add_argument("--full", action="store_true", help="re-embed every document instead of only changed ones")
+    args = parser.parse_args()
+
     # --------------------
-    # Load both input and output docs
+    # Load input, output and generic docs
     # --------------------
+    t = time.perf_counter()
     params_docs = load_sql_as_docs(DB_PATH)
+    load_seconds = time.perf_counter() - t
     print(f"Loaded {len(params_docs)} documents for indexing.")
 
     # --------------------
-    # Create embeddings & save FAISS index
+    # Embed new/changed docs & write the index artifact
     # --------------------
-    embedding_model = HuggingFaceEmbeddings(model_name=hf_retrieval_model, model_kwargs={"device": device})
-
-    vector_store = FAISS.from_documents(params_docs, embedding_model)
-    vector_store.save_local(str(STORE_PATH))
+    # Unchanged texts are served from the persistent embedding cache
+    device = "cpu" if config["retrieval"].get("backend") == "onnx" else get_device()
+    embedding_model = load_embeddings(config, device, persistent_cache=True)
+
+    manifest, change_log = build_index(
+        params_docs, STORE_PATH, embedding_model, hf_retrieval_model,
+        full=args.full, timings={"load_docs": load_seconds}, lexical=config["retrieval"].get("lexical"),
+        index=config["retrieval"].get("index"), embedding_revision=cache_revision(config["retrieval"])
+    )
 
-    print(f"Vector store saved to {STORE_PATH}")
\ No newline at end of file
+    print(
+        f"{change_log['mode'].title()} build: {len(change_log['added'])} added, "
+        f"{len(change_log['updated'])} updated, {len(change_log['removed'])} removed, "
+        f"{change_log['unchanged']} unchanged"
+    )
+    print(f"Index artifact {manifest['build_id']} saved to {STORE_PATH}")
@@ -0,0 +1,147 @@
+"""
+In-process caches for the retrieval path.
+
+LRUCache is a thread-safe LRU with an optional TTL and an approximate memory
+bound. Entries carry a version tag (e.g. the embedding revision or the index
+version) so anything cached against another model or store is treated as a
+miss and dropped.
+"""
+
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query used as a cache key"""
+    return _WHITESPACE.sub(" ", query.strip().lower()).rstrip("?!. ")
+
+
+def index_version(store_path) -> str:
+    """
+    Identify the on-disk RAG store.
+
+    Based on the size and mtime of every file in the store, so rebuilding the
+    store yields a new version without having to hash the index itself.
+    """
+    store_path = Path(store_path)
+    h = hashlib.sha1()
+    if store_path.exists():
+        for f in sorted(store_path.rglob("*")):
+            if f.is_file():
+                st = f.stat()
+                h.update(f"{f.relative_to(store_path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+
+def approx_size(value: Any) -> int:
+    """Rough deep size in bytes of cached values (lists, tuples, dicts, strings, numbers)"""
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    nbytes = getattr(value, "nbytes", None)  # numpy arrays
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with TTL, an approximate memory bound and version tags.
+
+    - max_entries: maximum number of entries
+    - max_bytes: approximate memory bound, measured with `sizeof`
+    - ttl_s: seconds an entry stays valid (None = no expiry)
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None,
+                 ttl_s: Optional[float] = None, sizeof: Callable[[Any], int] = approx_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._sizeof = sizeof
+        self._data = OrderedDict()  # key -> (value, version, expires_at, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, version: Optional[str] = None, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, entry_version, expires_at, _ = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if entry_version != version:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Optional[str] = None):
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # never cacheable
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else None
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, version, expires_at, size)
+            self.bytes += size
+
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        _, _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
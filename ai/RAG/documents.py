@@ -0,0 +1,30 @@
+"""
+Stable identifiers for indexed documents.
+
+Every row loaded from params.db maps to one document. Its id is derived from
+where it lives in the schema (section/package/function/param for inputs and
+outputs, section/package/term for generic terms), so it survives re-indexing.
+"""
+
+import hashlib
+from typing import Any, Dict, Optional
+
+
+def document_id(metadata: Optional[Dict[str, Any]], content: Optional[str] = None) -> str:
+    """Stable id for a document, falling back to a content hash when metadata is missing"""
+    metadata = metadata or {}
+    if metadata.get("doc_id"):
+        return metadata["doc_id"]
+
+    section = metadata.get("section")
+    if section in ("input", "output"):
+        return "/".join([section, str(metadata.get("package")), str(metadata.get("function")), str(metadata.get("param"))])
+    if section == "generic":
+        return "/".join([section, str(metadata.get("package")), str(metadata.get("term"))])
+
+    return "text/" + content_hash(content or "")
+
+
+def content_hash(text: str) -> str:
+    """Hash of a document's text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
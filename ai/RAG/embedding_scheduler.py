@@ -0,0 +1,122 @@
+"""
+Micro-batching embedder.
+
+Concurrent `embed_query` calls are queued and a single worker thread embeds
+everything that arrives within a short window (or until the batch is full) in
+one `embed_documents` call, then hands each caller its own vector. Under load
+this turns many batch-size-1 transformer passes into a few larger ones.
+
+The wrapped model must embed queries and documents the same way (true for
+HuggingFaceEmbeddings without a query instruction).
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from serving.metrics import BATCH_SIZE_BUCKETS, Histogram
+
+
+class _PendingQuery:
+    __slots__ = ("text", "enqueued", "future")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.enqueued = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatchEmbedder(Embeddings):
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        self.embeddings = embeddings
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker_pid = None  # worker is (re)started lazily, also after a fork
+
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram()
+        self.embed_ms = Histogram()
+
+    # --- Embeddings interface ---
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        pending = _PendingQuery(text)
+        self._ensure_worker().put(pending)
+        return pending.future.result()
+
+    # --- Worker ---
+    def _ensure_worker(self) -> queue.Queue:
+        pid = os.getpid()
+        if self._worker_pid != pid:
+            with self._lock:
+                if self._worker_pid != pid:
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="embed-batcher", daemon=True).start()
+                    self._worker_pid = pid
+        return self._queue
+
+    def _collect(self, pending_queue: queue.Queue) -> List[_PendingQuery]:
+        batch = [pending_queue.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(pending_queue.get(timeout=remaining))
+                else:
+                    batch.append(pending_queue.get_nowait())  # take whatever is already queued
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, pending_queue: queue.Queue):
+        while True:
+            batch = self._collect(pending_queue)
+
+            started = time.perf_counter()
+            for pending in batch:
+                self.queue_wait_ms.observe((started - pending.enqueued) * 1000)
+            self.batch_sizes.observe(len(batch))
+
+            try:
+                vectors = self.embeddings.embed_documents([p.text for p in batch])
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            finally:
+                self.embed_ms.observe((time.perf_counter() - started) * 1000)
+
+            for pending, vector in zip(batch, vectors):
+                pending.future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "embed_ms": self.embed_ms.snapshot(),
+        }
+
+
+def make_query_embedder(embeddings: Embeddings, micro_batch_config: Optional[dict]) -> Embeddings:
+    """Wrap `embeddings` in a MicroBatchEmbedder unless disabled in settings.yaml"""
+    micro_batch_config = micro_batch_config or {}
+    if not micro_batch_config.get("enabled", True):
+        return embeddings
+    return MicroBatchEmbedder(
+        embeddings,
+        max_batch_size=micro_batch_config.get("max_batch_size", 32),
+        max_wait_ms=micro_batch_config.get("max_wait_ms", 2.0),
+    )
@@ -0,0 +1,416 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Maps (model name, model revision, text hash) to a float32 vector in a SQLite
+table next to params.db, shared by index builds and the API servers:
+- index builds go through CachedEmbeddings, so a document is embedded once
+  per model version however often the index is rebuilt;
+- the API servers go through ServingEmbeddingCache: a read-only lookup when a
+  query misses the in-process cache (on the worker pool, never the event loop),
+  with new vectors, last_used updates and hit counts written behind by a
+  background thread in one transaction every few seconds. No request writes.
+
+Usage:
+    python RAG/embedding_store.py stats
+    python RAG/embedding_store.py prune --keep-current
+    python RAG/embedding_store.py prune --max-rows 100000
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, db_path, max_rows: Optional[int] = 200000):
+        self.db_path = str(db_path)
+        self.max_rows = max_rows
+        self._puts_since_trim = 0
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                revision TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, revision, text_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+
+            CREATE TABLE IF NOT EXISTS lookup_stats (
+                model TEXT NOT NULL,
+                revision TEXT NOT NULL,
+                hits INTEGER DEFAULT 0,
+                misses INTEGER DEFAULT 0,
+                PRIMARY KEY (model, revision)
+            );
+        """)
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10.0)
+
+    # ----------------------
+    # Lookups
+    # ----------------------
+    def get_many(self, model: str, revision: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Return the stored vectors for `hashes` (missing ones are left out)"""
+        found = {}
+        if not hashes:
+            return found
+
+        conn = self._connect()
+        try:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):  # stay under SQLite's variable limit
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND revision = ? AND text_hash IN ({placeholders})",
+                    (model, revision, *chunk),
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+
+            now = time.time()
+            if found:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND revision = ? AND text_hash = ?",
+                    [(now, model, revision, h) for h in found],
+                )
+            hits = sum(1 for h in hashes if h in found)
+            conn.execute("""
+                INSERT INTO lookup_stats (model, revision, hits, misses) VALUES (?, ?, ?, ?)
+                ON CONFLICT(model, revision) DO UPDATE SET hits = hits + excluded.hits,
+                                                           misses = misses + excluded.misses
+            """, (model, revision, hits, len(hashes) - hits))
+            conn.commit()
+        finally:
+            conn.close()
+        return found
+
+    def lookup(self, model: str, revision: str, h: str, conn: sqlite3.Connection) -> Optional[np.ndarray]:
+        """Read-only lookup of one vector on the caller's connection (no last_used/stats writes)"""
+        row = conn.execute(
+            "SELECT vector FROM embeddings WHERE model = ? AND revision = ? AND text_hash = ?",
+            (model, revision, h),
+        ).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row is not None else None
+
+    @staticmethod
+    def _vector_rows(model: str, revision: str, items: Iterable[Tuple[str, Sequence[float]]], now: float):
+        rows = []
+        for h, vector in items:
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((model, revision, h, int(vector.shape[0]), vector.tobytes(), now, now))
+        return rows
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, rows: List[tuple]):
+        conn.executemany("""
+            INSERT INTO embeddings (model, revision, text_hash, dim, vector, created, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(model, revision, text_hash) DO UPDATE SET vector = excluded.vector,
+                                                                  last_used = excluded.last_used
+        """, rows)
+
+    def _count_puts(self, n: int):
+        self._puts_since_trim += n
+        if self.max_rows and self._puts_since_trim >= 256:
+            self._puts_since_trim = 0
+            self.evict(self.max_rows)
+
+    def put_many(self, model: str, revision: str, items: Iterable[Tuple[str, Sequence[float]]]):
+        rows = self._vector_rows(model, revision, items, time.time())
+        if not rows:
+            return
+
+        conn = self._connect()
+        try:
+            self._insert(conn, rows)
+            conn.commit()
+        finally:
+            conn.close()
+        self._count_puts(len(rows))
+
+    def write_batch(self, model: str, revision: str, items: Iterable[Tuple[str, Sequence[float]]],
+                    touched: Iterable[str] = (), hits: int = 0, misses: int = 0):
+        """New vectors, last_used updates and lookup counts in one transaction (write-behind)"""
+        now = time.time()
+        rows = self._vector_rows(model, revision, items, now)
+        conn = self._connect()
+        try:
+            self._insert(conn, rows)
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND revision = ? AND text_hash = ?",
+                [(now, model, revision, h) for h in touched],
+            )
+            if hits or misses:
+                conn.execute("""
+                    INSERT INTO lookup_stats (model, revision, hits, misses) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(model, revision) DO UPDATE SET hits = hits + excluded.hits,
+                                                               misses = misses + excluded.misses
+                """, (model, revision, hits, misses))
+            conn.commit()
+        finally:
+            conn.close()
+        self._count_puts(len(rows))
+
+    # ----------------------
+    # Maintenance
+    # ----------------------
+    def evict(self, max_rows: int) -> int:
+        """Drop least recently used rows beyond `max_rows`"""
+        conn = self._connect()
+        try:
+            cur = conn.execute("""
+                DELETE FROM embeddings WHERE rowid IN (
+                    SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (max_rows,))
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def prune(self, keep: Sequence[Tuple[str, str]]) -> int:
+        """Delete every (model, revision) not listed in `keep`"""
+        conn = self._connect()
+        try:
+            versions = conn.execute("SELECT DISTINCT model, revision FROM embeddings").fetchall()
+            deleted = 0
+            for model, revision in versions:
+                if (model, revision) in keep:
+                    continue
+                cur = conn.execute("DELETE FROM embeddings WHERE model = ? AND revision = ?", (model, revision))
+                conn.execute("DELETE FROM lookup_stats WHERE model = ? AND revision = ?", (model, revision))
+                deleted += cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        conn = self._connect()
+        conn.execute("VACUUM")
+        conn.close()
+        return deleted
+
+    def stats(self) -> List[dict]:
+        conn = self._connect()
+        try:
+            sizes = {
+                (model, revision): (rows, nbytes)
+                for model, revision, rows, nbytes in conn.execute(
+                    "SELECT model, revision, COUNT(*), SUM(LENGTH(vector)) FROM embeddings GROUP BY model, revision"
+                )
+            }
+            lookups = {
+                (model, revision): (hits, misses)
+                for model, revision, hits, misses in conn.execute(
+                    "SELECT model, revision, hits, misses FROM lookup_stats"
+                )
+            }
+        finally:
+            conn.close()
+
+        report = []
+        for model, revision in sorted(set(sizes) | set(lookups)):
+            rows, nbytes = sizes.get((model, revision), (0, 0))
+            hits, misses = lookups.get((model, revision), (0, 0))
+            report.append({
+                "model": model,
+                "revision": revision,
+                "rows": rows,
+                "bytes": nbytes or 0,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            })
+        return report
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that consults an EmbeddingStore before calling the model"""
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, model_name: str, revision: str = "main"):
+        self.embeddings = embeddings
+        self.store = store
+        self.model_name = model_name
+        self.revision = revision or "main"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        found = self.store.get_many(self.model_name, self.revision, hashes)
+
+        missing = [i for i, h in enumerate(hashes) if h not in found]
+        if missing:
+            # Embed each distinct missing text once, in a single call
+            first_index = {}
+            for i in missing:
+                first_index.setdefault(hashes[i], i)
+            vectors = self.embeddings.embed_documents([texts[i] for i in first_index.values()])
+            new = dict(zip(first_index.keys(), vectors))
+            self.store.put_many(self.model_name, self.revision, new.items())
+            found.update({h: np.asarray(v, dtype=np.float32) for h, v in new.items()})
+
+        return [found[h].tolist() for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class ServingEmbeddingCache:
+    """
+    The API servers' view of an EmbeddingStore for one model version.
+
+    get() is a read-only SELECT on a per-thread connection; put() only queues
+    the vector. A background thread writes queued vectors, last_used updates
+    and hit/miss counts every `flush_s` seconds in one transaction, so no
+    request ever writes or waits for SQLite's write lock. Texts are the
+    callers' cache keys (normalized queries). When flushing falls behind,
+    new vectors beyond `max_pending` are dropped rather than queued.
+    """
+
+    def __init__(self, store: EmbeddingStore, model_name: str, revision: str = "main",
+                 flush_s: float = 5.0, max_pending: int = 4096):
+        self.store = store
+        self.model_name = model_name
+        self.revision = revision or "main"
+        self.flush_s = float(flush_s)
+        self.max_pending = int(max_pending)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, np.ndarray] = {}  # text hash -> vector not written yet
+        self._touched = set()
+        self._unflushed_hits = 0
+        self._unflushed_misses = 0
+        self._local = threading.local()
+        self._flusher_pid = None  # flusher is (re)started lazily, also after a fork
+        atexit.register(self.flush)
+
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():  # connections must not cross a fork
+            local.conn = self.store._connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        h = text_hash(text)
+        with self._lock:
+            vector = self._pending.get(h)
+        if vector is None:
+            vector = self.store.lookup(self.model_name, self.revision, h, self._connection())
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                self._unflushed_misses += 1
+            else:
+                self.hits += 1
+                self._unflushed_hits += 1
+                self._touched.add(h)
+        self._ensure_flusher()
+        return vector
+
+    def put(self, text: str, vector: Sequence[float]):
+        h = text_hash(text)
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending[h] = np.asarray(vector, dtype=np.float32)
+        self._ensure_flusher()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched - pending.keys(), set()
+            hits, misses = self._unflushed_hits, self._unflushed_misses
+            self._unflushed_hits = self._unflushed_misses = 0
+        if not (pending or touched or hits or misses):
+            return
+        self.store.write_batch(self.model_name, self.revision, pending.items(), touched, hits, misses)
+        self.flushes += 1
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._flusher_pid != pid:
+            with self._lock:
+                if self._flusher_pid != pid:
+                    threading.Thread(target=self._run, name="embedding-flush", daemon=True).start()
+                    self._flusher_pid = pid
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_s)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"⚠️  Embedding cache flush failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+        }
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Inspect and maintain the persistent embedding cache")
+    parser.add_argument("--config", default="config/settings.yaml")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="rows, size and hit rate per model version")
+    prune_parser = sub.add_parser("prune", help="remove stale model versions or old rows")
+    prune_parser.add_argument("--keep-current", action="store_true",
+                              help="delete every model/revision except the one in settings.yaml")
+    prune_parser.add_argument("--max-rows", type=int, help="keep only the most recently used rows")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    store = EmbeddingStore(config["paths"]["embedding_store"])
+
+    if args.command == "stats":
+        for entry in store.stats() or [{"model": "(empty)"}]:
+            print(entry)
+    else:
+        if args.keep_current:
+            sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from RAG.embeddings import cache_revision
+
+            current = (config["retrieval"]["embedding_model"], cache_revision(config["retrieval"]))
+            print(f"Deleted {store.prune([current])} rows from stale model versions (kept {current[0]}@{current[1]})")
+        if args.max_rows is not None:
+            print(f"Evicted {store.evict(args.max_rows)} least recently used rows")
@@ -0,0 +1,77 @@
+"""
+Embedding model factory shared by the index build and the serving paths.
+
+`retrieval.backend` selects how the model runs: "torch" (HuggingFaceEmbeddings)
+or "onnx" (ONNX Runtime, optionally int8-quantized; see RAG/onnx_embeddings.py).
+"""
+
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+from RAG.embedding_store import CachedEmbeddings, EmbeddingStore, ServingEmbeddingCache
+
+
+def cache_revision(retrieval: dict) -> str:
+    """Revision under which vectors are cached: torch, ONNX and int8 ONNX vectors are kept apart"""
+    revision = retrieval.get("embedding_revision") or "main"
+    if retrieval.get("backend", "torch") == "onnx":
+        quantize = (retrieval.get("onnx") or {}).get("quantize", True)
+        return f"{revision}+{'onnx-int8' if quantize else 'onnx'}"
+    return revision
+
+
+def load_embeddings(config: dict, device: str, threads: Optional[int] = None,
+                    persistent_cache: bool = False) -> Embeddings:
+    """
+    Load the embedding model from settings.yaml.
+    `threads` sets the ONNX Runtime intra-op threads unless they are configured.
+
+    `persistent_cache` backs the model with the on-disk embedding cache (unless
+    `retrieval.embedding_cache.enabled` is false), read and written on every
+    call. Index builds use it; the API servers use serving_embedding_cache(),
+    which never writes on the request path.
+    """
+    retrieval = config["retrieval"]
+    model_name = retrieval["embedding_model"]
+    revision = retrieval.get("embedding_revision") or "main"
+
+    if retrieval.get("backend", "torch") == "onnx":
+        from RAG.onnx_embeddings import OnnxEmbeddings
+
+        embeddings = OnnxEmbeddings.from_config(config, threads=threads)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": device, "revision": revision}
+        )
+
+    store = _embedding_store(config) if persistent_cache else None
+    if store is not None:
+        embeddings = CachedEmbeddings(embeddings, store, model_name, cache_revision(retrieval))
+    return embeddings
+
+
+def _embedding_store(config: dict) -> Optional[EmbeddingStore]:
+    cache_config = config["retrieval"].get("embedding_cache") or {}
+    store_path = config["paths"].get("embedding_store")
+    if not store_path or not cache_config.get("enabled", True):
+        return None
+    return EmbeddingStore(store_path, max_rows=cache_config.get("max_rows", 200000))
+
+
+def serving_embedding_cache(config: dict) -> Optional[ServingEmbeddingCache]:
+    """
+    The persistent embedding cache as the API servers use it: read-only lookups,
+    written behind every `retrieval.embedding_cache.flush_s` seconds.
+    None when the cache is disabled (or `serving: false`).
+    """
+    retrieval = config["retrieval"]
+    cache_config = retrieval.get("embedding_cache") or {}
+    store = _embedding_store(config) if cache_config.get("serving", True) else None
+    if store is None:
+        return None
+    return ServingEmbeddingCache(store, retrieval["embedding_model"], cache_revision(retrieval),
+                                 flush_s=cache_config.get("flush_s", 5.0))
@@ -0,0 +1,103 @@
+"""
+FAISS index types for the artifact (`retrieval.index` in settings.yaml).
+
+    flat      exact search over every vector (the default)
+    hnsw      graph index; efSearch trades recall for latency
+    ivf_flat  k-means partitions, nprobe of them scanned per query
+    ivf_pq    IVF over product-quantized codes: m bytes per vector (nbits=8)
+
+`storage: float16` keeps the flat, hnsw and ivf_flat codes (and vectors.npy)
+as half floats, halving memory with a negligible change in distances.
+ivf_pq always stores PQ codes. All types use L2, like the exact index, so
+scores stay on the scale the routing thresholds expect.
+
+Corpora too small to train the configured index (fewer vectors than IVF
+lists, or than PQ centroids) get an exact index with the same storage.
+"""
+
+import math
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+STORAGE_TYPES = ("float32", "float16")
+
+
+def default_nlist(count: int) -> int:
+    """About 4 * sqrt(n) IVF lists, with at least 39 training points per list"""
+    return max(1, min(int(4 * math.sqrt(max(count, 1))), count // 39))
+
+
+def index_spec(dim: int, count: int, settings: Optional[dict] = None) -> Dict:
+    """
+    Resolve `settings` (retrieval.index) for `count` vectors of `dim` into a
+    spec: type, index_factory string, storage and search-time parameters.
+    """
+    settings = settings or {}
+    index_type = settings.get("type", "flat")
+    storage = settings.get("storage", "float32")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r} (expected one of {', '.join(INDEX_TYPES)})")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown index storage {storage!r} (expected one of {', '.join(STORAGE_TYPES)})")
+
+    hnsw = settings.get("hnsw") or {}
+    ivf = settings.get("ivf") or {}
+    pq = settings.get("pq") or {}
+    codes = "SQfp16" if storage == "float16" else "Flat"
+    nlist = ivf.get("nlist") or default_nlist(count)
+    spec = {"type": index_type, "storage": storage}
+
+    if index_type == "ivf_pq":
+        m, nbits = pq.get("m", 16), pq.get("nbits", 8)
+        if dim % m:
+            raise ValueError(f"pq.m={m} must divide the embedding dimension {dim}")
+        spec["storage"] = f"pq{m}x{nbits}"
+        if count < max(nlist, 2 ** nbits):
+            print(f"⚠️  {count} vectors are too few to train ivf_pq (nlist={nlist}, {2 ** nbits} PQ centroids); using flat")
+            return {"type": "flat", "storage": storage, "factory": codes}
+        spec.update(factory=f"IVF{nlist},PQ{m}x{nbits}", nlist=nlist, nprobe=ivf.get("nprobe", 8))
+    elif index_type == "ivf_flat":
+        if count < nlist or nlist < 2:
+            print(f"⚠️  {count} vectors are too few to train ivf_flat (nlist={nlist}); using flat")
+            return {"type": "flat", "storage": storage, "factory": codes}
+        spec.update(factory=f"IVF{nlist},{codes}", nlist=nlist, nprobe=ivf.get("nprobe", 8))
+    elif index_type == "hnsw":
+        m = hnsw.get("m", 32)
+        spec.update(factory=f"HNSW{m}" + (",SQfp16" if storage == "float16" else ""),
+                    ef_construction=hnsw.get("ef_construction", 200), ef_search=hnsw.get("ef_search", 64))
+    else:
+        spec["factory"] = codes
+    return spec
+
+
+def build_index(vectors: np.ndarray, spec: Dict):
+    """Create, train and fill the index described by `spec` (see index_spec)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], spec["factory"], faiss.METRIC_L2)
+    if spec.get("ef_construction"):
+        faiss.downcast_index(index).hnsw.efConstruction = spec["ef_construction"]
+    if len(vectors):
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+    set_search_params(index, nprobe=spec.get("nprobe"), ef_search=spec.get("ef_search"))
+    return index
+
+
+def set_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Apply search-time knobs; parameters the index type doesn't have are ignored"""
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, int(value))
+        except RuntimeError:
+            pass
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).size)
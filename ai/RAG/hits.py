@@ -0,0 +1,85 @@
+"""
+Compact retrieval results.
+
+DocView is one indexed document plus the display fields the API renders
+(title line, explanation, source label, context line, debug descriptor).
+They are derived once per document, stored in the artifact at build time or
+computed when a legacy store is loaded, instead of re-splitting page_content
+for every hit of every request. DocViews are shared by every hit on the same
+document; SearchHit only adds the score.
+"""
+
+from typing import Any, Dict, Optional
+
+
+def display_fields(content: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Display fields for one document, by section (generic term or input/output parameter)"""
+    section = metadata.get("section", "unknown")
+    if section == "generic":
+        term = metadata.get("term", "Unknown")
+        return {
+            "name": term,
+            "title": term,
+            "explanation": content,
+            "summary": content,
+            "label": f"Generic concept: {term}",
+            "context": f"**{term}**: {content}",
+            "describe": {"document": term, "category": "Generic Concept", "source": metadata.get("package", "Generic")},
+        }
+    if section in ("input", "output"):
+        param = metadata.get("param", "Unknown")
+        function = metadata.get("function", "Unknown")
+        package = metadata.get("package", "Unknown")
+        lines = content.split("\n")
+        return {
+            "name": param,
+            "title": lines[0],
+            "explanation": "\n".join(lines[1:]) if len(lines) > 1 else content,
+            "summary": lines[1] if len(lines) > 1 else lines[0],
+            "label": f"{package}.{function}.{param}",
+            "context": f"**{param}** (from {function}): {content}",
+            "describe": {
+                "document": param,
+                "category": f"{section.title()} Parameter",
+                "function": function,
+                "package": package,
+                "source": f"{package}.{function}",
+            },
+        }
+    return {"name": None, "title": None, "explanation": content, "summary": "", "label": None,
+            "context": "", "describe": {}}
+
+
+class DocView:
+    __slots__ = ("row", "doc_id", "section", "content", "metadata",
+                 "name", "title", "explanation", "summary", "label", "context", "describe")
+
+    def __init__(self, row: int, doc_id: str, content: str, metadata: Dict[str, Any],
+                 display: Optional[Dict[str, Any]] = None):
+        self.row = row
+        self.doc_id = doc_id
+        self.section = metadata.get("section", "unknown")
+        self.content = content
+        self.metadata = metadata
+        display = display or display_fields(content, metadata)
+        self.name = display["name"]
+        self.title = display["title"]
+        self.explanation = display["explanation"]
+        self.summary = display["summary"]
+        self.label = display["label"]
+        self.context = display["context"]
+        self.describe = display["describe"]
+
+    def __repr__(self):
+        return f"DocView({self.row}, {self.doc_id!r})"
+
+
+class SearchHit:
+    __slots__ = ("doc", "score")
+
+    def __init__(self, doc: DocView, score: float):
+        self.doc = doc
+        self.score = score
+
+    def __repr__(self):
+        return f"SearchHit({self.doc.doc_id!r}, {self.score:.3f})"
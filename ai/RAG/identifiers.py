@@ -0,0 +1,129 @@
+"""
+Exact-identifier lookup for parameter, output and term names.
+
+Many questions are literally "what is effect_size" or "explain Synthetic
+Control". IdentifierIndex maps every name in params.db (inputs, outputs,
+generic terms and function names), plus simple aliases ("effect size",
+"effectsize", "EffectSize"), to the ids of the documents built from them. A
+KeywordMatcher finds all names in a query in one regex pass, so such
+questions can be answered from the matched document without embedding,
+searching or calling an LLM.
+"""
+
+import re
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from RAG.documents import document_id
+
+_SEPARATORS = re.compile(r"[\s_\-]+")
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Words that may surround a name in a question that is only about that name
+FILLER_WORDS = frozenset("""
+what whats what's is are was does do did mean means meaning of the a an explain define definition describe
+tell me about parameter param argument arg term concept output input in for please how i should to set
+use used choose pick value values can you by
+""".split())
+
+
+class KeywordMatcher:
+    """
+    Single-pass multi-pattern matcher: one compiled alternation, longest pattern first.
+
+    With `whole_words` a pattern only matches between non-alphanumeric
+    characters; otherwise it matches anywhere, like `pattern in text`.
+    """
+
+    def __init__(self, patterns: Iterable[str], whole_words: bool = False):
+        self.patterns = sorted({p for p in patterns if p}, key=len, reverse=True)
+        body = "|".join(map(re.escape, self.patterns)) or r"(?!)"
+        if whole_words:
+            body = rf"(?<![a-z0-9])(?:{body})(?![a-z0-9])"
+        self._regex = re.compile(body)
+
+    def search(self, text: str) -> bool:
+        return self._regex.search(text) is not None
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping (start, end, pattern) matches, left to right"""
+        return [(m.start(), m.end(), m.group()) for m in self._regex.finditer(text)]
+
+
+def normalize_identifier(text: str) -> str:
+    return _SEPARATORS.sub(" ", text.lower()).strip()
+
+
+def identifier_aliases(name: str) -> set:
+    """`lookback_window` -> {"lookback window", "lookbackwindow"}; `EffectSize` -> {"effectsize", "effect size"}"""
+    spaced = normalize_identifier(_CAMEL.sub(r"\1 \2", name))
+    return {alias for alias in (normalize_identifier(name), spaced, spaced.replace(" ", "")) if alias}
+
+
+class IdentifierMatch(NamedTuple):
+    name: str                 # the identifier as written in params.db
+    doc_ids: List[str]        # documents for that name, preferred one first
+
+
+class IdentifierIndex:
+    def __init__(self, names: Dict[str, List[Tuple[str, str, Optional[str]]]], functions: Dict[str, str]):
+        # alias -> [(name, doc_id, function)], alias -> function name
+        self.names = names
+        self.functions = functions
+        self.matcher = KeywordMatcher(list(names) + list(functions), whole_words=True)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_db(cls, db_path) -> "IdentifierIndex":
+        conn = sqlite3.connect(db_path)
+        try:
+            entries = []
+            for section, table in (("input", "inputs"), ("output", "outputs")):
+                for function, package, param in conn.execute(f"""
+                    SELECT f.function_name, f.package_name, t.param_name
+                    FROM {table} t JOIN functions f ON t.function_id = f.function_id
+                    WHERE COALESCE(t.omit, 0) = 0
+                """):
+                    metadata = {"section": section, "package": package, "function": function, "param": param}
+                    entries.append((param, document_id(metadata), function))
+            for term, package in conn.execute("SELECT term_name, package_name FROM generic_terms"):
+                entries.append((term, document_id({"section": "generic", "package": package, "term": term}), None))
+            function_names = [row[0] for row in conn.execute("SELECT DISTINCT function_name FROM functions")]
+        finally:
+            conn.close()
+
+        names: Dict[str, List[Tuple[str, str, Optional[str]]]] = {}
+        for name, doc_id, function in entries:
+            for alias in identifier_aliases(name):
+                names.setdefault(alias, []).append((name, doc_id, function))
+        functions = {alias: function for function in function_names for alias in identifier_aliases(function)}
+        return cls(names, functions)
+
+    def match(self, query: str) -> Optional[IdentifierMatch]:
+        """
+        The identifier a query is solely about, or None.
+
+        Matches when the query names exactly one parameter/term (optionally
+        qualified by a function name, e.g. "lookback_window in GeoLiftPower")
+        and every other word is a question filler word.
+        """
+        text = normalize_identifier(query)
+        found = self.matcher.find_all(text)
+        names = [alias for _, _, alias in found if alias in self.names]
+        if not names or len({self.names[alias][0][0].lower() for alias in names}) != 1:
+            return None
+
+        residual = text
+        for start, end, _ in reversed(found):
+            residual = residual[:start] + " " + residual[end:]
+        if any(word not in FILLER_WORDS for word in _WORD.findall(residual)):
+            return None
+
+        candidates = self.names[names[0]]
+        qualifiers = {self.functions[alias] for _, _, alias in found if alias in self.functions}
+        preferred = [c for c in candidates if c[2] in qualifiers]
+        ordered = preferred + [c for c in candidates if c not in preferred]
+        return IdentifierMatch(candidates[0][0], list(dict.fromkeys(doc_id for _, doc_id, _ in ordered)))
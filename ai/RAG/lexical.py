@@ -0,0 +1,135 @@
+"""
+BM25 inverted index over the same documents as the FAISS index.
+
+Exact parameter names (`lookback_window`, `Y_id`, `cpic`) are matched
+reliably by terms where dense embeddings rank them inconsistently, and a
+lexical lookup needs no embedding model at all. The index is written next to
+the vectors at build time (`lexical.npz`) as flat posting arrays:
+
+    terms    sorted vocabulary
+    offsets  postings of terms[i] are rows/tfs[offsets[i]:offsets[i + 1]]
+    rows     document row (same numbering as vectors.npy / docs.sqlite)
+    tfs      term frequency in that row
+    doc_len  tokens per document
+
+Dense and lexical rankings are combined with reciprocal-rank fusion (rrf).
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:_[a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by can could do does for from how i if in is it its me my of on or our should
+the their this to was we what when where which who why will with would you your explain tell about
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; snake_case identifiers are kept whole and also split into their parts"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if "_" in token:
+            tokens.append(token)
+            tokens.extend(part for part in token.split("_") if part and part not in STOPWORDS)
+        elif token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def document_text(content: str, metadata: Dict) -> str:
+    """Text indexed for a document: its content plus the identifiers it belongs to"""
+    names = [metadata.get(field) for field in ("param", "term", "function")]
+    return " ".join([content, *(name for name in names if name)])
+
+
+def lexical_distance(score: float) -> float:
+    """
+    Map a BM25 score onto the L2-distance scale the routing thresholds use
+    (lower is better): strong multi-term matches land below 0.5, single weak
+    term matches around 1 and above.
+    """
+    return 2.0 / (1.0 + score)
+
+
+def rrf(rankings: Iterable[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Reciprocal-rank fusion of several best-first row rankings"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, rows: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_len = doc_len.astype(np.float32)
+        self.k1 = float(k1)
+        self.b = float(b)
+
+        n_docs = len(doc_len)
+        doc_freq = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avgdl = float(self.doc_len.mean()) if n_docs else 1.0
+        # Per-document length normalization, precomputed once
+        self.norm = self.k1 * (1.0 - self.b + self.b * self.doc_len / max(avgdl, 1e-6))
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        counts = [Counter(tokenize(text)) for text in texts]
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for row, counter in enumerate(counts):
+            for term, tf in counter.items():
+                postings.setdefault(term, []).append((row, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows, tfs = [], []
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            offsets[i + 1] = offsets[i] + len(entries)
+            rows.extend(row for row, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+        doc_len = np.asarray([sum(counter.values()) for counter in counts], dtype=np.int32)
+        return cls(terms, offsets, np.asarray(rows, dtype=np.int32), np.asarray(tfs, dtype=np.float32),
+                   doc_len, k1, b)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, terms=np.asarray(sorted(self.terms, key=self.terms.get), dtype=str),
+                     offsets=self.offsets, rows=self.rows, tfs=self.tfs, doc_len=self.doc_len,
+                     params=np.asarray([self.k1, self.b], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"].tolist()
+            return cls(data["terms"].tolist(), data["offsets"], data["rows"], data["tfs"], data["doc_len"], k1, b)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (row, BM25 score), best first; rows without any query term are left out"""
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            rows, tf = self.rows[start:end], self.tfs[start:end]
+            scores[rows] += self.idf[t] * tf * (self.k1 + 1.0) / (tf + self.norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(row), float(scores[row])) for row in matched]
@@ -0,0 +1,171 @@
+"""
+ONNX Runtime embedding backend for CPU-only nodes.
+
+The Hugging Face model is exported to ONNX once (torch is only needed for
+the export), optionally quantized to dynamic int8, and cached under
+`retrieval.onnx.path`. Serving then runs it with ONNX Runtime: no torch
+import, a fixed number of intra-op threads, and BGE-style CLS pooling with
+L2 normalization (the same output as the sentence-transformers model).
+
+    RAG/onnx_models/<model>@<revision>/model.onnx        fp32 export
+    RAG/onnx_models/<model>@<revision>/model.int8.onnx   dynamic int8 weights
+    RAG/onnx_models/<model>@<revision>/tokenizer*        tokenizer files
+
+Usage (from ai/):
+    python -m RAG.onnx_embeddings export            # export (and quantize) the model in settings.yaml
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+
+def model_dir(root, model_name: str, revision: str = "main") -> Path:
+    return Path(root) / f"{model_name.replace('/', '--')}@{revision}"
+
+
+def export_onnx(model_name: str, output_dir, revision: str = "main", quantize: bool = True,
+                opset: int = 17) -> Path:
+    """Export `model_name` to ONNX (and int8) in `output_dir`; returns the model file to load"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    fp32_path = output_dir / FP32_FILE
+
+    if not fp32_path.exists():
+        print(f"📦 Exporting {model_name}@{revision} to ONNX")
+        tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+        model = AutoModel.from_pretrained(model_name, revision=revision).eval()
+        sample = tokenizer(["warm up export"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic = {0: "batch", 1: "sequence"}
+
+        class Encoder(torch.nn.Module):
+            # Fixed positional inputs; the model's own forward signature varies across transformers versions
+            def __init__(self):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+        with torch.no_grad():
+            torch.onnx.export(
+                Encoder(),
+                tuple(sample[name] for name in input_names),
+                str(fp32_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={name: dynamic for name in input_names + ["last_hidden_state"]},
+                opset_version=opset,
+                dynamo=False,
+            )
+        tokenizer.save_pretrained(str(output_dir))
+
+    if not quantize:
+        return fp32_path
+
+    int8_path = output_dir / INT8_FILE
+    if not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("📦 Quantizing ONNX weights to int8")
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings interface over an exported ONNX encoder (CLS pooling, L2-normalized)"""
+
+    def __init__(self, model_path, tokenizer_dir=None, threads: Optional[int] = None,
+                 batch_size: int = 32, max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = Path(model_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_dir or model_path.parent))
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    @classmethod
+    def from_config(cls, config: dict, threads: Optional[int] = None) -> "OnnxEmbeddings":
+        """Load (exporting on first use) the model named in settings.yaml"""
+        retrieval = config["retrieval"]
+        onnx_config = retrieval.get("onnx") or {}
+        revision = retrieval.get("embedding_revision") or "main"
+        quantize = onnx_config.get("quantize", True)
+        directory = model_dir(onnx_config.get("path", "RAG/onnx_models"), retrieval["embedding_model"], revision)
+
+        model_path = directory / (INT8_FILE if quantize else FP32_FILE)
+        if not model_path.exists():
+            model_path = export_onnx(retrieval["embedding_model"], directory, revision, quantize)
+        return cls(model_path, directory, threads=onnx_config.get("intra_op_threads") or threads,
+                   batch_size=onnx_config.get("batch_size", 32))
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                 return_tensors="np")
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+        if "token_type_ids" in self.input_names and "token_type_ids" not in feed:
+            feed["token_type_ids"] = np.zeros_like(feed["input_ids"])
+        hidden = self.session.run(None, feed)[0]
+        cls = hidden[:, 0]
+        return cls / np.maximum(np.linalg.norm(cls, axis=1, keepdims=True), 1e-12)
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32; texts are batched by length to keep padding small"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            vectors = self._encode([texts[i] for i in batch])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[batch] = vectors
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--no-quantize", action="store_true", help="fp32 export only")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    retrieval = config["retrieval"]
+    onnx_config = retrieval.get("onnx") or {}
+    revision = retrieval.get("embedding_revision") or "main"
+    directory = model_dir(onnx_config.get("path", "RAG/onnx_models"), retrieval["embedding_model"], revision)
+    path = export_onnx(retrieval["embedding_model"], directory, revision,
+                       quantize=onnx_config.get("quantize", True) and not args.no_quantize)
+    print(f"✅ {path} ({path.stat().st_size / 1e6:.1f} MB)")
@@ -0,0 +1,127 @@
+"""
+Qwen yes/no reranker.
+
+Each (query, document) pair is scored by the probability that the causal LM
+answers "yes" after `<Instruct> ... <Query> ... <Document> ...`. All pairs of a
+request share the instruction + query prefix, so the prefix is run through the
+model once and its KV cache is reused for every document. Documents are then
+scored in batches of similar token length, right-padded, so little work goes
+into padding, and only the "yes"/"no" logits are computed instead of the full
+vocabulary at every position.
+"""
+
+import copy
+from typing import List, Optional, Sequence
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+DEFAULT_INSTRUCTION = "Given a web search query, retrieve relevant passages that answer the query"
+
+
+def format_pair(query: str, doc: str, instruction: Optional[str] = None) -> str:
+    """The full reranker input for one pair (prefix + document)"""
+    return f"<Instruct>: {instruction or DEFAULT_INSTRUCTION}\n<Query>: {query}\n<Document>: {doc}"
+
+
+def _repeat_cache(cache, n: int):
+    """
+    A copy of a single-row KV cache repeated to `n` rows.
+
+    Cache objects are updated in place by every forward pass, so each batch
+    needs its own copy of the prefix cache.
+    """
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache = copy.deepcopy(cache)
+        cache.batch_repeat_interleave(n)
+        return cache
+    return tuple(tuple(t.repeat_interleave(n, dim=0) for t in layer) for layer in cache)  # legacy tuples
+
+
+class QwenReranker:
+    def __init__(self, model_name: str, batch_size: int = 8, max_length: int = 1024, revision: str = "main",
+                 model=None, tokenizer=None):
+        self.model_name = model_name
+        self.revision = revision or "main"
+        self.tokenizer = tokenizer or AutoTokenizer.from_pretrained(
+            model_name, revision=self.revision, padding_side="left"
+        )
+        self.model = model or AutoModelForCausalLM.from_pretrained(
+            model_name, revision=self.revision, device_map="auto"
+        ).eval()
+        self.batch_size = max(1, int(batch_size))
+        self.max_length = max_length
+
+        self.token_false_id = self.tokenizer.convert_tokens_to_ids("no")
+        self.token_true_id = self.tokenizer.convert_tokens_to_ids("yes")
+        pad_id = self.tokenizer.pad_token_id
+        self.pad_id = pad_id if pad_id is not None else (self.tokenizer.eos_token_id or 0)
+
+        # Output-embedding rows for "no" and "yes": the only logits that are needed
+        head = self.model.get_output_embeddings()
+        ids = [self.token_false_id, self.token_true_id]
+        self._head_weight = head.weight[ids]
+        self._head_bias = head.bias[ids] if getattr(head, "bias", None) is not None else None
+
+    @property
+    def tag(self) -> str:
+        """Identifies the scoring model in cache keys"""
+        return f"{self.model_name}@{self.revision}"
+
+    def _yes_probability(self, hidden: torch.Tensor) -> List[float]:
+        logits = hidden @ self._head_weight.T
+        if self._head_bias is not None:
+            logits = logits + self._head_bias
+        return torch.nn.functional.log_softmax(logits.float(), dim=1)[:, 1].exp().tolist()
+
+    def score(self, query: str, docs: Sequence[str], instruction: Optional[str] = None,
+              max_length: Optional[int] = None) -> List[float]:
+        """Probability of "yes" for each document, in the order given"""
+        if not docs:
+            return []
+        max_length = max_length or self.max_length
+        device = self.model.device
+
+        # The document part starts with the separating space so token boundaries
+        # match tokenizing the whole pair at once
+        prefix = format_pair(query, "", instruction)[:-1]
+        prefix_ids = self.tokenizer(prefix)["input_ids"][:max_length - 1]
+        budget = max_length - len(prefix_ids)
+        doc_ids = [
+            ids[:budget] or [self.pad_id]
+            for ids in self.tokenizer([f" {doc}" for doc in docs], add_special_tokens=False)["input_ids"]
+        ]
+
+        base_model = self.model.base_model
+        scores = [0.0] * len(docs)
+        with torch.no_grad():
+            prefix_cache = base_model(
+                input_ids=torch.tensor([prefix_ids], device=device), use_cache=True
+            ).past_key_values
+
+            # Length buckets: sort by token count, then cut into batches
+            order = sorted(range(len(docs)), key=lambda i: len(doc_ids[i]))
+            for start in range(0, len(order), self.batch_size):
+                bucket = order[start:start + self.batch_size]
+                lengths = [len(doc_ids[i]) for i in bucket]
+                width = max(lengths)
+
+                input_ids = torch.full((len(bucket), width), self.pad_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(bucket), len(prefix_ids) + width), dtype=torch.long)
+                attention_mask[:, :len(prefix_ids)] = 1
+                for row, i in enumerate(bucket):
+                    input_ids[row, :lengths[row]] = torch.tensor(doc_ids[i])
+                    attention_mask[row, len(prefix_ids):len(prefix_ids) + lengths[row]] = 1
+
+                hidden = base_model(
+                    input_ids=input_ids.to(device),
+                    attention_mask=attention_mask.to(device),
+                    past_key_values=_repeat_cache(prefix_cache, len(bucket)),
+                    use_cache=True,
+                ).last_hidden_state
+
+                # Right padding: each row's last real token holds its prediction
+                last = hidden[torch.arange(len(bucket), device=device), torch.tensor(lengths, device=device) - 1]
+                for i, p in zip(bucket, self._yes_probability(last)):
+                    scores[i] = p
+        return scores
@@ -1,11 +1,17 @@
 import re
 import yaml
 import torch
-from openai import OpenAI
 from pathlib import Path
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from RAG.artifact import load_vector_store
+from RAG.answer_cache import answer_key, make_answer_cache, template_hash
+from RAG.cache import LRUCache, normalize_query
+from RAG.documents import document_id
+from RAG.embedding_scheduler import make_query_embedder
+from RAG.embeddings import load_embeddings
+from RAG.reranker import QwenReranker
+from serving.tracing import annotate, span
+from serving.upstream import Upstream, UpstreamError, make_openai_client
 
 class RAG_settings: 
     def __init__(self, settings_path):
@@ -22,79 +28,85 @@ class RAG_settings:
         
         self.USE_ChatGPT = self.config['OpenAI']['USE_ChatGPT']
         self.Ollama_local_url = self.config['OpenAI']['Ollama_local_url']
+        self.upstream = (self.config.get('upstream') or {}).get('openai') or {}
         
         self.Retrieval_Model = self.config['retrieval']['embedding_model']
+        self.micro_batch = self.config['retrieval'].get('micro_batch')
         self.Rerank_Model = self.config['rerank']['rerank_model']
+        self.Rerank_batch_size = self.config['rerank'].get('batch_size', 8)
+        self.Rerank_max_length = self.config['rerank'].get('max_length', 1024)
+        self.Rerank_revision = self.config['rerank'].get('revision', 'main')
+        self.Rerank_score_cache = self.config['rerank'].get('score_cache') or {}
         self.rag_path = Path(self.config["paths"]["rag_store"])
+        self.answer_cache = self.config.get("answer_cache")
     
         
 
 
 
 class RAGPipeline:
+    PROMPT_TEMPLATE = """
+You are a helpful assistant with statistical knowledge and expertise in advertisement. 
+Answer the query based on the given document. 
+If the document is irrelevant, respond with "I don't know."
+
+Document: {context}
+
+Query: {query}
+
+You must provide exactly one answer in the following format.
+---
+<clear and concise answer, grounded only in the document>
+---
+"""
+
     def __init__(self, config_path="config/settings.yaml"):
 
         self.settings = RAG_settings(config_path)
 
 
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name=self.settings.Retrieval_Model, 
-            model_kwargs={"device": self.settings.device}
-        )
-        self.vector_store = FAISS.load_local(
-            self.settings.rag_path, 
-            self.embedding_model, 
-            allow_dangerous_deserialization=True
+        # Queries from concurrent requests are embedded together in micro-batches
+        self.embedding_model = make_query_embedder(
+            load_embeddings(self.settings.config, self.settings.device),
+            self.settings.micro_batch,
         )
+        self.vector_store = load_vector_store(self.settings.rag_path, self.embedding_model)
 
         # --- Rerank model ---
-        # rerank_model_name = self.config["rerank"]["rerank_model"]
-        self.tokenizer_rerank = AutoTokenizer.from_pretrained(self.settings.Rerank_Model, padding_side="left")
-        self.model_rerank = AutoModelForCausalLM.from_pretrained(
-            self.settings.Rerank_Model, 
-            device_map="auto"
-        ).eval()
+        self.reranker = QwenReranker(
+            self.settings.Rerank_Model,
+            batch_size=self.settings.Rerank_batch_size,
+            max_length=self.settings.Rerank_max_length,
+            revision=self.settings.Rerank_revision,
+        )
+        self.tokenizer_rerank = self.reranker.tokenizer
+        self.model_rerank = self.reranker.model
+
+        # (normalized query, doc id, reranker revision) -> probability, tagged with the index version
+        self.rerank_cache = LRUCache(
+            max_entries=self.settings.Rerank_score_cache.get("max_entries", 50000),
+            ttl_s=self.settings.Rerank_score_cache.get("ttl_s"),
+        )
         
 
+        # Pooled keep-alive client; deadlines, retries and the circuit breaker come from self.upstream
         self.client = (
-        OpenAI() if self.settings.USE_ChatGPT else OpenAI(base_url=self.settings.Ollama_local_url, api_key="ollama")
+        make_openai_client(settings=self.settings.upstream) if self.settings.USE_ChatGPT
+        else make_openai_client(self.settings.Ollama_local_url, "ollama", self.settings.upstream)
         )
+        self.upstream = Upstream("openai", self.settings.upstream)
+
+        # --- LLM answer cache (single-flight across threads) ---
+        self.answer_cache = make_answer_cache(self.settings.answer_cache)
+        self.prompt_hash = template_hash(self.PROMPT_TEMPLATE)
         
 
-    def rerank(self, query, docs, instruction=None, max_length=1024):
+    def rerank(self, query, docs, instruction=None, max_length=None):
         """
         Rerank documents using Qwen reranker.
         Returns a list of (doc, score) sorted by score.
         """
-        if instruction is None:
-            instruction = "Given a web search query, retrieve relevant passages that answer the query"
-
-        # Format pairs
-        pairs = [
-            f"<Instruct>: {instruction}\n<Query>: {query}\n<Document>: {doc}"
-            for doc in docs
-        ]
-
-        # Tokenize
-        inputs = self.tokenizer_rerank(
-            pairs,
-            padding=True,
-            truncation=True,
-            max_length=max_length,
-            return_tensors="pt"
-        ).to(self.model_rerank.device)
-
-        with torch.no_grad():
-            outputs = self.model_rerank(**inputs).logits[:, -1, :]
-
-        # "yes"/"no" token ids
-        token_false_id = self.tokenizer_rerank.convert_tokens_to_ids("no")
-        token_true_id = self.tokenizer_rerank.convert_tokens_to_ids("yes")
-
-        true_vector = outputs[:, token_true_id]
-        false_vector = outputs[:, token_false_id]
-        batch_scores = torch.stack([false_vector, true_vector], dim=1)
-        probs = torch.nn.functional.log_softmax(batch_scores, dim=1)[:, 1].exp().tolist()
+        probs = self.reranker.score(query, docs, instruction, max_length)
 
         scored = list(zip(docs, probs))
         scored.sort(key=lambda x: x[1], reverse=True)
@@ -105,7 +117,32 @@ class RAGPipeline:
         Retrieve top-k documents from FAISS via similarity search.
         Returns a list of Documents (langchain Document objects).
         """
-        return self.vector_store.similarity_search(query, k=k)
+        with span("retrieve"):
+            return self.vector_store.similarity_search(query, k=k)
+
+    def rerank_scores(self, query, docs, doc_ids):
+        """
+        Reranker probability for each document.
+        Only (query, doc id) pairs missing from the score cache are sent to the model.
+        """
+        normalized = normalize_query(query)
+        version = self.vector_store.version
+        keys = [(normalized, doc_id, self.reranker.tag) for doc_id in doc_ids]
+        scores = [self.rerank_cache.get(key, version) for key in keys]
+
+        # Score each distinct uncached document once
+        missing = {}
+        for i, score in enumerate(scores):
+            if score is None:
+                missing.setdefault(doc_ids[i], i)
+        if missing:
+            with span("rerank"):
+                fresh = self.reranker.score(query, [docs[i].page_content for i in missing.values()])
+            for (doc_id, i), score in zip(missing.items(), fresh):
+                self.rerank_cache.put(keys[i], score, version)
+            fresh_by_id = dict(zip(missing, fresh))
+            scores = [fresh_by_id[doc_id] if score is None else score for doc_id, score in zip(doc_ids, scores)]
+        return scores
 
     def rerank_with_qwen(self, query, docs = None, top_n=5):
         """
@@ -116,23 +153,22 @@ class RAGPipeline:
         if docs is None:
             docs = self.retrieve(query, k=10)
         
-        doc_texts = [doc.page_content for doc in docs]
-        
-        ranked = self.rerank(query, doc_texts)
-
-        # Match texts back to docs
-        ranked_docs = []
-        for text, score in ranked:
-            for doc in docs:
-                if doc.page_content == text:
-                    ranked_docs.append((doc, score))
-                    break
+        doc_ids = [document_id(doc.metadata, doc.page_content) for doc in docs]
+        ranked_docs = list(zip(docs, self.rerank_scores(query, docs, doc_ids)))
+        ranked_docs.sort(key=lambda x: x[1], reverse=True)
 
         return ranked_docs[:top_n]
     
+    def stats(self):
+        return {
+            "rerank_cache": {"model": self.reranker.tag, **self.rerank_cache.stats()},
+            "answer_cache": self.answer_cache.stats(),
+            "upstream": self.upstream.stats(),
+        }
+    
      # --- Step 1: pick doc + context ---
      
-    def select_context(self, query, reranked_docs=None, threshold=0.5):
+    def select_doc(self, query, reranked_docs=None, threshold=0.5):
         if reranked_docs is None:
             reranked_docs = self.rerank_with_qwen(query)
 
@@ -143,53 +179,55 @@ class RAGPipeline:
         if score < threshold:
             return None
 
+        return top_doc
+
+    def select_context(self, query, reranked_docs=None, threshold=0.5):
+        top_doc = self.select_doc(query, reranked_docs, threshold)
+        if top_doc is None:
+            return None
         return top_doc.page_content if hasattr(top_doc, "page_content") else str(top_doc)
     
     # --- Step 2: build prompt ---
     def build_prompt(self, query, context):
-        return f"""
-You are a helpful assistant with statistical knowledge and expertise in advertisement. 
-Answer the query based on the given document. 
-If the document is irrelevant, respond with "I don't know."
-
-Document: {context}
-
-Query: {query}
-
-You must provide exactly one answer in the following format.
----
-<clear and concise answer, grounded only in the document>
----
-"""
+        return self.PROMPT_TEMPLATE.format(context=context, query=query)
 
     # --- Step 3a: non-stream LLM call ---
     def call_llm(self, prompt):
-        response = self.client.chat.completions.create(
-            model=self.settings.LLM_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=self.settings.LLM_temp,
-            max_tokens=self.settings.LLM_MAX_TOKENS,
-        )
+        def create(timeout):
+            return self.client.chat.completions.create(
+                model=self.settings.LLM_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.settings.LLM_temp,
+                max_tokens=self.settings.LLM_MAX_TOKENS,
+                timeout=timeout,
+            )
+
+        with span("llm"):
+            response = self.upstream.call(create)
         return response.choices[0].message.content.strip()
 
     # --- Step 3b: streaming LLM call ---
     def call_llm_stream(self, prompt):
-        response = self.client.chat.completions.create(
-            model=self.settings.LLM_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=self.settings.LLM_temp,
-            max_tokens=self.settings.LLM_MAX_TOKENS,
-            stream=True,
-        )
-        full_answer = ""
-        for chunk in response:
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                text = delta.content
-                print(text, end="", flush=True)  # live stream
-                full_answer += text
-        print()
-        return full_answer.strip()
+        def create(timeout):
+            # The whole stream is one attempt: a broken stream is retried from the start
+            response = self.client.chat.completions.create(
+                model=self.settings.LLM_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.settings.LLM_temp,
+                max_tokens=self.settings.LLM_MAX_TOKENS,
+                stream=True,
+                timeout=timeout,
+            )
+            parts = []
+            for chunk in response:
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta and delta.content:
+                    parts.append(delta.content)
+            return parts
+
+        with span("llm_stream"):
+            parts = self.upstream.call(create)
+        return "".join(parts).strip()
     
     @staticmethod
     def extract_answer(llm_output: str) -> str:
@@ -207,12 +245,28 @@ You must provide exactly one answer in the following format.
         return llm_output.strip()
     # --- High-level orchestration ---
     def synthesize(self, query, reranked_docs=None, threshold=0.5, stream=False):
-        context = self.select_context(query, reranked_docs, threshold)
+        top_doc = self.select_doc(query, reranked_docs, threshold)
+        if top_doc is None:
+            return "I don't know."
+
+        context = top_doc.page_content if hasattr(top_doc, "page_content") else str(top_doc)
         if not context:
             return "I don't know."
 
         prompt = self.build_prompt(query, context)
-        return self.extract_answer(self.call_llm_stream(prompt) if stream else self.call_llm(prompt))
+        doc_ids = [document_id(getattr(top_doc, "metadata", None), context)]
+        key = answer_key(query, doc_ids, self.settings.LLM_model, self.prompt_hash)
+
+        # Identical concurrent questions share one upstream call
+        try:
+            return self.answer_cache.get_or_compute(
+                key,
+                lambda: self.extract_answer(self.call_llm_stream(prompt) if stream else self.call_llm(prompt)),
+            )
+        except UpstreamError:
+            # LLM unavailable (circuit open, deadline, retries exhausted): answer with the document itself
+            annotate(degraded="llm_unavailable")
+            return context.strip()
     
 
 
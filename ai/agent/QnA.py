@@ -2,6 +2,8 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
 from RAG.retrieval_rerank import RAGPipeline  # import your class
+from serving.metrics import REGISTRY, instrument
+from serving.tracing import install_tracing
 
 
 
@@ -18,6 +20,24 @@ app = FastAPI(
     version="0.1.0"
 )
 
+# GET /metrics (Prometheus text format): request metrics, pipeline stages, LLM errors, cache ratios
+instrument(app)
+# Request ids, per-request spans (retrieve, rerank, llm) and sampled trace logging
+install_tracing(app, pipeline.settings.config.get("tracing"))
+
+def _cache_stats():
+    stats = pipeline.stats()
+    return {"rerank": stats["rerank_cache"], "answers": stats["answer_cache"]}
+
+REGISTRY.gauge("rag_cache_hit_ratio", "Hit ratio of the reranker score cache and the answer cache", ["cache"],
+               fn=lambda: {(name,): s["hit_ratio"] for name, s in _cache_stats().items()})
+REGISTRY.counter("rag_cache_lookups_total", "Cache lookups by result", ["cache", "result"],
+                 fn=lambda: {(name, result): s[result] for name, s in _cache_stats().items()
+                             for result in ("hits", "misses")})
+REGISTRY.gauge("rag_index_documents", "Documents in the loaded vector store", fn=lambda: len(pipeline.vector_store))
+REGISTRY.gauge("rag_index_info", "Loaded index version (always 1)", ["version"],
+               fn=lambda: {(pipeline.vector_store.version,): 1})
+
 # Request schema
 class QueryRequest(BaseModel):
     query: str
@@ -26,6 +46,15 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     answer: str
 
+@app.get(
+    "/stats",
+    tags=["Operations"],
+    summary="Cache statistics",
+    description="Hit ratios and sizes of the reranker score cache and the LLM answer cache."
+)
+def stats():
+    return pipeline.stats()
+
 @app.post(
     "/ask",
     tags=["Q&A"],
@@ -0,0 +1,131 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Run benchmarks from the ai/ directory as modules, e.g.
+    python -m benchmarks.rerank_bench
+so that config/settings.yaml and the RAG package resolve as in the servers.
+"""
+
+import json
+import time
+import platform
+import statistics
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import yaml
+
+CONFIG_PATH = "config/settings.yaml"
+
+# Queries used when a benchmark isn't given its own
+DEFAULT_QUERIES = [
+    "What is lookback window and how should I set it?",
+    "How do I set effect_size?",
+    "What does holdout mean?",
+    "Which locations should be included in the test?",
+    "How is the minimum detectable effect computed?",
+]
+
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def load_corpus(config: Optional[dict] = None) -> List:
+    """Every document the index is built from (langchain Documents from params.db)"""
+    from RAG.build_index import load_sql_as_docs
+
+    config = config or load_config()
+    return load_sql_as_docs(config["paths"]["params_db"])
+
+
+def take(items: Sequence, n: int) -> List:
+    """First `n` items, cycling when there are fewer (keeps k fixed on small corpora)"""
+    if not items:
+        return []
+    return [items[i % len(items)] for i in range(n)]
+
+
+def summarize(samples_ms: Sequence[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def time_calls(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """Call `fn` `warmup` times untimed, then `repeat` times; latency summary in ms"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def environment() -> dict:
+    env = {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor()}
+    try:
+        import torch
+
+        env.update(torch=torch.__version__, torch_threads=torch.get_num_threads())
+    except ImportError:
+        pass
+    return env
+
+
+def print_table(rows: List[dict], columns: Sequence[str]):
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def write_results(path: Optional[str], name: str, results: dict):
+    """Write `results` (plus environment info) as JSON when `path` is given"""
+    if not path:
+        return
+    payload = {"benchmark": name, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": environment(), **results}
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"💾 Results written to {path}")
+
+
+def compare_results(baseline_path: str, rows: List[dict], keys: Sequence[str],
+                    metrics: Sequence[str] = ("p50_ms", "p95_ms"), tolerance: float = 0.25,
+                    min_delta_ms: float = 0.05) -> List[dict]:
+    """
+    Rows whose latency grew by more than `tolerance` (and `min_delta_ms`) against
+    the rows of a previous run's JSON; rows are matched on `keys`.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {tuple(r.get(k) for k in keys): r for r in json.load(f).get("rows", [])}
+    regressions = []
+    for row in rows:
+        before = baseline.get(tuple(row.get(k) for k in keys))
+        if before is None:
+            continue
+        for metric in metrics:
+            old, new = before.get(metric), row.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                regressions.append({**{k: row.get(k) for k in keys}, "metric": metric, "baseline": old,
+                                    "current": new, "change": f"{(new / old - 1) * 100 if old else float('inf'):+.0f}%"})
+    return regressions
+
@@ -0,0 +1,94 @@
+"""
+Embedding backends: parity with torch and latency/throughput across batch sizes.
+
+Compares the torch model (HuggingFaceEmbeddings) with the ONNX Runtime export
+in fp32 and dynamic int8. Parity is the cosine similarity between each
+backend's vector and the torch vector for every document in params.db; the
+script exits non-zero when the minimum falls below --min-cosine, so it can
+gate a backend switch. Latency is per embed_documents call (no embedding
+cache), throughput is texts per second.
+
+Usage (from ai/):
+    python -m benchmarks.embedding_bench
+    python -m benchmarks.embedding_bench --batch-size 1 8 32 64 --threads 4 --output results/embeddings.json
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from benchmarks.common import load_config, load_corpus, print_table, take, time_calls, write_results
+from RAG.onnx_embeddings import OnnxEmbeddings, export_onnx, model_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"],
+                        choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--threads", type=int, default=None, help="torch / ONNX Runtime intra-op threads")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per batch size")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="parity threshold against torch")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    config = load_config()
+    retrieval = config["retrieval"]
+    model_name = retrieval["embedding_model"]
+    revision = retrieval.get("embedding_revision") or "main"
+    texts = [doc.page_content for doc in load_corpus(config)]
+    print(f"📋 {len(texts)} documents, model {model_name}@{revision}")
+
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # torch is always loaded: it is the parity reference
+    models = {"torch": HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": "cpu", "revision": revision})}
+    directory = model_dir((retrieval.get("onnx") or {}).get("path", "RAG/onnx_models"), model_name, revision)
+    if "onnx" in args.backends:
+        models["onnx"] = OnnxEmbeddings(export_onnx(model_name, directory, revision, quantize=False),
+                                        directory, threads=args.threads)
+    if "onnx-int8" in args.backends:
+        models["onnx-int8"] = OnnxEmbeddings(export_onnx(model_name, directory, revision, quantize=True),
+                                             directory, threads=args.threads)
+
+    reference = np.asarray(models["torch"].embed_documents(texts), dtype=np.float32)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+
+    rows = []
+    failed = []
+    for backend in args.backends:
+        model = models[backend]
+        vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        cosine = np.sum(vectors * reference, axis=1)
+        if cosine.min() < args.min_cosine:
+            failed.append(backend)
+
+        for batch_size in args.batch_size:
+            batch = take(texts, batch_size)
+            latency = time_calls(lambda: model.embed_documents(batch), repeat=args.repeat)
+            rows.append({
+                "backend": backend,
+                "batch": batch_size,
+                "p50_ms": latency["p50_ms"],
+                "p95_ms": latency["p95_ms"],
+                "texts_per_s": round(batch_size / (latency["p50_ms"] / 1000), 1),
+                "cos_min": round(float(cosine.min()), 5),
+                "cos_mean": round(float(cosine.mean()), 5),
+            })
+
+    print_table(rows, ["backend", "batch", "p50_ms", "p95_ms", "texts_per_s", "cos_min", "cos_mean"])
+    write_results(args.output, "embeddings", {"model": f"{model_name}@{revision}", "threads": args.threads,
+                                              "min_cosine": args.min_cosine, "rows": rows})
+    if failed:
+        print(f"❌ Parity below {args.min_cosine} for: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All backends within cosine {args.min_cosine} of torch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Local stand-in LLM servers for load tests: OpenAI-compatible and Gemini REST.
+
+One process serves both APIs, so neither load tests nor benchmarks spend
+quota or depend on upstream latency:
+
+    POST /v1/chat/completions                             OpenAI chat (stream=true: SSE chunks + [DONE])
+    GET  /v1/models
+    POST /v1beta/models/{model}:generateContent           Gemini
+    POST /v1beta/models/{model}:streamGenerateContent     Gemini streaming (?alt=sse: SSE, else a JSON array)
+    GET  /stats                                           requests, errors, in flight
+    POST /config                                          change latency / error settings at runtime
+
+Latency is sampled per request from a distribution given as `kind:args` (ms):
+    fixed:800   uniform:200:1500   normal:800:200   lognormal:800:0.5 (median, sigma)
+Streams send the first chunk after that latency, then one chunk per --token-ms.
+Errors: --error-rate answers with --error-status (429 adds Retry-After),
+--stream-error-rate cuts a stream off half way.
+
+Point the backends at it:
+    agent/QnA.py        OpenAI.USE_ChatGPT: false, OpenAI.Ollama_local_url: http://localhost:8100/v1
+    hybrid_rag_api.py   upstream.gemini.api_base: http://localhost:8100 (or GEMINI_API_BASE), any GEMINI_API_KEY
+
+Usage (from ai/):
+    python -m benchmarks.fake_llm --port 8100 --latency lognormal:800:0.5 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+
+class LatencyModel:
+    """Per-request latency in seconds from a `kind:args` spec in milliseconds"""
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, *args = spec.split(":")
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {kind!r} (expected one of {', '.join(DISTRIBUTIONS)})")
+        self.spec = spec
+        self.kind = kind
+        self.args = [float(a) for a in args] or [0.0]
+
+    def sample(self) -> float:
+        a = self.args
+        if self.kind == "uniform":
+            ms = random.uniform(a[0], a[1])
+        elif self.kind == "normal":
+            ms = random.gauss(a[0], a[1])
+        elif self.kind == "lognormal":
+            ms = a[0] * random.lognormvariate(0.0, a[1] if len(a) > 1 else 0.5)
+        else:
+            ms = a[0]
+        return max(0.0, ms) / 1000
+
+
+class FakeLLMSettings:
+    def __init__(self, latency: str = "fixed:0", token_ms: float = 20.0, tokens: int = 40,
+                 error_rate: float = 0.0, error_status: int = 503, stream_error_rate: float = 0.0):
+        self.latency = LatencyModel(latency)
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_error_rate = stream_error_rate
+
+    def update(self, values: Dict):
+        if "latency" in values:
+            self.latency = LatencyModel(values["latency"])
+        for name in ("token_ms", "tokens", "error_rate", "error_status", "stream_error_rate"):
+            if name in values:
+                setattr(self, name, type(getattr(self, name))(values[name]))
+
+    def describe(self) -> Dict:
+        return {"latency": self.latency.spec, "token_ms": self.token_ms, "tokens": self.tokens,
+                "error_rate": self.error_rate, "error_status": self.error_status,
+                "stream_error_rate": self.stream_error_rate}
+
+
+def answer_chunks(prompt: str, tokens: int, delimited: bool) -> List[str]:
+    """A canned answer split into `tokens` chunks; `delimited` wraps it in --- like the agent prompt asks"""
+    words = ["Stub", "answer", "for:"] + prompt.split()[-8:]
+    words += ["lorem"] * max(0, tokens - len(words))
+    chunks = [w + " " for w in words[:max(1, tokens)]]
+    if delimited:
+        chunks = ["---\n"] + chunks + ["\n---"]
+    return chunks
+
+
+def create_app(settings: FakeLLMSettings) -> FastAPI:
+    app = FastAPI(title="Fake LLM servers (OpenAI-compatible and Gemini)")
+    stats = {"requests": 0, "errors": 0, "stream_errors": 0, "in_flight": 0, "by_api": {}}
+
+    async def admit(api: str) -> Optional[JSONResponse]:
+        """Count the request, wait the sampled latency, and maybe answer with an injected error"""
+        stats["requests"] += 1
+        stats["by_api"][api] = stats["by_api"].get(api, 0) + 1
+        await asyncio.sleep(settings.latency.sample())
+        if random.random() < settings.error_rate:
+            stats["errors"] += 1
+            headers = {"Retry-After": "1"} if settings.error_status == 429 else None
+            return JSONResponse(status_code=settings.error_status, headers=headers,
+                                content={"error": {"code": settings.error_status, "message": "injected error"}})
+        return None
+
+    async def paced(chunks: List[str]):
+        """Yield chunks one per token_ms; maybe cut the stream off half way"""
+        cut = len(chunks) // 2 if random.random() < settings.stream_error_rate else None
+        for i, chunk in enumerate(chunks):
+            if i == cut:
+                stats["stream_errors"] += 1
+                raise RuntimeError("injected stream error")
+            if i:
+                await asyncio.sleep(settings.token_ms / 1000)
+            yield chunk
+
+    def tracked(generator):
+        async def wrapper():
+            stats["in_flight"] += 1
+            try:
+                async for item in generator:
+                    yield item
+            finally:
+                stats["in_flight"] -= 1
+        return wrapper()
+
+    # --- OpenAI-compatible ---
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "local"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["in_flight"] += 1
+        try:
+            error = await admit("openai")
+        finally:
+            stats["in_flight"] -= 1
+        if error is not None:
+            return error
+
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        chunks = answer_chunks(prompt, settings.tokens, delimited=True)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "fake-model")
+        created = int(time.time())
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(chunks),
+                 "total_tokens": len(prompt.split()) + len(chunks)}
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            def chunk_event(delta, finish_reason=None):
+                return "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }) + "\n\n"
+
+            first = True
+            async for text in paced(chunks):
+                yield chunk_event({"role": "assistant", "content": text} if first else {"content": text})
+                first = False
+            yield chunk_event({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(tracked(events()), media_type="text/event-stream")
+
+    # --- Gemini REST ---
+    @app.post("/v1beta/models/{model_method:path}")
+    async def gemini(model_method: str, request: Request):
+        model, _, method = model_method.partition(":")
+        body = await request.json()
+        stats["in_flight"] += 1
+        try:
+            error = await admit("gemini")
+        finally:
+            stats["in_flight"] -= 1
+        if error is not None:
+            return error
+
+        prompt = " ".join(part.get("text", "") for content in body.get("contents", [])
+                          for part in content.get("parts", []))
+        chunks = answer_chunks(prompt, settings.tokens, delimited=False)
+
+        def response(texts: List[str], finish: bool = True) -> Dict:
+            candidate = {"content": {"role": "model", "parts": [{"text": "".join(texts)}]}, "index": 0}
+            if finish:
+                candidate["finishReason"] = "STOP"
+            return {"candidates": [candidate], "modelVersion": model,
+                    "usageMetadata": {"promptTokenCount": len(prompt.split()), "candidatesTokenCount": len(chunks),
+                                      "totalTokenCount": len(prompt.split()) + len(chunks)}}
+
+        if method == "generateContent":
+            return response(chunks)
+        if method != "streamGenerateContent":
+            return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"unknown method {method}"}})
+
+        sse = request.query_params.get("alt") == "sse"
+
+        async def events():
+            first = True
+            async for text in paced(chunks):
+                data = json.dumps(response([text], finish=False))
+                if sse:
+                    yield f"data: {data}\n\n"
+                else:
+                    yield ("[" if first else ",\n") + data
+                first = False
+            if not sse:
+                yield "]"
+
+        return StreamingResponse(tracked(events()), media_type="text/event-stream" if sse else "application/json")
+
+    # --- Control ---
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "settings": settings.describe()}
+
+    @app.post("/config")
+    async def set_config(request: Request):
+        settings.update(await request.json())
+        return settings.describe()
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="lognormal:800:0.5",
+                        help="time to first byte, ms: fixed:X | uniform:MIN:MAX | normal:MEAN:SD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="delay between streamed chunks")
+    parser.add_argument("--tokens", type=int, default=40, help="chunks per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="fraction of streams cut off half way")
+    args = parser.parse_args()
+
+    settings = FakeLLMSettings(args.latency, args.token_ms, args.tokens, args.error_rate, args.error_status,
+                               args.stream_error_rate)
+    print(f"🧪 Fake OpenAI + Gemini on http://{args.host}:{args.port} {settings.describe()}")
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+FAISS index types: recall@k against the exact index, query latency and index size.
+
+Vectors come from the built store (RAG/store). The params.db corpus is small,
+so --scale grows it with noisy copies of the real vectors (re-normalized, like
+bge outputs) to see how each index type behaves at a larger size. Queries are
+further noisy copies of random rows; ground truth is an exact flat L2 search.
+Every index is built once and then searched with each search-time setting
+(nprobe for IVF, efSearch for HNSW).
+
+Usage (from ai/):
+    python -m benchmarks.index_bench
+    python -m benchmarks.index_bench --scale 100000 --k 5 10 --threads 4 --output results/index.json
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from benchmarks.common import load_config, print_table, summarize, write_results
+from RAG.artifact import INDEX_FILE, VECTORS_FILE, is_artifact
+from RAG.faiss_index import build_index, index_bytes, index_spec, set_search_params
+
+# (label, settings overrides, search-time sweeps)
+CONFIGURATIONS = [
+    ("flat", {"type": "flat"}, [{}]),
+    ("flat-fp16", {"type": "flat", "storage": "float16"}, [{}]),
+    ("hnsw", {"type": "hnsw"}, [{"ef_search": ef} for ef in (16, 64, 256)]),
+    ("hnsw-fp16", {"type": "hnsw", "storage": "float16"}, [{"ef_search": 64}]),
+    ("ivf_flat", {"type": "ivf_flat"}, [{"nprobe": n} for n in (1, 4, 16)]),
+    ("ivf_pq", {"type": "ivf_pq"}, [{"nprobe": n} for n in (4, 16, 64)]),
+]
+
+
+def scaled(vectors: np.ndarray, n: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """`n` vectors: the originals, then noisy re-normalized copies of random originals"""
+    if n <= len(vectors):
+        return vectors[:n]
+    extra = vectors[rng.integers(0, len(vectors), n - len(vectors))]
+    extra = extra + rng.normal(0.0, noise, extra.shape).astype(np.float32)
+    extra /= np.linalg.norm(extra, axis=1, keepdims=True)
+    return np.vstack([vectors, extra]).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=0, help="grow the corpus to this many vectors")
+    parser.add_argument("--noise", type=float, default=0.03, help="per-dimension noise of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--configs", nargs="+", default=[label for label, _, _ in CONFIGURATIONS],
+                        choices=[label for label, _, _ in CONFIGURATIONS])
+    parser.add_argument("--threads", type=int, default=None, help="FAISS OpenMP threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    config = load_config()
+    base_settings = config["retrieval"].get("index") or {}
+    rng = np.random.default_rng(args.seed)
+
+    store_path = Path(config["paths"]["rag_store"])
+    if is_artifact(store_path):
+        originals = np.load(store_path / VECTORS_FILE).astype(np.float32)
+    else:  # legacy store: only the FAISS file is needed, not the pickled docstore
+        legacy = faiss.read_index(str(store_path / INDEX_FILE))
+        originals = legacy.reconstruct_n(0, legacy.ntotal)
+    vectors = scaled(originals, max(args.scale, len(originals)), args.noise, rng)
+    queries = scaled(originals, len(originals) + args.queries, args.noise, rng)[len(originals):]
+    top_k = max(args.k)
+    print(f"📋 {len(vectors)} vectors ({len(originals)} real), dim {vectors.shape[1]}, {len(queries)} queries")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, top_k)
+
+    rows = []
+    for label, overrides, sweeps in CONFIGURATIONS:
+        if label not in args.configs:
+            continue
+        settings = {**base_settings, **overrides}
+        spec = index_spec(vectors.shape[1], len(vectors), settings)
+        started = time.perf_counter()
+        index = build_index(vectors, spec)
+        build_s = time.perf_counter() - started
+        size = index_bytes(index)
+
+        for params in sweeps:
+            set_search_params(index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+            index.search(queries[:1], top_k)  # warm up
+            latencies = []
+            found = np.empty((len(queries), top_k), dtype=np.int64)
+            for i, query in enumerate(queries):
+                started = time.perf_counter()
+                _, found[i:i + 1] = index.search(query[None, :], top_k)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            row = {
+                "index": label,
+                "factory": spec["factory"],
+                "params": ",".join(f"{key}={value}" for key, value in params.items()) or "-",
+            }
+            for k in args.k:
+                hits = sum(len(set(found[i, :k]) & set(truth[i, :k])) for i in range(len(queries)))
+                row[f"recall@{k}"] = round(hits / (k * len(queries)), 4)
+            latency = summarize(latencies)
+            row.update(p50_ms=latency["p50_ms"], p95_ms=latency["p95_ms"], size_mb=round(size / 1e6, 3),
+                       build_s=round(build_s, 3))
+            rows.append(row)
+
+    print_table(rows, ["index", "factory", "params", *[f"recall@{k}" for k in args.k],
+                       "p50_ms", "p95_ms", "size_mb", "build_s"])
+    write_results(args.output, "index", {"vectors": len(vectors), "real_vectors": len(originals),
+                                         "dim": int(vectors.shape[1]), "queries": len(queries), "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Concurrent load generator: replay a query mix against a running API at several concurrency levels.
+
+Closed loop: each of N workers sends its next request as soon as the previous
+one finishes, picking queries round-robin from the mix (shifted per worker).
+For every concurrency level it reports throughput, p50/p95/p99 latency, the
+error rate (non-2xx, timeouts, `error` stream events) and a per-route
+breakdown: the response `method` for hybrid_rag_api.py, "answer" for
+agent/QnA.py. Streaming endpoints (/ask/stream) also report time to first event.
+
+Run the API against the local stand-in LLMs so quota and upstream latency stay
+out of the picture:
+    python -m benchmarks.fake_llm --port 8100 --latency lognormal:800:0.5 --error-rate 0.02
+    GEMINI_API_BASE=http://localhost:8100 GEMINI_API_KEY=fake-key-0123456789 uvicorn hybrid_rag_api:app --port 8000
+
+Usage (from ai/):
+    python -m benchmarks.loadgen --url http://localhost:8000 --concurrency 1 4 16 64 --duration 30
+    python -m benchmarks.loadgen --endpoint /ask/stream --queries my_queries.txt --requests 500
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.common import print_table, summarize, write_results
+from benchmarks.stage_bench import SCENARIOS
+
+
+def default_queries() -> List[str]:
+    return list(dict.fromkeys(q for queries, _ in SCENARIOS.values() for q in queries))
+
+
+def load_queries(path: Optional[str]) -> List[str]:
+    """One query per line (blank lines and #comments skipped), or the stage_bench scenarios"""
+    if not path:
+        return default_queries()
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, query: str) -> Dict:
+    """One request; returns status, route, latency and (streams) time to first event"""
+    started = time.perf_counter()
+    result = {"status": None, "route": None, "first_event_ms": None, "error": None}
+    try:
+        if endpoint.endswith("/stream"):
+            async with client.stream("POST", endpoint, json={"query": query}) as response:
+                result["status"] = response.status_code
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                        if result["first_event_ms"] is None:
+                            result["first_event_ms"] = (time.perf_counter() - started) * 1000
+                    elif line.startswith("data:") and event in ("done", "error"):
+                        data = json.loads(line[5:])
+                        if event == "error":
+                            result["error"] = data.get("detail", "stream error")
+                        else:
+                            result["route"] = data.get("method")
+        else:
+            response = await client.post(endpoint, json={"query": query})
+            result["status"] = response.status_code
+            if response.is_success:
+                body = response.json()
+                result["route"] = body.get("method", "answer")
+    except httpx.TimeoutException:
+        result["error"] = "timeout"
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    if result["status"] is not None and not 200 <= result["status"] < 300:
+        result["error"] = f"http_{result['status']}"
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def run_level(url: str, endpoint: str, queries: List[str], concurrency: int,
+                    duration_s: Optional[float], total_requests: Optional[int], timeout_s: float) -> List[Dict]:
+    """All results of `concurrency` closed-loop workers, until the duration or request budget runs out"""
+    results = []
+    issued = 0
+    deadline = time.perf_counter() + duration_s if duration_s else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout_s, limits=limits) as client:
+        async def worker(worker_id: int):
+            nonlocal issued
+            i = worker_id
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if total_requests is not None:
+                    if issued >= total_requests:
+                        return
+                    issued += 1
+                results.append(await send(client, endpoint, queries[i % len(queries)]))
+                i += 1
+
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return results
+
+
+def level_rows(concurrency: int, results: List[Dict], elapsed_s: float) -> Tuple[Dict, List[Dict]]:
+    """The summary row of one concurrency level, and its per-route rows"""
+    ok = [r for r in results if r["error"] is None]
+    errors = Counter(r["error"] for r in results if r["error"] is not None)
+    latency = summarize([r["latency_ms"] for r in ok]) if ok else {}
+    row = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "req_per_s": round(len(ok) / elapsed_s, 2) if elapsed_s else None,
+        "p50_ms": latency.get("p50_ms"),
+        "p95_ms": latency.get("p95_ms"),
+        "p99_ms": latency.get("p99_ms"),
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else None,
+        "errors": ",".join(f"{e}={c}" for e, c in errors.most_common()),
+    }
+    first_events = [r["first_event_ms"] for r in ok if r["first_event_ms"] is not None]
+    if first_events:
+        row["first_event_p95_ms"] = summarize(first_events)["p95_ms"]
+
+    by_route = defaultdict(list)
+    for r in ok:
+        by_route[r["route"] or "unknown"].append(r["latency_ms"])
+    routes = []
+    for route, samples in sorted(by_route.items(), key=lambda item: -len(item[1])):
+        route_latency = summarize(samples)
+        routes.append({"concurrency": concurrency, "route": route, "n": len(samples),
+                       "share": round(len(samples) / len(ok), 3), "p50_ms": route_latency["p50_ms"],
+                       "p95_ms": route_latency["p95_ms"], "p99_ms": route_latency["p99_ms"]})
+    return row, routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/ask", help="/ask or /ask/stream (hybrid_rag_api), /ask (agent/QnA)")
+    parser.add_argument("--queries", help="file with one query per line (default: the stage_bench scenarios)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per concurrency level")
+    parser.add_argument("--requests", type=int, default=None, help="requests per level instead of --duration")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request (s)")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    duration_s = None if args.requests else args.duration
+    budget = f"{args.requests} requests" if args.requests else f"{args.duration:.0f}s"
+    print(f"📋 {len(queries)} queries -> {args.url}{args.endpoint}, {budget} per level")
+
+    rows, route_rows = [], []
+    for concurrency in args.concurrency:
+        started = time.perf_counter()
+        results = asyncio.run(run_level(args.url, args.endpoint, queries, concurrency, duration_s,
+                                        args.requests, args.timeout))
+        row, routes = level_rows(concurrency, results, time.perf_counter() - started)
+        rows.append(row)
+        route_rows.extend(routes)
+        print(f"⏱️  concurrency {concurrency}: {row['req_per_s']} req/s, p95 {row['p95_ms']} ms, "
+              f"errors {row['error_rate']:.1%}" if row["error_rate"] is not None else
+              f"⏱️  concurrency {concurrency}: no requests completed")
+
+    columns = ["concurrency", "requests", "req_per_s", "p50_ms", "p95_ms", "p99_ms", "error_rate", "errors"]
+    if any("first_event_p95_ms" in r for r in rows):
+        columns.insert(6, "first_event_p95_ms")
+    print_table(rows, columns)
+    print()
+    print_table(route_rows, ["concurrency", "route", "n", "share", "p50_ms", "p95_ms", "p99_ms"])
+    write_results(args.output, "load", {"url": args.url, "endpoint": args.endpoint, "queries": len(queries),
+                                        "duration_s": duration_s, "requests_per_level": args.requests,
+                                        "rows": rows, "routes": route_rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-query rerank latency: padded full-batch scoring vs. prefix-cached, length-bucketed scoring.
+
+"before" is the original RAGPipeline.rerank: every pair repeats the instruction
+and query, the batch is left-padded to the longest pair and the full
+vocabulary is projected at every position. "after" is QwenReranker.score.
+Both score the same documents; the largest probability difference is reported
+as a parity check.
+
+Usage (from ai/):
+    python -m benchmarks.rerank_bench
+    python -m benchmarks.rerank_bench --k 10 50 --batch-size 8 16 --repeat 5 --output results/rerank.json
+"""
+
+import argparse
+from typing import List
+
+import torch
+
+from benchmarks.common import DEFAULT_QUERIES, load_config, load_corpus, print_table, take, time_calls, write_results
+from RAG.reranker import QwenReranker, format_pair
+
+
+def padded_rerank(reranker: QwenReranker, query: str, docs: List[str], max_length: int = 1024) -> List[float]:
+    """The original implementation, kept here as the baseline"""
+    inputs = reranker.tokenizer(
+        [format_pair(query, doc) for doc in docs],
+        padding=True,
+        truncation=True,
+        max_length=max_length,
+        return_tensors="pt"
+    ).to(reranker.model.device)
+
+    with torch.no_grad():
+        outputs = reranker.model(**inputs).logits[:, -1, :]
+
+    batch_scores = torch.stack([outputs[:, reranker.token_false_id], outputs[:, reranker.token_true_id]], dim=1)
+    return torch.nn.functional.log_softmax(batch_scores, dim=1)[:, 1].exp().tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 50], help="documents reranked per query")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=None,
+                        help="bucketed batch sizes to try (default: rerank.batch_size from settings.yaml)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    config = load_config()
+    rerank_config = config["rerank"]
+    batch_sizes = args.batch_size or [rerank_config.get("batch_size", 8)]
+    max_length = rerank_config.get("max_length", 1024)
+
+    print(f"🔧 Loading {rerank_config['rerank_model']}")
+    reranker = QwenReranker(rerank_config["rerank_model"], max_length=max_length)
+    corpus = [doc.page_content for doc in load_corpus(config)]
+
+    def run(query, docs, batch_size):
+        if batch_size is None:
+            return padded_rerank(reranker, query, docs, max_length)
+        reranker.batch_size = batch_size
+        return reranker.score(query, docs)
+
+    rows = []
+    for k in args.k:
+        docs = take(corpus, k)
+        baseline = {q: run(q, docs, None) for q in args.queries}
+        for batch_size in [None, *batch_sizes]:
+            samples = [time_calls(lambda: run(q, docs, batch_size), repeat=args.repeat, warmup=1) for q in args.queries]
+            max_diff = max(max(abs(a - b) for a, b in zip(baseline[q], run(q, docs, batch_size))) for q in args.queries)
+            rows.append({
+                "k": k,
+                "method": "padded" if batch_size is None else "prefix+buckets",
+                "batch_size": batch_size or k,
+                "p50_ms": round(sorted(s["p50_ms"] for s in samples)[len(samples) // 2], 1),
+                "mean_ms": round(sum(s["mean_ms"] for s in samples) / len(samples), 1),
+                "max_prob_diff": round(max_diff, 5),
+            })
+
+    for k in args.k:
+        padded = next(r for r in rows if r["k"] == k and r["method"] == "padded")
+        for r in rows:
+            if r["k"] == k:
+                r["speedup"] = round(padded["mean_ms"] / r["mean_ms"], 2) if r["mean_ms"] else None
+
+    print_table(rows, ["k", "method", "batch_size", "p50_ms", "mean_ms", "speedup", "max_prob_diff"])
+    write_results(args.output, "rerank", {"model": rerank_config["rerank_model"], "max_length": max_length,
+                                          "queries": args.queries, "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
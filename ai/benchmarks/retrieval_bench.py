@@ -0,0 +1,104 @@
+"""
+Recall and latency of dense, lexical (BM25) and hybrid (rank-fused) retrieval.
+
+Queries are generated from params.db so they have known answers:
+- identifier: "what is <param or term name>" / "how do I set <name>"; any document
+  with that name is relevant (several functions share parameter names)
+- description: the first words of a document's explanation; only that document is relevant
+
+Latency is per query and includes embedding (uncached) for the dense and hybrid modes.
+
+Usage (from ai/):
+    python -m benchmarks.retrieval_bench
+    python -m benchmarks.retrieval_bench --k 1 5 --output results/retrieval.json
+"""
+
+import argparse
+import time
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from benchmarks.common import load_config, print_table, summarize, write_results
+from RAG.artifact import load_vector_store
+
+MODES = ("dense", "lexical", "hybrid")
+
+
+def build_queries(store) -> List[Tuple[str, str, Set[str]]]:
+    """(query set, query text, relevant doc ids) generated from the indexed documents"""
+    by_name: Dict[str, Set[str]] = {}
+    views = store.get_views(range(len(store))).values()
+    for view in views:
+        if view.name:
+            by_name.setdefault(view.name, set()).add(view.doc_id)
+
+    queries = []
+    for name, doc_ids in sorted(by_name.items()):
+        queries.append(("identifier", f"what is {name}", doc_ids))
+        queries.append(("identifier", f"how do I set {name}?", doc_ids))
+    for view in views:
+        words = view.explanation.split()
+        if view.label and len(words) >= 6:
+            queries.append(("description", " ".join(words[:12]), {view.doc_id}))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="recall cut-offs")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    config = load_config()
+    lexical_config = config["retrieval"].get("lexical") or {}
+    top_k = max(args.k)
+
+    embeddings = None
+    if {"dense", "hybrid"} & set(args.modes):
+        from RAG.build_index import get_device
+        from RAG.embeddings import load_embeddings
+
+        embeddings = load_embeddings(config, get_device())
+    store = load_vector_store(config["paths"]["rag_store"], embeddings)
+    queries = build_queries(store)
+    print(f"📋 {len(queries)} queries over {len(store)} documents")
+
+    def search(mode: str, query: str):
+        if mode == "lexical":
+            return store.lexical_hits(query, top_k)
+        matrix = np.asarray([embeddings.embed_query(query)], dtype=np.float32)
+        if mode == "hybrid":
+            return store.hybrid_hits([query], matrix, top_k, candidates=lexical_config.get("candidates", 20),
+                                     rrf_k=lexical_config.get("rrf_k", 60))[0]
+        return store.search_hits(matrix, top_k)[0]
+
+    rows = []
+    for mode in args.modes:
+        search(mode, queries[0][1])  # warm up
+        for query_set in ("identifier", "description", "all"):
+            subset = [q for q in queries if query_set == "all" or q[0] == query_set]
+            latencies, found_at = [], []
+            for _, text, relevant in subset:
+                started = time.perf_counter()
+                hits = search(mode, text)
+                latencies.append((time.perf_counter() - started) * 1000)
+                ranks = [rank for rank, hit in enumerate(hits) if hit.doc.doc_id in relevant]
+                found_at.append(ranks[0] if ranks else None)
+
+            row = {"mode": mode, "queries": query_set, "n": len(subset)}
+            for k in args.k:
+                row[f"recall@{k}"] = round(sum(1 for r in found_at if r is not None and r < k) / len(subset), 3)
+            row["mrr"] = round(sum(1.0 / (r + 1) for r in found_at if r is not None) / len(subset), 3)
+            latency = summarize(latencies)
+            row["p50_ms"] = latency["p50_ms"]
+            row["p95_ms"] = latency["p95_ms"]
+            rows.append(row)
+
+    print_table(rows, ["mode", "queries", "n", *[f"recall@{k}" for k in args.k], "mrr", "p50_ms", "p95_ms"])
+    write_results(args.output, "retrieval", {"store": str(store.path), "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
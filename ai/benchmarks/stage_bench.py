@@ -0,0 +1,265 @@
+"""
+Stage-level latency of the RAG hot path, and end-to-end /ask per routing branch.
+
+Runs offline against the checked-in RAG/store and params.db; Gemini and the
+OpenAI client are replaced by stubs (optionally with a fixed latency), and the
+LLM answer cache is bypassed so every LLM branch reaches the stub.
+
+Stages (each over the same query set):
+    embed_query                 raw embedding model, no cache
+    semantic_search             query caches cleared before every call ("cold") or kept ("warm")
+    identifier_match, is_geolift_question, format_rag_answer, plan_route
+    RAGPipeline.rerank, RAGPipeline.rerank_with_qwen, RAGPipeline.extract_answer,
+    RAGPipeline.synthesize      (with --rerank; loads the reranker)
+
+End to end, /ask through FastAPI's TestClient for each branch:
+    rag           GeoLift questions with close matches (pure RAG, no LLM)
+    rag_enhanced  GeoLift questions answered by RAG + Gemini
+    gemini        general questions answered by Gemini only
+    fallback      the same questions while the LLM fails (non-LLM routes)
+Each row also reports the `method` mix actually returned, since routing depends
+on the scores the embedding model produces.
+
+Usage (from ai/):
+    python -m benchmarks.stage_bench --output results/stages.json
+    python -m benchmarks.stage_bench --rerank --compare results/stages.json   # exit 1 on regressions
+"""
+
+import os
+
+# Offline by default: models must already be in the local Hugging Face cache
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Sequence
+
+from benchmarks.common import compare_results, print_table, summarize, write_results
+
+SCENARIOS = {
+    "rag": ([
+        "What is lookback window?",
+        "How do I set effect_size?",
+        "What does holdout mean?",
+        "What is cpic?",
+        "Explain Synthetic Control",
+    ], False),
+    "rag_enhanced": ([
+        "How should I choose the number of test markets for a small budget?",
+        "Why would my power analysis need a longer lookback window?",
+        "Which locations should be included in the test?",
+        "How is the minimum detectable effect computed?",
+    ], False),
+    "gemini": ([
+        "What is the capital of France?",
+        "Write a haiku about autumn",
+        "How do I reverse a list in Python?",
+    ], False),
+    "fallback": ([
+        "How should I choose the number of test markets for a small budget?",
+        "What is the capital of France?",
+        "Why would my power analysis need a longer lookback window?",
+    ], True),
+}
+
+
+class StubLLM:
+    """Stands in for the Gemini model and the OpenAI client: fixed latency, optional failure"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000
+        self.fail = False
+        self.calls = 0
+        self.chat = self  # client.chat.completions.create(...)
+        self.completions = self
+
+    def _answer(self) -> str:
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("stub LLM failure")
+        return "---\nStub answer grounded in the document.\n---"
+
+    # Gemini
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency_s)
+        return _Response(self._answer())
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        await asyncio.sleep(self.latency_s)
+        return _Response(self._answer())
+
+    # OpenAI
+    def create(self, **kwargs):
+        time.sleep(self.latency_s)
+        return _Completion(self._answer())
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Completion:
+    def __init__(self, text):
+        message = type("Message", (), {"content": text})()
+        self.choices = [type("Choice", (), {"message": message})()]
+
+
+class NullAnswerBackend:
+    """Answer cache backend that never hits, so every request reaches the LLM stub"""
+
+    def get(self, key):
+        return None
+
+    def put(self, key, answer):
+        pass
+
+    def size(self):
+        return 0
+
+
+def stage_row(stage: str, samples_ms: List[float]) -> Dict:
+    latency = summarize(samples_ms)
+    mean_s = latency["mean_ms"] / 1000
+    return {"section": "stage", "name": stage, "n": latency["n"], "p50_ms": latency["p50_ms"],
+            "p95_ms": latency["p95_ms"], "p99_ms": latency["p99_ms"],
+            "per_s": round(1 / mean_s, 1) if mean_s else None}
+
+
+def time_stage(fn: Callable, inputs: Sequence, repeat: int, before: Callable = None) -> List[float]:
+    """Latency samples (ms) of fn(x) for every input, `repeat` times, after one untimed pass"""
+    for x in inputs:
+        if before:
+            before()
+        fn(x)
+    samples = []
+    for _ in range(repeat):
+        for x in inputs:
+            if before:
+                before()
+            started = time.perf_counter()
+            fn(x)
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="timed passes over each query set")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="latency of the stub LLMs")
+    parser.add_argument("--warm", action="store_true", help="keep the query caches between calls")
+    parser.add_argument("--rerank", action="store_true", help="also benchmark RAGPipeline (loads the reranker)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="previous results JSON; exit 1 when a row regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative latency increase")
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    import hybrid_rag_api as api
+    from RAG.answer_cache import AnswerCache
+
+    llm = StubLLM(args.llm_latency_ms)
+    api.init_gemini = lambda: llm
+    api.answer_cache = AnswerCache(NullAnswerBackend())
+
+    def clear_query_caches():
+        if not args.warm:
+            api.search_cache.clear()
+            api.embedding_cache.clear()
+
+    all_queries = list(dict.fromkeys(q for queries, _ in SCENARIOS.values() for q in queries))
+    rows = []
+    with TestClient(api.app) as client:
+        while not api.startup_state["ready"]:
+            if api.startup_state["phase"] in ("failed", "degraded"):
+                sys.exit(f"❌ Startup failed: {api.startup_state['error']}")
+            time.sleep(0.05)
+        print(f"📋 {len(all_queries)} queries, search mode {api.SEARCH_MODE}, "
+              f"{'warm' if args.warm else 'cold'} query caches, stub LLM {args.llm_latency_ms} ms")
+
+        # --- Stages ---
+        if api.SEARCH_MODE != "lexical":
+            raw_model = getattr(api.embedding_model, "embeddings", api.embedding_model)
+            rows.append(stage_row("embed_query", time_stage(raw_model.embed_query, all_queries, args.repeat)))
+        rows.append(stage_row("semantic_search", time_stage(api.semantic_search, all_queries, args.repeat,
+                                                            clear_query_caches)))
+        hits = {q: api.semantic_search(q) for q in all_queries}
+        if api.identifier_index is not None:
+            rows.append(stage_row("identifier_match", time_stage(api.identifier_index.match, all_queries, args.repeat)))
+        rows.append(stage_row("is_geolift_question", time_stage(api.is_geolift_question, all_queries, args.repeat)))
+        rows.append(stage_row("format_rag_answer", time_stage(
+            lambda q: api.format_rag_answer(q, hits[q]), all_queries, args.repeat)))
+        rows.append(stage_row("plan_route", time_stage(
+            lambda q: api.plan_route(q, hits[q], api.format_rag_answer(q, hits[q])), all_queries, args.repeat)))
+
+        if args.rerank:
+            os.environ.setdefault("OPENAI_API_KEY", "stub")  # the client is replaced below
+            from RAG.retrieval_rerank import RAGPipeline
+
+            pipeline = RAGPipeline("config/settings.yaml")
+            pipeline.client = llm
+            pipeline.answer_cache = AnswerCache(NullAnswerBackend())
+            candidates = {q: pipeline.retrieve(q, k=10) for q in all_queries}
+            rows.append(stage_row("RAGPipeline.retrieve", time_stage(
+                lambda q: pipeline.retrieve(q, k=10), all_queries, args.repeat)))
+            rows.append(stage_row("RAGPipeline.rerank", time_stage(
+                lambda q: pipeline.rerank(q, [d.page_content for d in candidates[q]]), all_queries, args.repeat)))
+            rows.append(stage_row("RAGPipeline.rerank_with_qwen", time_stage(
+                lambda q: pipeline.rerank_with_qwen(q, candidates[q]), all_queries, args.repeat,
+                pipeline.rerank_cache.clear if not args.warm else None)))
+            outputs = [llm._answer(), "no delimiters here", "---\nfirst\n---\n---\nsecond\n---"]
+            rows.append(stage_row("RAGPipeline.extract_answer", time_stage(
+                pipeline.extract_answer, outputs, args.repeat * 10)))
+            reranked = {q: pipeline.rerank_with_qwen(q, candidates[q]) for q in all_queries}
+            rows.append(stage_row("RAGPipeline.synthesize", time_stage(
+                lambda q: pipeline.synthesize(q, reranked[q]), all_queries, args.repeat)))
+
+        # --- End to end, per routing branch ---
+        for branch, (queries, llm_fails) in SCENARIOS.items():
+            llm.fail = llm_fails
+            methods = Counter()
+            samples = []
+            started_all = time.perf_counter()
+            for i in range(args.repeat + 1):
+                for query in queries:
+                    clear_query_caches()
+                    started = time.perf_counter()
+                    response = client.post("/ask", json={"query": query})
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if i == 0:
+                        continue  # untimed first pass
+                    response.raise_for_status()
+                    samples.append(elapsed)
+                    methods[response.json()["method"]] += 1
+                if i == 0:
+                    started_all = time.perf_counter()
+            total_s = time.perf_counter() - started_all
+            latency = summarize(samples)
+            rows.append({"section": "ask", "name": branch, "n": latency["n"], "p50_ms": latency["p50_ms"],
+                         "p95_ms": latency["p95_ms"], "p99_ms": latency["p99_ms"],
+                         "per_s": round(len(samples) / total_s, 1),
+                         "methods": ",".join(f"{m}={c}" for m, c in methods.most_common())})
+        llm.fail = False
+
+    print_table(rows, ["section", "name", "n", "p50_ms", "p95_ms", "p99_ms", "per_s", "methods"])
+    write_results(args.output, "stages", {
+        "search_mode": api.SEARCH_MODE, "warm": args.warm, "llm_latency_ms": args.llm_latency_ms,
+        "index_version": api.INDEX_VERSION, "rows": rows,
+    })
+
+    if args.compare:
+        regressions = compare_results(args.compare, rows, ["section", "name"], tolerance=args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.compare}:")
+            print_table(regressions, ["section", "name", "metric", "baseline", "current", "change"])
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
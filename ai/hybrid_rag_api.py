@@ -6,16 +6,38 @@ Confidence-based routing determines when to use each system
 """
 
 import os
+import asyncio
+import importlib
+import contextlib
+import contextvars
+import functools
+import json
+import time
 import sqlite3
 import yaml
-import torch
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from RAG.answer_cache import answer_key, make_answer_cache, template_hash
+from RAG.artifact import load_vector_store
+from RAG.cache import LRUCache, normalize_query
+from RAG.embedding_scheduler import MicroBatchEmbedder, make_query_embedder
+from RAG.embeddings import cache_revision, load_embeddings, serving_embedding_cache
+from RAG.hits import SearchHit
+from RAG.identifiers import IdentifierIndex, KeywordMatcher
+from serving.admission import AdmissionController, Overloaded
+from serving import prefork
+from serving.budget import Budget, decide as budget_decide, record as record_budget_decision
+from serving.metrics import REGISTRY, BATCH_SIZE_BUCKETS, instrument
+from serving.speculation import SpeculativeCall
+from serving.tracing import annotate, current_trace, debug_trace, get_logger, install_tracing, record_span, span
+from serving.upstream import GeminiClient, Upstream, UpstreamError
 
 # Load environment variables from .env file
 try:
@@ -39,22 +61,22 @@ try:
 except ImportError:
     print("⚠️  python-dotenv not available. Install with: pip install python-dotenv")
 
-# Google Gemini integration
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    print("⚠️  Google Gemini not available. Install with: pip install google-generativeai")
-
 # Change to the ai directory for correct relative imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(current_dir)
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize in the background so /health and /ready answer while models load"""
+    loop = asyncio.get_running_loop()
+    app.state.init_task = loop.run_in_executor(cpu_pool, initialize_components)
+    yield
+
 app = FastAPI(
     title="Hybrid RAG API for GeoLift",
     description="Smart routing between RAG (GeoLift knowledge) and Gemini (general AI)",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware for production
@@ -70,122 +92,507 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# GET /metrics (Prometheus text format) plus per-endpoint request latency and in-flight gauges
+instrument(app)
 
 # Request/Response models
 class QueryRequest(BaseModel):
     query: str
+    debug: bool = False  # include debug_info (routing factors, documents used) in the response
+    budget_ms: Optional[float] = None  # latency budget; default latency_budget.default_ms
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[str] = []
     method: str = "rag"  # "rag", "gemini", "rag_enhanced", "hybrid", or "fallback"
     confidence: float = 0.0
-    debug_info: Dict[str, Any] = {}  # Additional debug information
+    debug_info: Dict[str, Any] = {}  # Additional debug information (only when the request sets debug)
+    budget_decision: Optional[str] = None  # latency budget decision when an LLM route was considered (serving/budget.py)
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    max_concurrency: Optional[int] = None  # LLM calls in flight for this batch (capped by the server)
+    debug: bool = False
+    budget_ms: Optional[float] = None  # latency budget for the whole batch; default latency_budget.default_ms
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]  # same order as the request's queries
 
 # Load configuration
 with open("config/settings.yaml", "r") as f:
     config = yaml.safe_load(f)
 
+# Request ids and per-request spans; per-request output goes through a queued, sampled logger
+install_tracing(app, config.get("tracing"))
+log = get_logger("api")
+
 # Database and vector store paths
 DB_PATH = Path(config["paths"]["params_db"])
 STORE_PATH = Path(config["paths"]["rag_store"])
 EMBEDDING_MODEL = config["retrieval"]["embedding_model"]
+# "torch" (HuggingFaceEmbeddings) or "onnx" (ONNX Runtime, optionally int8)
+EMBEDDING_BACKEND = config["retrieval"].get("backend", "torch")
+# Model revision + backend the query vectors come from (RAG/embeddings.py), shared with build_index.py
+EMBEDDING_REVISION = cache_revision(config["retrieval"])
+
+# Retrieval mode: "dense" (FAISS), "hybrid" (FAISS + BM25, rank fusion) or "lexical" (BM25 only).
+# Lexical mode needs neither torch nor the embedding model; it is also the fallback when they fail to load.
+SEARCH_MODE = config["retrieval"].get("search_mode", "dense")
+LEXICAL_CONFIG = config["retrieval"].get("lexical") or {}
+# FAISS search-time knobs; override what the index was built with (see RAG/faiss_index.py)
+INDEX_CONFIG = config["retrieval"].get("index") or {}
+INDEX_SEARCH_PARAMS = {
+    "nprobe": (INDEX_CONFIG.get("ivf") or {}).get("nprobe"),
+    "ef_search": (INDEX_CONFIG.get("hnsw") or {}).get("ef_search"),
+}
+# "What is effect_size"-style questions are answered from the named document without search or LLM
+IDENTIFIER_FAST_PATH = config["retrieval"].get("identifier_fast_path", True)
+
+# Worker pool and admission control
+# Embedding and FAISS search release the GIL, so a thread pool sized to the
+# cores gives real parallelism without loading the model once per process.
+SERVING_CONFIG = config.get("serving") or {}
+# With pre-forked workers the cores are split between the processes.
+CPU_WORKERS = SERVING_CONFIG.get("cpu_workers") or max(1, (os.cpu_count() or 1) // (SERVING_CONFIG.get("workers") or 1))
+TORCH_THREADS = SERVING_CONFIG.get("torch_threads") or max(
+    1, (os.cpu_count() or 1) // (CPU_WORKERS * (SERVING_CONFIG.get("workers") or 1))
+)
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+admission = AdmissionController(
+    max_in_flight=SERVING_CONFIG.get("max_in_flight", 32),
+    max_queue=SERVING_CONFIG.get("max_queue", 64),
+    queue_timeout_s=SERVING_CONFIG.get("queue_timeout_s", 2.0),
+)
+BATCH_MAX_QUERIES = SERVING_CONFIG.get("batch_max_queries", 64)
+BATCH_LLM_CONCURRENCY = SERVING_CONFIG.get("batch_llm_concurrency", 4)
+
+
+async def run_cpu_bound(fn, *args, **kwargs):
+    """Run a blocking CPU-bound call on the worker pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # the request's trace follows the call into the pool
+    return await loop.run_in_executor(cpu_pool, functools.partial(context.run, fn, *args, **kwargs))
+
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+# Gemini calls go through a pooled REST client with deadlines, retries and a circuit breaker;
+# while the circuit is open, queries are answered from RAG alone without waiting on Gemini.
+UPSTREAM_CONFIG = config.get("upstream") or {}
+GEMINI_UPSTREAM_CONFIG = UPSTREAM_CONFIG.get("gemini") or {}
+# Override the Gemini endpoint, e.g. for load tests against benchmarks/fake_llm.py
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE") or GEMINI_UPSTREAM_CONFIG.get("api_base")
+gemini_upstream = Upstream("gemini", GEMINI_UPSTREAM_CONFIG)
 
-# Initialize Gemini
+# Latency budgets: an LLM step is skipped (pure RAG answer) when Gemini's recent
+# latency won't fit in what is left of the request's budget
+BUDGET_CONFIG = config.get("latency_budget") or {}
+DEFAULT_BUDGET_MS = BUDGET_CONFIG.get("default_ms")
+BUDGET_QUANTILE = BUDGET_CONFIG.get("quantile", 0.9)
+BUDGET_MIN_SAMPLES = BUDGET_CONFIG.get("min_samples", 10)
+BUDGET_HEADROOM_MS = BUDGET_CONFIG.get("headroom_ms", 50)
+
+# Speculation: for questions predicted to be non-GeoLift, /ask starts the general
+# Gemini call alongside retrieval and cancels it if the route turns out otherwise
+SPECULATION_CONFIG = config.get("speculation") or {}
+SPECULATION_ENABLED = SPECULATION_CONFIG.get("enabled", False)
+SPECULATION_MAX_IN_FLIGHT = SPECULATION_CONFIG.get("max_in_flight")
+
+# Heavy components are loaded by a background startup task (initialize_components),
+# so uvicorn binds right away and /ready reports when everything is loaded and warm.
 gemini_model = None
-if GEMINI_AVAILABLE:
+embedding_model = None
+query_embedder = None
+persistent_embeddings = None  # on-disk embedding cache shared with build_index.py (read-only, written behind)
+vector_store = None
+INDEX_VERSION = None
+INDEX_BYTES = None  # on-disk size of the loaded store, measured once at load (rag_index_bytes)
+device = None
+identifier_index = None  # parameter/term names -> doc ids (from params.db)
+identifier_rows = {}     # doc id -> vector store row
+
+WARMUP_QUERIES = SERVING_CONFIG.get("warmup_queries") or [
+    "What is lookback window?",
+    "How do I set effect_size?",
+    "What does holdout mean?",
+]
+startup_state = {"ready": False, "loaded": False, "phase": "pending", "timings_ms": {}, "error": None}
+
+def init_gemini():
+    """Initialize Gemini; returns the model, or None when unavailable"""
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     print(f"🔍 Debug: GEMINI_API_KEY = {gemini_api_key[:15] + '...' if gemini_api_key else 'None'}")
     if gemini_api_key and len(gemini_api_key.strip()) > 10:
         try:
-            genai.configure(api_key=gemini_api_key.strip())
-            gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+            model = GeminiClient(gemini_api_key.strip(), GEMINI_MODEL_NAME, base_url=GEMINI_API_BASE,
+                                 settings=GEMINI_UPSTREAM_CONFIG)
+            if GEMINI_API_BASE:  # e.g. the local stand-in: python -m benchmarks.fake_llm
+                print(f"🧪 Gemini requests go to {GEMINI_API_BASE}")
             print(f"✅ Gemini API initialized successfully")
+            return model
         except Exception as e:
             print(f"❌ Gemini initialization failed: {e}")
     else:
         print("⚠️  GEMINI_API_KEY not found or invalid in environment variables")
+    return None
 
-# Initialize embeddings and vector store
-device = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
-print(f"🔧 Using device: {device}")
+def warm_up(queries: List[str]):
+    """
+    Run synthetic queries through the embedding model and the index so the first
+    real request doesn't pay for tokenizer/kernel warm-up or cold index pages.
+    The raw model is used, so warm-up neither hits nor fills any cache.
+    """
+    if SEARCH_MODE == "lexical":
+        search_store(queries, None, 5)
+        return
+    vectors = embedding_model.embed_documents(queries)  # batched path (/ask/batch, micro-batches)
+    embedding_model.embed_query(queries[0])              # batch-size-1 path
+    matrix = np.asarray(vectors, dtype=np.float32)
+    search_store(queries, matrix, 5)
+    for query, vector in zip(queries, matrix):
+        search_store([query], vector[None, :], 5)
 
-try:
-    embedding_model = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL, 
-        model_kwargs={"device": device}
-    )
-    print(f"✅ Loaded embedding model: {EMBEDDING_MODEL}")
+def _timed(phase, fn, *args):
+    startup_state["phase"] = phase
+    t = time.perf_counter()
+    result = fn(*args)
+    startup_state["timings_ms"][phase] = round((time.perf_counter() - t) * 1000, 1)
+    return result
+
+def load_components():
+    """Load Gemini, the embedding model and the vector store (blocking, no warm-up)"""
+    global gemini_model, embedding_model, query_embedder, persistent_embeddings, vector_store, INDEX_VERSION, device
+    global INDEX_BYTES
+    global SEARCH_MODE
+    global identifier_index, identifier_rows
     
-    vector_store = FAISS.load_local(
-        str(STORE_PATH), 
-        embedding_model, 
-        allow_dangerous_deserialization=True
-    )
-    print(f"✅ Loaded FAISS vector store from: {STORE_PATH}")
+    gemini_model = _timed("gemini", init_gemini)
+    if not gemini_model:
+        print("⚠️  WARNING: Gemini not available! Set GEMINI_API_KEY environment variable")
     
-except Exception as e:
-    print(f"❌ Error loading vector store: {e}")
-    print("📝 Make sure to run: cd ai && python RAG/build_index.py")
-    vector_store = None
-    embedding_model = None
+    # Initialize embeddings (not needed for lexical-only search)
+    if SEARCH_MODE != "lexical":
+        try:
+            if EMBEDDING_BACKEND == "onnx":
+                # ONNX Runtime on CPU; torch is only needed once, to export the model
+                device = "cpu"
+            else:
+                torch = _timed("torch_import", importlib.import_module, "torch")
+                torch.set_num_threads(TORCH_THREADS)
+                device = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+            print(f"🔧 Using device: {device} ({EMBEDDING_BACKEND} backend)")
+            
+            embedding_model = _timed("embedding_model", load_embeddings, config, device, TORCH_THREADS)
+            print(f"✅ Loaded embedding model: {EMBEDDING_MODEL}")
+            
+            # Queries that miss the in-process cache are looked up in the store shared with
+            # build_index.py and other workers; the request path only reads it
+            try:
+                persistent_embeddings = serving_embedding_cache(config)
+            except Exception as e:
+                print(f"⚠️  Persistent embedding cache disabled: {e}")
+            
+            # Concurrent queries are coalesced into one embed_documents call
+            query_embedder = make_query_embedder(embedding_model, config["retrieval"].get("micro_batch"))
+        except Exception as e:
+            print(f"❌ Error loading embedding model: {e}")
+            embedding_model = None
+            query_embedder = None
+    
+    # Memory-mapped artifact: vectors and index pages are shared through the OS page cache,
+    # document text is read lazily for the top-k hits only
+    try:
+        vector_store = _timed("vector_store", load_vector_store, STORE_PATH, embedding_model, INDEX_SEARCH_PARAMS)
+        INDEX_VERSION = vector_store.version
+        print(f"✅ Loaded vector store from: {STORE_PATH} ({len(vector_store)} documents, version {INDEX_VERSION})")
+        manifest = getattr(vector_store, "manifest", None)  # artifacts only; the legacy pickle has none
+        built_with = manifest.get("embedding_revision") if manifest is not None else None
+        if manifest is not None and SEARCH_MODE != "lexical" and built_with != EMBEDDING_REVISION:
+            print(f"⚠️  Index vectors were built with embedding revision {built_with!r}, queries use "
+                  f"{EMBEDDING_REVISION!r}: rebuild with python RAG/build_index.py --full")
+    except Exception as e:
+        print(f"❌ Error loading vector store: {e}")
+        print("📝 Make sure to run: cd ai && python RAG/build_index.py")
+        vector_store = None
+        INDEX_VERSION = None
+    
+    if vector_store is not None and embedding_model is None and SEARCH_MODE != "lexical":
+        if vector_store.lexical is not None:
+            print("⚠️  Embedding model unavailable, degrading to lexical-only search")
+            SEARCH_MODE = "lexical"
+        else:
+            vector_store = None
+            INDEX_VERSION = None
+    print(f"🔎 Search mode: {SEARCH_MODE}")
+    INDEX_BYTES = _index_bytes() if vector_store is not None else None
+    
+    if vector_store is not None and IDENTIFIER_FAST_PATH:
+        try:
+            identifier_index = _timed("identifier_index", IdentifierIndex.from_db, DB_PATH)
+            identifier_rows = vector_store.doc_rows()
+            print(f"✅ Loaded {len(identifier_index)} identifier names for the fast path")
+        except Exception as e:
+            print(f"⚠️  Identifier fast path disabled: {e}")
+            identifier_index = None
+            identifier_rows = {}
+    
+    startup_state["loaded"] = True
+
+def initialize_components():
+    """
+    Load everything (unless a pre-fork parent already did), then warm up (blocking).
+    
+    Warm-up always runs in the serving process itself, so thread pools and
+    kernels are set up after any fork rather than inherited from the parent.
+    """
+    started = time.perf_counter()
+    try:
+        if not startup_state.get("loaded"):
+            load_components()
+        
+        if vector_store is not None and WARMUP_QUERIES:
+            try:
+                _timed("warmup", warm_up, WARMUP_QUERIES)
+            except Exception as e:
+                print(f"⚠️  Warm-up failed: {e}")
+        
+        timings = startup_state["timings_ms"]
+        timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        if vector_store is None:
+            # Gemini-only answers still work, but this worker must not look ready to a load balancer
+            startup_state.update(phase="degraded", error="vector store not loaded (run python RAG/build_index.py)")
+            print(f"⚠️  Degraded after {timings['total']:.0f} ms: no vector store, /ready answers 503")
+            return
+        startup_state.update(ready=True, phase="ready")
+        print(f"✅ Ready in {timings['total']:.0f} ms {timings}")
+        
+    except Exception as e:
+        startup_state.update(phase="failed", error=str(e))
+        print(f"❌ Initialization failed: {e}")
+
+def _require_ready():
+    # A degraded worker (no vector store) still answers, from Gemini alone
+    if not startup_state["ready"] and startup_state["phase"] != "degraded":
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service warming up ({startup_state['phase']})",
+            headers={"Retry-After": "2"}
+        )
+
+# Query caches: normalized query -> embedding, (normalized query, k) -> scored results.
+# Embeddings are tagged with the embedding model revision (a rebuilt index doesn't change them),
+# results with the loaded index version. The store is loaded once per process: restart the
+# server (or its workers) to serve a rebuilt index.
+QUERY_CACHE_CONFIG = config["retrieval"].get("query_cache") or {}
+_query_cache_kwargs = dict(
+    max_entries=QUERY_CACHE_CONFIG.get("max_entries", 2048),
+    max_bytes=int(QUERY_CACHE_CONFIG.get("max_mb", 64) * 1024 * 1024),
+    ttl_s=QUERY_CACHE_CONFIG.get("ttl_s", 3600),
+)
+embedding_cache = LRUCache(**_query_cache_kwargs)
+search_cache = LRUCache(**_query_cache_kwargs)
+
+# LLM answer cache with single-flight de-duplication of identical requests
+answer_cache = make_answer_cache(config.get("answer_cache"))
+
+# Prometheus metrics (GET /metrics); callbacks read existing counters at scrape time
+ANSWERS = REGISTRY.counter("rag_answers_total", "Answers by reported method and internal route", ["method", "route"])
+
+def _cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {"embeddings": embedding_cache.stats(), "results": search_cache.stats(), "answers": answer_cache.stats()}
+
+def _index_bytes() -> int:
+    if STORE_PATH.is_file():
+        return STORE_PATH.stat().st_size
+    return sum(f.stat().st_size for f in STORE_PATH.rglob("*") if f.is_file())
+
+REGISTRY.gauge("rag_cache_hit_ratio", "Hit ratio of the query and answer caches", ["cache"],
+               fn=lambda: {(name,): stats["hit_ratio"] for name, stats in _cache_stats().items()})
+REGISTRY.counter("rag_cache_lookups_total", "Cache lookups by result", ["cache", "result"],
+                 fn=lambda: {(name, result): stats[result] for name, stats in _cache_stats().items()
+                             for result in ("hits", "misses")})
+REGISTRY.gauge("rag_cache_entries", "Entries held by each cache", ["cache"],
+               fn=lambda: {("embeddings",): len(embedding_cache), ("results",): len(search_cache),
+                           ("answers",): answer_cache.backend.size()})
+REGISTRY.gauge("rag_requests_in_flight", "Requests holding an admission slot", fn=lambda: admission.in_flight)
+REGISTRY.gauge("rag_requests_waiting", "Requests queued for an admission slot", fn=lambda: admission.waiting)
+REGISTRY.counter("rag_requests_rejected_total", "Requests rejected by admission control", ["reason"],
+                 fn=lambda: {("queue_full",): admission.rejected_queue_full, ("timeout",): admission.rejected_timeout})
+REGISTRY.gauge("rag_index_documents", "Documents in the loaded vector store",
+               fn=lambda: len(vector_store) if vector_store is not None else None)
+REGISTRY.gauge("rag_index_bytes", "On-disk size of the loaded vector store", fn=lambda: INDEX_BYTES)
+REGISTRY.gauge("rag_index_info", "Loaded index version, type and search mode (always 1)",
+               ["version", "type", "search_mode"],
+               fn=lambda: {(INDEX_VERSION, (getattr(vector_store, "manifest", {}).get("index") or {}).get("type", "flat"),
+                            SEARCH_MODE): 1} if vector_store is not None else None)
+REGISTRY.gauge("rag_ready", "1 once models and index are loaded and warm", fn=lambda: int(startup_state["ready"]))
+REGISTRY.histogram("rag_embedding_batch_size", "Queries per micro-batched embedding call", buckets=BATCH_SIZE_BUCKETS,
+                   fn=lambda: query_embedder.batch_sizes if isinstance(query_embedder, MicroBatchEmbedder) else None)
+REGISTRY.histogram("rag_embedding_queue_wait_ms", "Time queries wait for their embedding micro-batch",
+                   fn=lambda: query_embedder.queue_wait_ms if isinstance(query_embedder, MicroBatchEmbedder) else None)
 
 # Configuration thresholds
 RAG_CONFIDENCE_THRESHOLD = 0.7  # If best RAG result score < 0.7, consider it good
 GEMINI_FALLBACK_THRESHOLD = 1.2  # If best RAG result score > 1.2, use Gemini
 
+GEOLIFT_INDICATORS = KeywordMatcher([
+    'geolift', 'holdout', 'effect size', 'power analysis', 'synthetic control',
+    'treatment', 'control', 'market selection', 'lookback window', 'alpha',
+    'statistical significance', 'lift', 'incrementality', 'cpic', 'mde',
+    'minimum detectable effect', 'fixed effects', 'correlation',
+    'exclude', 'include', 'market', 'location', 'budget', 'investment',
+    'experiment', 'test', 'analysis', 'parameter', 'setting'
+])
+
 def is_geolift_question(query: str) -> bool:
-    """Determine if a question is likely about GeoLift/experimentation"""
-    geolift_indicators = [
-        'geolift', 'holdout', 'effect size', 'power analysis', 'synthetic control',
-        'treatment', 'control', 'market selection', 'lookback window', 'alpha',
-        'statistical significance', 'lift', 'incrementality', 'cpic', 'mde',
-        'minimum detectable effect', 'fixed effects', 'correlation',
-        'exclude', 'include', 'market', 'location', 'budget', 'investment',
-        'experiment', 'test', 'analysis', 'parameter', 'setting'
-    ]
+    """Determine if a question is likely about GeoLift/experimentation (any indicator as a substring)"""
+    return GEOLIFT_INDICATORS.search(query.lower())
+
+def identifier_response(query: str, debug: bool = False) -> Optional[QueryResponse]:
+    """
+    Answer a question that only names one parameter or term ("what is effect_size",
+    "explain Synthetic Control") straight from its document: no embedding, search or LLM.
+    Returns None when the fast path does not apply.
+    """
+    if identifier_index is None:
+        return None
+    with span("identifier"):
+        match = identifier_index.match(query)
+    if match is None:
+        return None
+    rows = [identifier_rows[doc_id] for doc_id in match.doc_ids if doc_id in identifier_rows]
+    views = vector_store.get_views(rows)
+    hits = [SearchHit(views[row], 0.0) for row in rows if row in views]
+    if not hits:
+        return None
     
-    query_lower = query.lower()
-    return any(indicator in query_lower for indicator in geolift_indicators)
+    rag_response = format_rag_answer(query, hits)
+    ANSWERS.labels("rag", "identifier").inc()
+    annotate(route="identifier", identifier=match.name)
+    return QueryResponse(
+        answer=rag_response["answer"],
+        sources=rag_response["sources"],
+        method="rag",
+        confidence=rag_response["confidence"],
+        debug_info={
+            'rag_documents': [describe_doc(hit, i + 1, "exact identifier match") for i, hit in enumerate(hits[:3])],
+            'matched_identifier': match.name,
+            'enhancement_applied': False,
+            'decision_reason': f"Query names '{match.name}' directly, answered from its document without search",
+            'total_documents_searched': 0
+        } if debug else {}
+    )
+
+def search_store(queries: List[str], matrix: Optional[np.ndarray], k: int) -> List[List[SearchHit]]:
+    """Search the store in the configured mode (`matrix` holds the query embeddings, unused for lexical)"""
+    if SEARCH_MODE == "lexical":
+        return [vector_store.lexical_hits(query, k) for query in queries]
+    if SEARCH_MODE == "hybrid":
+        return vector_store.hybrid_hits(
+            queries, matrix, k,
+            candidates=LEXICAL_CONFIG.get("candidates", 20),
+            rrf_k=LEXICAL_CONFIG.get("rrf_k", 60)
+        )
+    return vector_store.search_hits(matrix, k)
+
+def stored_embedding(cache_key: str) -> Optional[np.ndarray]:
+    """Read-only lookup in the persistent embedding cache (worker pool only: it reads SQLite)"""
+    if persistent_embeddings is None:
+        return None
+    try:
+        with span("embedding_store"):
+            return persistent_embeddings.get(cache_key)
+    except sqlite3.Error as e:
+        log.warning("Embedding store lookup failed: %s", e)
+        return None
+
+def store_embedding(cache_key: str, vector):
+    """Queue a new query vector for the next write-behind flush"""
+    if persistent_embeddings is not None:
+        persistent_embeddings.put(cache_key, vector)
 
-def semantic_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
-    """Perform semantic search using FAISS vector similarity"""
+def semantic_search(query: str, k: int = 5) -> List[SearchHit]:
+    """Perform semantic search using FAISS vector similarity (best hit first)"""
     if not vector_store:
         return []
     
+    cache_key = normalize_query(query)
+    cached = search_cache.get((cache_key, k), version=INDEX_VERSION)
+    if cached is not None:
+        return list(cached)
+    
     try:
-        docs = vector_store.similarity_search_with_score(query, k=k)
-        
-        results = []
-        for doc, score in docs:
-            metadata = doc.metadata
-            content = doc.page_content
-            
-            result = {
-                'content': content,
-                'score': float(score),
-                'metadata': metadata,
-                'type': metadata.get('section', 'unknown'),
-                'source': metadata.get('source', 'unknown')
-            }
-            results.append(result)
+        matrix = None
+        if SEARCH_MODE != "lexical":
+            embedding = embedding_cache.get(cache_key, version=EMBEDDING_REVISION)
+            if embedding is None:
+                embedding = stored_embedding(cache_key)
+                if embedding is None:
+                    with span("embed"):
+                        embedding = query_embedder.embed_query(query)
+                    store_embedding(cache_key, embedding)
+                embedding_cache.put(cache_key, embedding, version=EMBEDDING_REVISION)
+            matrix = np.asarray([embedding], dtype=np.float32)
         
-        results.sort(key=lambda x: x['score'])
+        with span("search"):
+            results = search_store([query], matrix, k)[0]
+        search_cache.put((cache_key, k), tuple(results), version=INDEX_VERSION)
         return results
         
     except Exception as e:
-        print(f"❌ Error in semantic search: {e}")
+        log.error("Semantic search failed: %s", e, exc_info=True)
         return []
 
-def query_gemini_with_context(query: str, rag_context: str = None) -> Optional[str]:
-    """Query Gemini with RAG context for enhanced responses"""
-    if not gemini_model:
-        return None
+def semantic_search_batch(queries: List[str], k: int = 5) -> List[List[SearchHit]]:
+    """
+    Semantic search for many queries at once.
+    Uncached queries are embedded as one matrix and searched with a single FAISS call.
+    """
+    if not vector_store:
+        return [[] for _ in queries]
     
-    try:
-        if rag_context:
-            # RAG-enhanced response: Use retrieved knowledge + LLM generation
-            context_prompt = f"""Based on this GeoLift knowledge:
+    cache_keys = [normalize_query(q) for q in queries]
+    all_results: List[Optional[Sequence[SearchHit]]] = [
+        search_cache.get((key, k), version=INDEX_VERSION) for key in cache_keys
+    ]
+    pending = [i for i, cached in enumerate(all_results) if cached is None]
+    
+    if pending:
+        try:
+            matrix = None
+            if SEARCH_MODE != "lexical":
+                # Reuse cached embeddings, embed the rest in one forward pass
+                embeddings = {i: embedding_cache.get(cache_keys[i], version=EMBEDDING_REVISION) for i in pending}
+                for i in pending:
+                    if embeddings[i] is None:
+                        embeddings[i] = stored_embedding(cache_keys[i])
+                        if embeddings[i] is not None:
+                            embedding_cache.put(cache_keys[i], embeddings[i], version=EMBEDDING_REVISION)
+                to_embed = [i for i in pending if embeddings[i] is None]
+                if to_embed:
+                    with span("embed_batch"):
+                        vectors = embedding_model.embed_documents([queries[i] for i in to_embed])
+                    for i, vector in zip(to_embed, vectors):
+                        embeddings[i] = vector
+                        store_embedding(cache_keys[i], vector)
+                        embedding_cache.put(cache_keys[i], vector, version=EMBEDDING_REVISION)
+                matrix = np.asarray([embeddings[i] for i in pending], dtype=np.float32)
+            
+            with span("search_batch"):
+                hits_per_query = search_store([queries[i] for i in pending], matrix, k)
+            
+            for i, hits in zip(pending, hits_per_query):
+                search_cache.put((cache_keys[i], k), tuple(hits), version=INDEX_VERSION)
+                all_results[i] = hits
+                
+        except Exception as e:
+            log.error("Batch semantic search failed: %s", e, exc_info=True)
+            for i in pending:
+                all_results[i] = []
+    
+    return [list(results) for results in all_results]
+
+# Prompt templates (their hashes are part of the answer cache key)
+RAG_CONTEXT_PROMPT = """Based on this GeoLift knowledge:
 
 {rag_context}
 
@@ -199,25 +606,101 @@ Guidelines:
 - Focus on practical, actionable guidance
 
 Provide a clear, focused response:"""
-        else:
-            # General question without RAG context
-            context_prompt = f"""You are an AI assistant helping with marketing experimentation and data analysis. 
+
+GENERAL_PROMPT = """You are an AI assistant helping with marketing experimentation and data analysis. 
             Please provide a helpful, concise answer to the following question. Keep your response practical and actionable.
             
             Question: {query}"""
-        
-        response = gemini_model.generate_content(context_prompt)
-        return response.text
-        
-    except Exception as e:
-        print(f"❌ Error querying Gemini: {e}")
+
+RAG_CONTEXT_PROMPT_HASH = template_hash(RAG_CONTEXT_PROMPT)
+GENERAL_PROMPT_HASH = template_hash(GENERAL_PROMPT)
+
+def build_gemini_prompt(query: str, rag_context: str = None) -> str:
+    """Build the Gemini prompt, with or without RAG context"""
+    if rag_context:
+        # RAG-enhanced response: Use retrieved knowledge + LLM generation
+        return RAG_CONTEXT_PROMPT.format(rag_context=rag_context, query=query)
+    # General question without RAG context
+    return GENERAL_PROMPT.format(query=query)
+
+def gemini_answer_key(query: str, rag_context: str = None, doc_ids: Sequence[str] = ()) -> str:
+    """Answer cache key for a Gemini call"""
+    prompt_hash = RAG_CONTEXT_PROMPT_HASH if rag_context else GENERAL_PROMPT_HASH
+    return answer_key(query, doc_ids, GEMINI_MODEL_NAME, prompt_hash)
+
+def query_gemini_with_context(query: str, rag_context: str = None, doc_ids: Sequence[str] = ()) -> Optional[str]:
+    """Query Gemini with RAG context for enhanced responses (blocking)"""
+    if not gemini_model:
         return None
+    
+    prompt = build_gemini_prompt(query, rag_context)
+    
+    def call_gemini():
+        try:
+            with span("gemini"):
+                response = gemini_upstream.call(lambda timeout: gemini_model.generate_content(prompt, timeout=timeout))
+            return response.text
+        except UpstreamError as e:
+            log.warning("Gemini call failed: %s", e)
+            return None
+    
+    return answer_cache.get_or_compute(gemini_answer_key(query, rag_context, doc_ids), call_gemini)
+
+async def query_gemini_with_context_async(query: str, rag_context: str = None, doc_ids: Sequence[str] = (),
+                                          deadline_s: Optional[float] = None) -> Optional[str]:
+    """Query Gemini with RAG context without blocking the event loop, within `deadline_s` when given"""
+    if not gemini_model:
+        return None
+    
+    prompt = build_gemini_prompt(query, rag_context)
+    
+    async def call_gemini():
+        try:
+            with span("gemini"):
+                response = await gemini_upstream.acall(lambda: gemini_model.generate_content_async(prompt),
+                                                       deadline_s=deadline_s)
+            return response.text
+        except UpstreamError as e:
+            log.warning("Gemini call failed: %s", e)
+            return None
+    
+    return await answer_cache.aget_or_compute(gemini_answer_key(query, rag_context, doc_ids), call_gemini)
 
 def query_gemini(query: str) -> Optional[str]:
     """Legacy method for backward compatibility"""
     return query_gemini_with_context(query)
 
-def format_rag_answer(query: str, search_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+async def query_gemini_async(query: str, deadline_s: Optional[float] = None) -> Optional[str]:
+    """General (no RAG context) Gemini query without blocking the event loop"""
+    return await query_gemini_with_context_async(query, deadline_s=deadline_s)
+
+async def stream_gemini(query: str, rag_context: str = None, doc_ids: Sequence[str] = (),
+                        deadline_s: Optional[float] = None):
+    """
+    Yield Gemini answer chunks as they are generated, within `deadline_s` when given.
+    A cached answer is yielded as one chunk; a completed stream is added to the cache.
+    Errors are raised to the caller (as UpstreamError), which decides how to degrade.
+    """
+    key = gemini_answer_key(query, rag_context, doc_ids)
+    cached = await answer_cache.aget(key)
+    if cached is not None:
+        yield cached
+        return
+    
+    started = time.perf_counter()
+    prompt = build_gemini_prompt(query, rag_context)
+    parts = []
+    async for chunk in gemini_upstream.astream(lambda: gemini_model.generate_content_async(prompt, stream=True),
+                                               deadline_s=deadline_s):
+        text = chunk.text
+        if text:
+            parts.append(text)
+            yield text
+    record_span("gemini_stream", started)
+    if parts:
+        await answer_cache.aput(key, "".join(parts))
+
+def format_rag_answer(query: str, search_results: List[SearchHit]) -> Dict[str, Any]:
     """Format RAG search results into an answer"""
     if not search_results:
         return {
@@ -227,46 +710,24 @@ def format_rag_answer(query: str, search_results: List[Dict[str, Any]]) -> Dict[
         }
     
     best_match = search_results[0]
-    confidence = max(0.0, min(1.0, (2.0 - best_match['score']) / 2.0))  # Convert score to 0-1 confidence
+    confidence = max(0.0, min(1.0, (2.0 - best_match.score) / 2.0))  # Convert score to 0-1 confidence
     
     answer_parts = []
     sources = []
     
-    # Add the primary answer
-    metadata = best_match['metadata']
-    content = best_match['content']
-    
-    if best_match['type'] == 'generic':
-        term_name = metadata.get('term', 'Unknown')
-        answer_parts.append(f"**{term_name}**: {content}")
-        sources.append(f"Generic concept: {term_name}")
-        
-    elif best_match['type'] in ['input', 'output']:
-        param_name = metadata.get('param', 'Unknown')
-        function_name = metadata.get('function', 'Unknown')
-        package_name = metadata.get('package', 'Unknown')
-        
-        lines = content.split('\n')
-        param_title = lines[0] if lines else param_name
-        explanation = '\n'.join(lines[1:]) if len(lines) > 1 else content
-        
-        answer_parts.append(f"**{param_title}**: {explanation}")
-        sources.append(f"{package_name}.{function_name}.{param_name}")
+    # Add the primary answer (display fields are precomputed per document)
+    doc = best_match.doc
+    if doc.label:
+        answer_parts.append(f"**{doc.title}**: {doc.explanation}")
+        sources.append(doc.label)
     
     # Add related concepts if confidence is reasonable
     if confidence > 0.3:
-        related_items = []
-        for result in search_results[1:3]:
-            if result['score'] < 1.5:  # Only reasonably similar items
-                meta = result['metadata']
-                if result['type'] == 'generic':
-                    term = meta.get('term', 'Unknown')
-                    related_items.append(f"**{term}**: {result['content'][:100]}...")
-                elif result['type'] in ['input', 'output']:
-                    param = meta.get('param', 'Unknown')
-                    lines = result['content'].split('\n')
-                    desc = lines[1] if len(lines) > 1 else lines[0] if lines else ""
-                    related_items.append(f"**{param}**: {desc[:100]}...")
+        related_items = [
+            f"**{hit.doc.name}**: {hit.doc.summary[:100]}..."
+            for hit in search_results[1:3]
+            if hit.score < 1.5 and hit.doc.label  # Only reasonably similar items
+        ]
         
         if related_items:
             answer_parts.append("\n**Related concepts**:")
@@ -288,234 +749,617 @@ async def root():
         "gemini_available": gemini_model is not None
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until models and index are loaded and warmed up, and while degraded"""
+    body = {
+        "ready": startup_state["ready"],
+        "phase": startup_state["phase"],
+        "timings_ms": startup_state["timings_ms"],
+        "error": startup_state["error"]
+    }
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 @app.get("/health")
-async def health_check():
-    return {
+async def health_check(memory: bool = False):
+    """Liveness and serving stats; `?memory=1` adds this worker's memory split (reads /proc smaps)"""
+    body = {
         "status": "healthy",
+        "ready": startup_state["ready"],
+        "startup": startup_state,
         "vector_store_loaded": vector_store is not None,
         "gemini_available": gemini_model is not None,
+        "upstream": gemini_upstream.stats(),
         "embedding_model": EMBEDDING_MODEL,
-        "device": device
+        "embedding_backend": EMBEDDING_BACKEND,
+        "search_mode": SEARCH_MODE,
+        "device": device,
+        "cpu_workers": CPU_WORKERS,
+        "torch_threads": TORCH_THREADS,
+        "pid": os.getpid(),
+        "admission": admission.stats(),
+        "index_version": INDEX_VERSION,
+        "index": getattr(vector_store, "manifest", {}).get("index"),
+        "query_cache": {
+            "embeddings": embedding_cache.stats(),
+            "results": search_cache.stats(),
+            "persistent_embeddings": persistent_embeddings.stats() if persistent_embeddings is not None else None
+        },
+        "answer_cache": answer_cache.stats(),
+        "embedding_batches": query_embedder.stats() if isinstance(query_embedder, MicroBatchEmbedder) else None,
+        "streaming": {
+            "ttfb_ms": stream_ttfb_ms.snapshot(),
+            "first_token_ms": stream_first_token_ms.snapshot(),
+            "total_ms": stream_total_ms.snapshot()
+        }
     }
+    if memory:
+        body["memory_kb"] = prefork.memory_usage(os.getpid())
+    return body
 
 @app.post("/ask", response_model=QueryResponse)
 async def ask_question(request: QueryRequest):
     """
     RAG-first approach: Always retrieve knowledge, then enhance with LLM
     """
+    _require_ready()
+    try:
+        async with admission.slot():
+            return await _answer_query(request)
+    except Overloaded as e:
+        raise _overloaded_response(e)
+
+def _overloaded_response(e: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.reason,
+        headers={"Retry-After": str(max(1, round(e.retry_after)))}
+    )
+
+async def _answer_query(request: QueryRequest) -> QueryResponse:
+    """Retrieve, route and answer a single query (runs inside an admission slot)"""
     try:
         query = request.query.strip()
-        print(f"🔍 Processing query: '{query}'")
-        
-        # Step 1: Always try RAG search first to get relevant knowledge
-        search_results = semantic_search(query, k=5)
-        rag_response = format_rag_answer(query, search_results)
+        log.debug("Processing query", extra={"fields": {"query": query}})
         
-        # Determine question characteristics
-        is_geolift_related = is_geolift_question(query)
-        rag_confidence = rag_response['confidence']
-        best_score = search_results[0]['score'] if search_results else 999
+        response = identifier_response(query, request.debug)
+        if response is None:
+            budget = request_budget(request.budget_ms)
+            speculation = start_speculation(query, budget)
+            try:
+                # Step 1: Always try RAG search first to get relevant knowledge
+                search_results = await run_cpu_bound(semantic_search, query, k=5)
+                response = await answer_from_results(query, search_results, debug=request.debug,
+                                                     budget=budget, speculation=speculation)
+            finally:
+                if speculation is not None:
+                    speculation.cancel()  # no-op once answer_from_results has used or cancelled it
+        if request.debug:
+            attach_trace(response.debug_info)
+        return response
         
-        print(f"📊 RAG confidence: {rag_confidence:.3f}, Best score: {best_score:.3f}")
-        print(f"🏷️  GeoLift related: {is_geolift_related}")
-        
-        # Step 2: Decide between pure RAG and RAG + LLM enhancement
-        # For excellent matches (< 0.5), use pure RAG to avoid verbosity/hallucination
-        if is_geolift_related and best_score < 0.5:
-            # Excellent match -> Use pure RAG (more concise, accurate)
-            print("✅ Using RAG only (excellent match, high confidence)")
-            debug_info = {
-                'rag_documents': [],  # Will be populated below
-                'best_similarity_score': best_score,
-                'rag_confidence': rag_confidence,
-                'enhancement_applied': False,
-                'decision_reason': f"Excellent similarity score {best_score:.3f} < 0.5 threshold, using direct RAG",
-                'total_documents_searched': len(search_results)
-            }
-            
-            # Populate rag_documents for consistency
-            if search_results:
-                for i, result in enumerate(search_results[:1]):  # Show top 1 for pure RAG
-                    metadata = result['metadata']
-                    doc_info = {
-                        'rank': i + 1,
-                        'score': round(result['score'], 3),
-                        'type': result['type'],
-                        'similarity_reason': f"Vector similarity score: {result['score']:.3f} (excellent match)"
-                    }
-                    
-                    if result['type'] == 'generic':
-                        term_name = metadata.get('term', 'Unknown')
-                        doc_info.update({
-                            'document': term_name,
-                            'category': 'Generic Concept',
-                            'source': metadata.get('package', 'Generic')
-                        })
-                    elif result['type'] in ['input', 'output']:
-                        param_name = metadata.get('param', 'Unknown')
-                        function_name = metadata.get('function', 'Unknown')
-                        package_name = metadata.get('package', 'Unknown')
-                        doc_info.update({
-                            'document': param_name,
-                            'category': f'{result["type"].title()} Parameter',
-                            'function': function_name,
-                            'package': package_name,
-                            'source': f"{package_name}.{function_name}"
-                        })
-                    
-                    debug_info['rag_documents'].append(doc_info)
+    except Exception as e:
+        log.error("Error processing query: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+def attach_trace(debug_info: Dict[str, Any]):
+    """Add the request's spans to debug_info (tracing.debug_spans)"""
+    trace = debug_trace()
+    if trace is not None:
+        debug_info['trace'] = trace
+
+def request_budget(budget_ms: Optional[float]) -> Budget:
+    """The request's latency budget (or the server default), counted from when the request arrived"""
+    trace = current_trace()
+    return Budget(budget_ms if budget_ms is not None else DEFAULT_BUDGET_MS, trace.started if trace else None)
+
+def start_speculation(query: str, budget: Optional[Budget]) -> Optional[SpeculativeCall]:
+    """
+    Start the general Gemini call before retrieval finishes, when the early signal
+    (not a GeoLift question) predicts the 'gemini' route and the call fits the budget
+    """
+    if not SPECULATION_ENABLED or gemini_model is None or not gemini_upstream.available:
+        return None
+    if is_geolift_question(query) or not SpeculativeCall.has_capacity(SPECULATION_MAX_IN_FLIGHT):
+        return None
+    decision = budget_decide(budget, gemini_upstream.latency, "gemini", BUDGET_QUANTILE,
+                             BUDGET_MIN_SAMPLES, BUDGET_HEADROOM_MS)
+    if decision['decision'] == 'over_budget':
+        if not answer_cache.contains(gemini_answer_key(query)):
+            return None
+        decision['decision'] = 'cached'
+    deadline_s = budget.remaining_s() if budget is not None and decision['decision'] != 'cached' else None
+    return SpeculativeCall(query_gemini_async(query, deadline_s=deadline_s), decision)
+
+async def answer_from_results(query: str, search_results: List[SearchHit],
+                              llm_semaphore: Optional[asyncio.Semaphore] = None,
+                              debug: bool = False, budget: Optional[Budget] = None,
+                              speculation: Optional[SpeculativeCall] = None) -> QueryResponse:
+    """
+    Route a query given its search results: pure RAG, RAG + Gemini, Gemini only or fallback.
+    LLM calls are gated by `llm_semaphore` when one is given and bounded by what is left of
+    `budget`; a `speculation` already running the general Gemini call is used for the
+    'gemini' route and cancelled for any other. debug_info is only built when `debug` is set.
+    """
+    with span("format"):
+        rag_response = format_rag_answer(query, search_results)
+    llm_slot = llm_semaphore or contextlib.nullcontext()
+    with span("route"):
+        plan = plan_route(query, search_results, rag_response, budget, speculation)
+    if speculation is not None and plan['route'] != 'gemini':
+        speculation.cancel()
+    
+    # Step 3: Good matches that benefit from LLM enhancement
+    if plan['route'] == 'rag_enhanced':
+        async with llm_slot:
+            deadline_s = llm_deadline_s(plan, budget)
+            enhanced_answer = None
+            if deadline_s != 0:  # 0: the budget ran out while waiting for an LLM slot
+                enhanced_answer = await query_gemini_with_context_async(
+                    query, plan['rag_context'], plan['doc_ids'], deadline_s=deadline_s)
+        if enhanced_answer:
+            ANSWERS.labels("rag_enhanced", "rag_enhanced").inc()
+            annotate(route="rag_enhanced")
+            return finish_budget(plan, enhanced_response(plan, rag_response, search_results, enhanced_answer, debug),
+                                 debug)
+        plan['route'] = fallback_route(plan['is_geolift_related'], plan['best_score'], search_results)
+    
+    elif plan['route'] == 'gemini':
+        # General question with poor RAG match -> Use Gemini only
+        async with llm_slot:
+            deadline_s = llm_deadline_s(plan, budget)
+            gemini_answer = None
+            if speculation is not None:
+                gemini_answer = await speculation.use()  # started during retrieval
+            elif deadline_s != 0:
+                gemini_answer = await query_gemini_async(query, deadline_s=deadline_s)
+        if gemini_answer:
+            ANSWERS.labels("gemini", "gemini").inc()
+            annotate(route="gemini")
+            return finish_budget(plan, gemini_response(gemini_answer), debug)
+        plan['route'] = fallback_route(plan['is_geolift_related'], plan['best_score'], search_results)
+    
+    mark_exhausted(plan, budget)
+    ANSWERS.labels(route_method(plan['route']), plan['route']).inc()
+    annotate(route=plan['route'])
+    return finish_budget(plan, rag_route_response(plan, rag_response, search_results, debug), debug)
+
+def llm_deadline_s(plan: Dict[str, Any], budget: Optional[Budget]) -> Optional[float]:
+    """Time left for the planned LLM call: the rest of the budget, or None when unbounded"""
+    if budget is None or plan.get('budget', {}).get('decision') == 'cached':
+        return None  # a cached answer is served whatever the budget
+    return budget.remaining_s()
+
+def mark_exhausted(plan: Dict[str, Any], budget: Optional[Budget]):
+    """Record that a planned LLM call gave no answer because the budget ran out"""
+    if budget is not None and 'budget' in plan and plan['budget']['decision'] != 'cached':
+        remaining = budget.remaining_ms()
+        if remaining is not None and remaining <= 0:
+            plan['budget']['decision'] = 'exhausted'
+
+def finish_budget(plan: Dict[str, Any], response: QueryResponse, debug: bool = False) -> QueryResponse:
+    """Record the plan's latency budget decision (if an LLM route was considered) on the response"""
+    decision = plan.get('budget')
+    if decision is not None:
+        record_budget_decision(decision)
+        annotate(budget_decision=decision['decision'])
+        response.budget_decision = decision['decision']
+        if debug:
+            response.debug_info['budget'] = decision
+    return response
+
+def plan_route(query: str, search_results: List[SearchHit], rag_response: Dict[str, Any],
+               budget: Optional[Budget] = None, speculation: Optional[SpeculativeCall] = None) -> Dict[str, Any]:
+    """
+    Decide how a query will be answered, before any LLM call is made.
+    
+    Routes: 'rag_excellent', 'rag_enhanced', 'gemini', or one of the non-LLM
+    routes from fallback_route(). For 'rag_enhanced' the plan also carries the
+    context and document ids for the Gemini call. An LLM route is only kept if
+    Gemini's recent latency fits in what is left of `budget`; the decision is
+    in plan['budget'] (for a speculative 'gemini' call, the one made when it started).
+    """
+    # Determine question characteristics
+    is_geolift_related = is_geolift_question(query)
+    rag_confidence = rag_response['confidence']
+    best_score = search_results[0].score if search_results else 999
+    
+    annotate(rag_confidence=round(rag_confidence, 3), best_score=round(best_score, 3),
+             is_geolift_related=is_geolift_related)
+    
+    plan = {
+        'is_geolift_related': is_geolift_related,
+        'rag_confidence': rag_confidence,
+        'best_score': best_score,
+    }
+    
+    # While Gemini's circuit is open, answer from RAG right away instead of waiting out timeouts
+    llm_available = gemini_model is not None and gemini_upstream.available
+    
+    # Step 2: Decide between pure RAG and RAG + LLM enhancement
+    # For excellent matches (< 0.5), use pure RAG to avoid verbosity/hallucination
+    if is_geolift_related and best_score < 0.5:
+        plan['route'] = 'rag_excellent'
+    elif llm_available and search_results and best_score < 1.2:
+        plan['route'] = 'rag_enhanced'
+        # Use fewer documents for enhancement to keep it concise
+        docs_to_use = min(2, len(search_results))  # Use top 2 documents max
+        plan.update({
+            'docs_to_use': docs_to_use,
+            'rag_context': build_rag_context(search_results[:docs_to_use]),
+            'doc_ids': [hit.doc.doc_id for hit in search_results[:docs_to_use]],
+        })
+    elif llm_available and not is_geolift_related and best_score > 1.2:
+        plan['route'] = 'gemini'
+    else:
+        if gemini_model is not None and not llm_available and (
+                (search_results and best_score < 1.2) or (not is_geolift_related and best_score > 1.2)):
+            gemini_upstream.short_circuited()
+        plan['route'] = fallback_route(is_geolift_related, best_score, search_results)
+    
+    if plan['route'] == 'gemini' and speculation is not None:
+        plan['budget'] = speculation.budget_decision  # the call is already running
+    elif plan['route'] in ('rag_enhanced', 'gemini'):
+        apply_budget(query, plan, budget, search_results)
+    return plan
+
+def apply_budget(query: str, plan: Dict[str, Any], budget: Optional[Budget], search_results: List[SearchHit]):
+    """Fall back to the pure-RAG route when the planned Gemini call won't fit the remaining budget"""
+    decision = budget_decide(budget, gemini_upstream.latency, "gemini", BUDGET_QUANTILE,
+                             BUDGET_MIN_SAMPLES, BUDGET_HEADROOM_MS)
+    if decision['decision'] == 'over_budget':
+        if answer_cache.contains(gemini_answer_key(query, plan.get('rag_context'), plan.get('doc_ids', ()))):
+            decision['decision'] = 'cached'
+        else:
+            plan['route'] = fallback_route(plan['is_geolift_related'], plan['best_score'], search_results)
+    plan['budget'] = decision
+
+def fallback_route(is_geolift_related: bool, best_score: float, search_results: List[SearchHit]) -> str:
+    """Non-LLM route, used directly or when an LLM call fails"""
+    if is_geolift_related and best_score < RAG_CONFIDENCE_THRESHOLD:
+        return 'rag_confident'
+    if is_geolift_related and search_results:
+        return 'rag_disclaimer'
+    if search_results:
+        return 'rag_fallback'
+    return 'fallback'
+
+def route_method(route: str) -> str:
+    """Public `method` reported for a route"""
+    return route if route in ('rag_enhanced', 'gemini', 'fallback') else 'rag'
+
+def describe_doc(hit: SearchHit, rank: int, reason: str) -> Dict[str, Any]:
+    """One entry of debug_info.rag_documents"""
+    return {
+        'rank': rank,
+        'score': round(hit.score, 3),
+        'type': hit.doc.section,
+        'similarity_reason': f"Vector similarity score: {hit.score:.3f} ({reason})",
+        **hit.doc.describe
+    }
+
+def build_rag_context(results: List[SearchHit]) -> str:
+    """Build the Gemini context from RAG results"""
+    return "".join(f"{hit.doc.context}\n\n" for hit in results if hit.doc.context)
+
+def enhanced_response(plan: Dict[str, Any], rag_response: Dict[str, Any],
+                      search_results: List[SearchHit], enhanced_answer: str, debug: bool = False) -> QueryResponse:
+    """Response for a successful RAG + Gemini enhancement"""
+    return QueryResponse(
+        answer=enhanced_answer,
+        sources=rag_response["sources"] + ["Enhanced by Gemini AI"],
+        method="rag_enhanced",
+        confidence=enhanced_confidence(plan),
+        debug_info=enhanced_debug_info(plan, search_results) if debug else {}
+    )
+
+def enhanced_confidence(plan: Dict[str, Any]) -> float:
+    # Calculate consistent confidence (don't artificially boost)
+    return min(0.9, plan['rag_confidence'] + 0.1)  # Modest boost for enhancement
+
+def enhanced_debug_info(plan: Dict[str, Any], search_results: List[SearchHit]) -> Dict[str, Any]:
+    return {
+        'rag_documents': [
+            describe_doc(hit, i + 1, "good match for enhancement")
+            for i, hit in enumerate(search_results[:plan['docs_to_use']])
+        ],
+        'best_similarity_score': plan['best_score'],
+        'rag_confidence': plan['rag_confidence'],
+        'enhancement_applied': True,
+        'decision_reason': f"Good similarity score {plan['best_score']:.3f}, enhanced with LLM for natural response",
+        'context_length': len(plan['rag_context']),
+        'total_documents_searched': len(search_results),
+        'documents_used_for_context': plan['docs_to_use']
+    }
+
+def gemini_response(gemini_answer: str) -> QueryResponse:
+    return QueryResponse(
+        answer=gemini_answer,
+        sources=["Gemini AI"],
+        method="gemini",
+        confidence=0.8
+    )
+
+def excellent_debug_info(plan: Dict[str, Any], search_results: List[SearchHit]) -> Dict[str, Any]:
+    best_score = plan['best_score']
+    return {
+        # Show top 1 for pure RAG
+        'rag_documents': [describe_doc(hit, i + 1, "excellent match") for i, hit in enumerate(search_results[:1])],
+        'best_similarity_score': best_score,
+        'rag_confidence': plan['rag_confidence'],
+        'enhancement_applied': False,
+        'decision_reason': f"Excellent similarity score {best_score:.3f} < 0.5 threshold, using direct RAG",
+        'total_documents_searched': len(search_results)
+    }
+
+def rag_route_response(plan: Dict[str, Any], rag_response: Dict[str, Any],
+                       search_results: List[SearchHit], debug: bool = False) -> QueryResponse:
+    """Response for the routes that need no LLM call"""
+    route = plan['route']
+    rag_confidence = plan['rag_confidence']
+    
+    if route == 'rag_excellent':
+        # Excellent match -> Use pure RAG (more concise, accurate)
+        return QueryResponse(
+            answer=rag_response["answer"],
+            sources=rag_response["sources"],
+            method="rag",
+            confidence=rag_confidence,
+            debug_info=excellent_debug_info(plan, search_results) if debug else {}
+        )
+    
+    if route == 'rag_confident':
+        # High-confidence GeoLift question -> Use pure RAG
+        answer = rag_response["answer"]
+    elif route == 'rag_disclaimer':
+        # Medium-confidence GeoLift question -> RAG with disclaimer
+        answer = "Based on my GeoLift knowledge base:\n\n" + rag_response["answer"]
+    elif route == 'rag_fallback':
+        answer = rag_response["answer"]
+    else:
+        # Last resort
+        return QueryResponse(
+            answer="I'm not sure how to help with that. Could you ask about specific GeoLift parameters or rephrase your question?",
+            sources=[],
+            method="fallback",
+            confidence=0.0
+        )
+    
+    return QueryResponse(
+        answer=answer,
+        sources=rag_response["sources"],
+        method="rag",
+        confidence=rag_confidence
+    )
+
+@app.post("/ask/batch", response_model=BatchQueryResponse)
+async def ask_batch(request: BatchQueryRequest):
+    """
+    Answer many questions in one call. Retrieval runs as one embedding pass and a
+    single FAISS search; LLM enhancement runs concurrently up to a per-batch cap.
+    Each item carries the same routing metadata as a separate /ask call.
+    """
+    _require_ready()
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(request.queries)} queries (max {BATCH_MAX_QUERIES})"
+        )
+    
+    try:
+        async with admission.slot():
+            queries = [q.strip() for q in request.queries]
+            annotate(batch_size=len(queries))
+            budget = request_budget(request.budget_ms)
             
-            return QueryResponse(
-                answer=rag_response["answer"],
-                sources=rag_response["sources"],
-                method="rag",
-                confidence=rag_confidence,
-                debug_info=debug_info
-            )
-        
-        # Step 3: Good matches that benefit from LLM enhancement
-        elif gemini_model and search_results and best_score < 1.2:
-            # Good RAG results available -> Use RAG + Gemini enhancement
-            print("🧠 Using RAG + Gemini enhancement")
+            # Identifier questions are answered directly; only the rest are searched
+            responses: List[Optional[QueryResponse]] = [identifier_response(q, request.debug) for q in queries]
+            pending = [i for i, response in enumerate(responses) if response is None]
+            all_results = await run_cpu_bound(semantic_search_batch, [queries[i] for i in pending], k=5)
             
-            # Build context from RAG results and collect debug info
-            rag_context = ""
-            rag_documents = []
+            concurrency = min(request.max_concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)
+            llm_semaphore = asyncio.Semaphore(max(1, concurrency))
+            answered = await asyncio.gather(*(
+                answer_from_results(queries[i], results, llm_semaphore, request.debug, budget)
+                for i, results in zip(pending, all_results)
+            ))
+            for i, response in zip(pending, answered):
+                responses[i] = response
+            return BatchQueryResponse(results=responses)
+    except Overloaded as e:
+        raise _overloaded_response(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("Error processing batch: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {str(e)}")
+
+# Streaming latency: first byte (routing + sources), first LLM token, full answer
+stream_ttfb_ms = REGISTRY.histogram("rag_stream_ttfb_ms", "/ask/stream time to the meta event in ms")
+stream_first_token_ms = REGISTRY.histogram("rag_stream_first_token_ms", "/ask/stream time to the first LLM token in ms")
+stream_total_ms = REGISTRY.histogram("rag_stream_total_ms", "/ask/stream time to the done event in ms")
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that releases the request's admission slot (held by `stack`)
+    however the response ends: finished, failed, cancelled by a client disconnect,
+    or before the body iterator was ever started (e.g. a failed response start).
+    """
+
+    def __init__(self, content, stack: contextlib.AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.stack = stack
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()  # runs the generator's cleanup if it was suspended mid-stream
+            await self.stack.aclose()           # no-op when the generator already released the slot
+
+@app.post("/ask/stream")
+async def ask_stream(request: QueryRequest):
+    """
+    Same routing as /ask, streamed as server-sent events:
+    - `meta`: routing decision and sources, sent as soon as retrieval returns
+    - `token`: answer chunks from the LLM (RAG + Gemini and Gemini-only routes)
+    - `answer`: the whole answer in one event (pure RAG routes, or when the LLM fails)
+    - `done`: final method, confidence, timings and (when requested) debug_info
+    """
+    _require_ready()
+    started = time.perf_counter()
+    stack = contextlib.AsyncExitStack()
+    try:
+        await stack.enter_async_context(admission.slot())
+    except Overloaded as e:
+        raise _overloaded_response(e)
+    
+    return SlotStreamingResponse(
+        _stream_answer(request.query.strip(), stack, started, request.debug, request_budget(request.budget_ms)),
+        stack,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _stream_answer(query: str, stack: contextlib.AsyncExitStack, started: float, debug: bool = False,
+                         budget: Optional[Budget] = None):
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+    
+    async with stack:
+        try:
+            log.debug("Streaming query", extra={"fields": {"query": query}})
+            response = identifier_response(query, debug)
+            if response is not None:
+                ttfb_ms = elapsed_ms()
+                stream_ttfb_ms.observe(ttfb_ms)
+                yield sse_event("meta", {
+                    "method": response.method,
+                    "route": "identifier",
+                    "sources": response.sources,
+                    "is_geolift_related": True,
+                    "best_similarity_score": 0.0
+                })
+                yield sse_event("answer", {
+                    "answer": response.answer,
+                    "method": response.method,
+                    "sources": response.sources
+                })
+                stream_total_ms.observe(ttfb_ms)
+                if debug:
+                    attach_trace(response.debug_info)
+                yield sse_event("done", {
+                    "method": response.method,
+                    "confidence": response.confidence,
+                    "debug_info": response.debug_info,
+                    "timings": {"ttfb_ms": ttfb_ms, "first_token_ms": None, "total_ms": ttfb_ms}
+                })
+                return
             
-            # Use fewer documents for enhancement to keep it concise
-            docs_to_use = min(2, len(search_results))  # Use top 2 documents max
+            search_results = await run_cpu_bound(semantic_search, query, k=5)
+            with span("format"):
+                rag_response = format_rag_answer(query, search_results)
+            with span("route"):
+                plan = plan_route(query, search_results, rag_response, budget)
+            route = plan['route']
             
-            for i, result in enumerate(search_results[:docs_to_use]):
-                metadata = result['metadata']
-                content = result['content']
-                score = result['score']
-                
-                # Collect debug information
-                doc_info = {
-                    'rank': i + 1,
-                    'score': round(score, 3),
-                    'type': result['type'],
-                    'similarity_reason': f"Vector similarity score: {score:.3f} (good match for enhancement)"
-                }
-                
-                if result['type'] == 'generic':
-                    term_name = metadata.get('term', 'Unknown')
-                    rag_context += f"**{term_name}**: {content}\n\n"
-                    doc_info.update({
-                        'document': term_name,
-                        'category': 'Generic Concept',
-                        'source': metadata.get('package', 'Generic')
-                    })
-                elif result['type'] in ['input', 'output']:
-                    param_name = metadata.get('param', 'Unknown')
-                    function_name = metadata.get('function', 'Unknown')
-                    package_name = metadata.get('package', 'Unknown')
-                    rag_context += f"**{param_name}** (from {function_name}): {content}\n\n"
-                    doc_info.update({
-                        'document': param_name,
-                        'category': f'{result["type"].title()} Parameter',
-                        'function': function_name,
-                        'package': package_name,
-                        'source': f"{package_name}.{function_name}"
-                    })
-                
-                rag_documents.append(doc_info)
+            if route == 'rag_enhanced':
+                sources = rag_response["sources"] + ["Enhanced by Gemini AI"]
+            elif route == 'gemini':
+                sources = ["Gemini AI"]
+            else:
+                sources = rag_response["sources"]
             
-            # Get enhanced response from Gemini using RAG context
-            enhanced_answer = query_gemini_with_context(query, rag_context)
+            ttfb_ms = elapsed_ms()
+            stream_ttfb_ms.observe(ttfb_ms)
+            yield sse_event("meta", {
+                "method": route_method(route),
+                "route": route,
+                "sources": sources,
+                "is_geolift_related": plan['is_geolift_related'],
+                "best_similarity_score": plan['best_score'],
+                "budget_decision": plan.get('budget', {}).get('decision')
+            })
             
-            if enhanced_answer:
-                # Calculate consistent confidence (don't artificially boost)
-                final_confidence = min(0.9, rag_confidence + 0.1)  # Modest boost for enhancement
+            response = None
+            first_token_ms = None
+            if route in ('rag_enhanced', 'gemini'):
+                parts = []
+                deadline_s = llm_deadline_s(plan, budget)
+                try:
+                    if deadline_s != 0:  # 0: the budget ran out before the LLM step
+                        async for text in stream_gemini(query, plan.get('rag_context'), plan.get('doc_ids', ()),
+                                                        deadline_s=deadline_s):
+                            if first_token_ms is None:
+                                first_token_ms = elapsed_ms()
+                                stream_first_token_ms.observe(first_token_ms)
+                            parts.append(text)
+                            yield sse_event("token", {"text": text})
+                except UpstreamError as e:
+                    log.warning("Gemini stream failed: %s", e)
+                    if parts:
+                        yield sse_event("error", {"detail": "LLM stream interrupted"})
                 
-                debug_info = {
-                    'rag_documents': rag_documents,
-                    'best_similarity_score': best_score,
-                    'rag_confidence': rag_confidence,
-                    'enhancement_applied': True,
-                    'decision_reason': f"Good similarity score {best_score:.3f}, enhanced with LLM for natural response",
-                    'context_length': len(rag_context),
-                    'total_documents_searched': len(search_results),
-                    'documents_used_for_context': docs_to_use
-                }
-                
-                return QueryResponse(
-                    answer=enhanced_answer,
-                    sources=rag_response["sources"] + ["Enhanced by Gemini AI"],
-                    method="rag_enhanced",
-                    confidence=final_confidence,
-                    debug_info=debug_info
-                )
-        
-        # Step 3: Handle cases where RAG + Gemini enhancement isn't suitable
-        if is_geolift_related and best_score < RAG_CONFIDENCE_THRESHOLD:
-            # High-confidence GeoLift question -> Use pure RAG
-            print("✅ Using RAG only (high confidence)")
-            return QueryResponse(
-                answer=rag_response["answer"],
-                sources=rag_response["sources"],
-                method="rag",
-                confidence=rag_confidence
-            )
+                if parts and route == 'rag_enhanced':
+                    response = enhanced_response(plan, rag_response, search_results, "".join(parts), debug)
+                elif parts:
+                    response = gemini_response("".join(parts))
+                else:
+                    # Nothing streamed: degrade to the non-LLM answer
+                    plan['route'] = fallback_route(plan['is_geolift_related'], plan['best_score'], search_results)
+                    mark_exhausted(plan, budget)
             
-        elif gemini_model and not is_geolift_related and best_score > 1.2:
-            # General question with poor RAG match -> Use Gemini only
-            print("🤖 Using Gemini only (general question)")
-            gemini_answer = query_gemini(query)
-            if gemini_answer:
-                return QueryResponse(
-                    answer=gemini_answer,
-                    sources=["Gemini AI"],
-                    method="gemini",
-                    confidence=0.8
-                )
-        
-        elif is_geolift_related and search_results:
-            # Medium-confidence GeoLift question -> RAG with disclaimer
-            print("⚠️  Using RAG with disclaimer (medium confidence)")
-            disclaimer = "Based on my GeoLift knowledge base:\n\n"
-            return QueryResponse(
-                answer=disclaimer + rag_response["answer"],
-                sources=rag_response["sources"],
-                method="rag",
-                confidence=rag_confidence
-            )
-        
-        # Step 4: Fallbacks
-        if search_results:
-            print("🔄 Fallback to RAG")
-            return QueryResponse(
-                answer=rag_response["answer"],
-                sources=rag_response["sources"],
-                method="rag",
-                confidence=rag_confidence
-            )
-        
-        # Last resort
-        return QueryResponse(
-            answer="I'm not sure how to help with that. Could you ask about specific GeoLift parameters or rephrase your question?",
-            sources=[],
-            method="fallback",
-            confidence=0.0
-        )
+            if response is None:
+                response = rag_route_response(plan, rag_response, search_results, debug)
+                yield sse_event("answer", {
+                    "answer": response.answer,
+                    "method": response.method,
+                    "sources": response.sources
+                })
+            ANSWERS.labels(response.method, plan['route']).inc()
+            annotate(route=plan['route'])
+            finish_budget(plan, response, debug)
+            
+            total_ms = elapsed_ms()
+            stream_total_ms.observe(total_ms)
+            if debug:
+                attach_trace(response.debug_info)
+            yield sse_event("done", {
+                "method": response.method,
+                "confidence": response.confidence,
+                "budget_decision": response.budget_decision,
+                "debug_info": response.debug_info,
+                "timings": {"ttfb_ms": ttfb_ms, "first_token_ms": first_token_ms, "total_ms": total_ms}
+            })
         
-    except Exception as e:
-        print(f"❌ Error processing query: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+        except Exception as e:
+            log.error("Error streaming query: %s", e, exc_info=True)
+            yield sse_event("error", {"detail": f"Error processing query: {str(e)}"})
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    print("🚀 Starting Hybrid RAG API server...")
-    print("🧠 RAG for GeoLift knowledge, Gemini for general questions")
-    print("🌐 Server will run on http://localhost:5000")
-    print("📖 API documentation: http://localhost:5000/docs")
     
-    if not vector_store:
-        print("\n⚠️  WARNING: Vector store not loaded!")
-        print("📝 Run this first: cd ai && python RAG/build_index.py")
+    parser = argparse.ArgumentParser(description="Hybrid RAG API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=SERVING_CONFIG.get("workers") or 1,
+                        help="pre-forked worker processes sharing one copy of the models and index")
+    args = parser.parse_args()
     
-    if not gemini_model:
-        print("\n⚠️  WARNING: Gemini not available!")
-        print("📝 Set GEMINI_API_KEY environment variable")
+    print("🚀 Starting Hybrid RAG API server...")
+    print("🧠 RAG for GeoLift knowledge, Gemini for general questions")
+    print(f"🌐 Server will run on http://localhost:{args.port}")
+    print(f"📖 API documentation: http://localhost:{args.port}/docs")
     
-    uvicorn.run(app, host="0.0.0.0", port=5000, log_level="info")
+    if args.workers > 1:
+        # Load once in the parent; workers only warm up and share the pages copy-on-write
+        prefork.serve(app, host=args.host, port=args.port, workers=args.workers, preload=load_components)
+    else:
+        print(f"⏳ Models load in the background; poll http://localhost:{args.port}/ready")
+        uvicorn.run(app, host=args.host, port=args.port, log_level="info")
@@ -0,0 +1,84 @@
+"""
+Admission control for the async API servers.
+
+Caps the number of requests doing work at once and bounds how many may wait
+for a slot. Requests beyond that are rejected immediately instead of piling up
+behind a slow upstream, so tail latency stays bounded under bursty load.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    In-flight limit with a bounded wait queue.
+
+    - At most `max_in_flight` requests hold a slot at the same time.
+    - Up to `max_queue` further requests may wait for a slot; each waits at
+      most `queue_timeout_s` seconds before being rejected with 503.
+    - When the queue itself is full, requests are rejected with 429 right away.
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 64, queue_timeout_s: float = 2.0):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout_s = float(queue_timeout_s)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise Overloaded("Server busy: request queue is full", status_code=429)
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout_s)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise Overloaded(
+                    f"Server busy: no worker free within {self.queue_timeout_s:.1f}s",
+                    status_code=503,
+                    retry_after=self.queue_timeout_s,
+                )
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
@@ -0,0 +1,143 @@
+"""
+Latency budgets for routing.
+
+A request may carry a latency budget (`budget_ms`, default
+`latency_budget.default_ms`), counted from when the server received it.
+Before an LLM call the router compares what is left of the budget with how
+long that backend has recently taken. The estimate is a percentile over a
+sliding window of recent calls, or their EWMA while there are too few
+samples. When the call would not fit, the request is answered from RAG alone.
+Samples expire after `max_age_s`, so a backend that was skipped for being
+slow gets called (and measured) again once its samples are gone.
+
+The decision is one of:
+    unbounded       no budget: the LLM is called
+    no_estimate     no recent calls to judge by: the LLM is called
+    within_budget   the estimate fits the remaining budget: the LLM is called,
+                    capped at the remaining budget
+    cached          over budget, but the answer is cached: served from the cache
+    over_budget     the estimate does not fit: pure RAG answer
+    exhausted       the LLM was called but the budget ran out first: pure RAG answer
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from serving.metrics import REGISTRY
+
+BUDGET_DECISIONS = REGISTRY.counter("rag_budget_decisions_total", "Latency budget decisions for LLM routes",
+                                    ["decision"])
+
+
+class LatencyEstimator:
+    """EWMA and sliding-window percentiles of one backend's recent call latencies (ms)"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 200, max_age_s: float = 60.0):
+        self.alpha = float(alpha)
+        self.max_age_s = float(max_age_s)
+        self._samples = deque(maxlen=max(1, int(window)))  # (monotonic time, ms)
+        self._lock = threading.Lock()
+        self._ewma: Optional[float] = None
+        self.count = 0
+
+    def observe(self, ms: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), ms))
+            self._ewma = ms if self._ewma is None else self.alpha * ms + (1 - self.alpha) * self._ewma
+            self.count += 1
+
+    def _recent(self) -> List[float]:
+        """Unexpired samples (caller holds the lock); the EWMA is reset once they have all expired"""
+        cutoff = time.monotonic() - self.max_age_s
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if not self._samples:
+            self._ewma = None
+        return [ms for _, ms in self._samples]
+
+    @property
+    def ewma(self) -> Optional[float]:
+        with self._lock:
+            self._recent()
+            return self._ewma
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Nearest-rank q-quantile (0..1) of the recent window"""
+        with self._lock:
+            samples = sorted(self._recent())
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+    def estimate_ms(self, q: float = 0.9, min_samples: int = 10) -> Optional[float]:
+        """The q-quantile of recent calls, the EWMA while there are fewer than min_samples, or None"""
+        with self._lock:
+            enough = len(self._recent()) >= min_samples
+            ewma = self._ewma
+        return self.percentile(q) if enough else ewma
+
+    def stats(self) -> Dict[str, Any]:
+        def rounded(value):
+            return round(value, 1) if value is not None else None
+        with self._lock:
+            samples = len(self._recent())
+        return {
+            "samples": samples,
+            "ewma_ms": rounded(self.ewma),
+            "p50_ms": rounded(self.percentile(0.50)),
+            "p90_ms": rounded(self.percentile(0.90)),
+            "p99_ms": rounded(self.percentile(0.99)),
+        }
+
+
+class Budget:
+    """A request's latency budget, counted from `started` (perf_counter)"""
+
+    __slots__ = ("budget_ms", "started")
+
+    def __init__(self, budget_ms: Optional[float], started: Optional[float] = None):
+        self.budget_ms = budget_ms
+        self.started = started if started is not None else time.perf_counter()
+
+    def remaining_ms(self) -> Optional[float]:
+        if self.budget_ms is None:
+            return None
+        return self.budget_ms - (time.perf_counter() - self.started) * 1000
+
+    def remaining_s(self) -> Optional[float]:
+        """What is left for a call, in seconds (None when unbounded)"""
+        remaining = self.remaining_ms()
+        return max(0.0, remaining) / 1000 if remaining is not None else None
+
+
+def decide(budget: Optional[Budget], estimator: LatencyEstimator, backend: str, quantile: float = 0.9,
+           min_samples: int = 10, headroom_ms: float = 0.0) -> Dict[str, Any]:
+    """
+    Whether an LLM call to `backend` fits the remaining budget.
+    Returns {"decision", "backend", "budget_ms", "remaining_ms", "estimate_ms"};
+    the caller counts it (`record`) once the final decision is known.
+    """
+    remaining = budget.remaining_ms() if budget is not None else None
+    estimate = estimator.estimate_ms(quantile, min_samples)
+    if remaining is None:
+        decision = "unbounded"
+    elif estimate is None:
+        decision = "no_estimate"
+    elif estimate + headroom_ms <= remaining:
+        decision = "within_budget"
+    else:
+        decision = "over_budget"
+    return {
+        "decision": decision,
+        "backend": backend,
+        "budget_ms": budget.budget_ms if budget is not None else None,
+        "remaining_ms": round(remaining, 1) if remaining is not None else None,
+        "estimate_ms": round(estimate, 1) if estimate is not None else None,
+    }
+
+
+def record(decision: Dict[str, Any]):
+    BUDGET_DECISIONS.labels(decision["decision"]).inc()
@@ -0,0 +1,298 @@
+"""
+Lightweight in-process metrics, exported in the Prometheus text format.
+
+Histogram, Counter and Gauge live in a Registry; labelled metrics hand out one
+child per label set (`STAGE_MS.labels("embed").observe(ms)`). Values that
+other objects already count (cache hits, admission queue) are exported with
+`fn=`, a callback evaluated at scrape time, so the hot path pays nothing.
+`instrument(app)` adds the /metrics route and per-endpoint request metrics to
+a FastAPI app. Metrics are per process: behind pre-forked workers each scrape
+answers from one worker.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+LATENCY_MS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """Fixed-bucket histogram with approximate quantiles"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_MS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for idx, c in enumerate(self._counts):
+                seen += c
+                if seen >= rank:
+                    return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def cumulative_counts(self):
+        """[(upper bound, cumulative count)], ending with +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+        out, total = [], 0
+        for bound, c in zip(list(self.buckets) + [float("inf")], counts):
+            total += c
+            out.append((bound, total))
+        return out
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the block in milliseconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - started) * 1000)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {("+Inf" if b == float("inf") else b): c for b, c in self.cumulative_counts()},
+        }
+
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that goes up and down"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+class Metric:
+    """
+    A named metric with optional labels, as exported by the Registry.
+
+    Without labels the metric proxies its single child (`.inc()`, `.observe()`);
+    with labels, `.labels(*values)` returns the child for that label set.
+    `fn` replaces the children with a callback returning either one value or
+    {label values tuple: value}.
+    """
+
+    def __init__(self, kind: str, name: str, help: str, labelnames: Sequence[str] = (),
+                 factory: Callable = None, fn: Callable = None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def __getattr__(self, attr):
+        # inc/dec/set/observe/time on an unlabelled metric
+        if attr.startswith("_") or self.labelnames:
+            raise AttributeError(attr)
+        return getattr(self.labels(), attr)
+
+    def samples(self):
+        """[(label values, value or Histogram)]"""
+        if self.fn is None:
+            return list(self._children.items())
+        value = self.fn()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(tuple(str(v) for v in k), v) for k, v in value.items() if v is not None]
+        return [((), value)]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Registry:
+    """Metrics exported together by one /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # modules may be imported (and register) more than once
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (), fn: Callable = None) -> Metric:
+        return self._add(Metric("counter", name, help, labels, Counter, fn))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), fn: Callable = None) -> Metric:
+        return self._add(Metric("gauge", name, help, labels, Gauge, fn))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_MS_BUCKETS, fn: Callable = None) -> Metric:
+        return self._add(Metric("histogram", name, help, labels, lambda: Histogram(buckets), fn))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # a failing callback must not break the scrape
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, child in samples:
+                if metric.kind == "histogram":
+                    for bound, count in child.cumulative_counts():
+                        le = _labels(metric.labelnames, values, f'le="{_number(bound)}"')
+                        lines.append(f"{metric.name}_bucket{le} {count}")
+                    labels = _labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}_sum{labels} {_number(round(child.sum, 6))}")
+                    lines.append(f"{metric.name}_count{labels} {child.count}")
+                else:
+                    value = getattr(child, "value", child)
+                    lines.append(f"{metric.name}{_labels(metric.labelnames, values)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Shared by both API servers and the RAG pipeline
+STAGE_MS = REGISTRY.histogram(
+    "rag_stage_duration_ms", "Latency of one pipeline stage (embed, search, rerank, llm, ...) in ms", ["stage"])
+LLM_ERRORS = REGISTRY.counter(
+    "rag_llm_errors_total", "Failed upstream LLM calls by provider and kind (error or timeout)", ["provider", "kind"])
+
+
+def llm_error_kind(error: BaseException) -> str:
+    """'timeout' for deadline/timeout errors from any client library, else 'error'"""
+    name = type(error).__name__.lower()
+    if isinstance(error, TimeoutError) or "timeout" in name or "deadline" in name:
+        return "timeout"
+    return "error"
+
+
+def record_llm_error(provider: str, error: BaseException):
+    LLM_ERRORS.labels(provider, llm_error_kind(error)).inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: requests in flight, request latency (including the
+    streamed body) and responses by status, per endpoint. Paths that are not
+    routes of the app are counted as "other" to bound the label set.
+    """
+
+    def __init__(self, app, registry: Registry = REGISTRY, skip: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip = set(skip)
+        self.routes: Optional[set] = None
+        self.in_flight = registry.gauge("rag_http_requests_in_flight", "Requests being handled", ["endpoint"])
+        self.latency = registry.histogram("rag_http_request_duration_ms", "Request latency in ms", ["endpoint"])
+        self.responses = registry.counter("rag_http_responses_total", "Responses by status code",
+                                          ["endpoint", "status"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            return await self.app(scope, receive, send)
+        if self.routes is None:
+            self.routes = {getattr(r, "path", None) for r in getattr(scope.get("app"), "routes", [])}
+        endpoint = scope["path"] if scope["path"] in self.routes else "other"
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = self.in_flight.labels(endpoint)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            self.latency.labels(endpoint).observe((time.perf_counter() - started) * 1000)
+            self.responses.labels(endpoint, status["code"]).inc()
+
+
+def instrument(app, registry: Registry = REGISTRY):
+    """Add /metrics (Prometheus text format) and per-endpoint request metrics to a FastAPI app"""
+    from fastapi.responses import PlainTextResponse
+
+    app.add_middleware(MetricsMiddleware, registry=registry)
+
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_api_route("/metrics", metrics, methods=["GET"], tags=["Operations"], include_in_schema=False)
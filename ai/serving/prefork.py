@@ -0,0 +1,215 @@
+"""
+Pre-fork serving for multi-worker deployments.
+
+`uvicorn --workers N` starts N fresh interpreters, each importing torch and
+loading the embedding model, the index (and, for agent/QnA.py, the reranker)
+on its own, so resident memory grows linearly with the number of workers.
+
+Here the parent process loads everything once, freezes the garbage collector
+so the loaded objects are never written to by a collection pass, then forks
+workers that share those pages copy-on-write and serve on one listening socket.
+
+Usage:
+    python hybrid_rag_api.py --workers 4
+    python -m serving.prefork agent.QnA:app --workers 4 --port 8000
+    python -m serving.prefork --report <pid> [<pid> ...]
+"""
+
+import gc
+import os
+import time
+import signal
+import socket
+import argparse
+import importlib
+from typing import Callable, Dict, List, Optional, Sequence
+
+import uvicorn
+
+# smaps_rollup fields reported per process (values in kB)
+_MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memory_usage(pid: int) -> Optional[Dict[str, int]]:
+    """
+    RSS split for one process from /proc/<pid>/smaps_rollup, in kB.
+
+    - unique_kb: pages only this process maps (Private_*), i.e. what it costs on its own
+    - shared_kb: pages also mapped by other processes (Shared_*), e.g. inherited model weights
+    - pss_kb: proportional share; summing it over processes gives their true total
+
+    Returns None where /proc is not available (e.g. macOS).
+    """
+    values = {}
+    for name in (f"/proc/{pid}/smaps_rollup", f"/proc/{pid}/smaps"):
+        try:
+            with open(name, "r") as f:
+                for line in f:
+                    field, _, rest = line.partition(":")
+                    if field in _MEMORY_FIELDS:
+                        values[field] = values.get(field, 0) + int(rest.split()[0])
+            break
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            continue
+    if not values:
+        return None
+    return {
+        "pid": pid,
+        "rss_kb": values.get("Rss", 0),
+        "pss_kb": values.get("Pss", 0),
+        "shared_kb": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "unique_kb": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def memory_report(pids: Sequence[int]) -> dict:
+    """
+    Per-process memory plus totals.
+
+    `rss_kb` in the totals is what N independent workers would roughly need
+    (each counts the shared pages in full); `pss_kb` is what they actually use
+    together, so the difference is what sharing saves.
+    """
+    processes = [m for m in (memory_usage(pid) for pid in pids) if m is not None]
+    total_rss = sum(m["rss_kb"] for m in processes)
+    total_pss = sum(m["pss_kb"] for m in processes)
+    return {
+        "processes": processes,
+        "total": {
+            "rss_kb": total_rss,
+            "pss_kb": total_pss,
+            "unique_kb": sum(m["unique_kb"] for m in processes),
+            "saved_kb": total_rss - total_pss,
+        },
+    }
+
+
+def print_memory_report(report: dict, labels: Optional[Dict[int, str]] = None):
+    labels = labels or {}
+    print(f"{'process':<12}{'pid':>8}{'rss MB':>10}{'unique MB':>11}{'shared MB':>11}{'pss MB':>10}")
+    for m in report["processes"]:
+        print(f"{labels.get(m['pid'], 'worker'):<12}{m['pid']:>8}{m['rss_kb'] / 1024:>10.1f}"
+              f"{m['unique_kb'] / 1024:>11.1f}{m['shared_kb'] / 1024:>11.1f}{m['pss_kb'] / 1024:>10.1f}")
+    total = report["total"]
+    print(f"📊 Sum of RSS {total['rss_kb'] / 1024:.1f} MB, actual (PSS) {total['pss_kb'] / 1024:.1f} MB, "
+          f"saved by sharing {total['saved_kb'] / 1024:.1f} MB")
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, log_level: str):
+    # The parent's handlers are for supervising; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def serve(app, host: str = "0.0.0.0", port: int = 5000, workers: int = 2,
+          preload: Optional[Callable[[], None]] = None, log_level: str = "info",
+          report_after_s: Optional[float] = 30.0):
+    """
+    Load once, fork `workers` processes and supervise them until SIGINT/SIGTERM.
+
+    `preload` runs in the parent before forking and should load every model and
+    index the app needs. It must not start threads or run inference (thread
+    pools don't survive fork); the app's own lifespan startup runs in each worker.
+    Workers that die unexpectedly are replaced. A memory report is printed once
+    `report_after_s` seconds after start and on SIGUSR1.
+    """
+    if preload is not None:
+        started = time.perf_counter()
+        preload()
+        print(f"✅ Preloaded in parent {os.getpid()} in {time.perf_counter() - started:.1f}s")
+
+    # Move everything loaded so far out of the GC's reach: collections would
+    # otherwise write to object headers and unshare the pages in every worker
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(host, port)
+    children: Dict[int, int] = {}  # pid -> worker slot
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, log_level)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        print(f"👷 Worker {slot} started (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(signum=None, frame=None):
+        labels = {os.getpid(): "parent", **{pid: f"worker {slot}" for pid, slot in children.items()}}
+        print_memory_report(memory_report([os.getpid(), *children]), labels)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, report)
+
+    for slot in range(workers):
+        spawn(slot)
+    print(f"🌐 {workers} workers serving on http://{host}:{port}")
+
+    report_at = time.monotonic() + report_after_s if report_after_s else None
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if report_at is not None and time.monotonic() >= report_at:
+                report_at = None
+                report()
+            time.sleep(0.5)
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            print(f"⚠️  Worker {slot} (pid {pid}) exited with status {status}, restarting")
+            spawn(slot)
+
+    sock.close()
+    print("👋 All workers stopped")
+
+
+def _import_app(target: str):
+    module_name, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "app")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an ASGI app from pre-forked workers that share loaded models")
+    parser.add_argument("app", nargs="?", help="module:attribute, e.g. agent.QnA:app (loads at import)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--report", type=int, nargs="+", metavar="PID",
+                        help="print unique/shared memory for running processes and exit")
+    args = parser.parse_args()
+
+    if args.report:
+        print_memory_report(memory_report(args.report))
+    elif args.app:
+        # Importing the app module in the parent is the preload step
+        serve(_import_app(args.app), host=args.host, port=args.port, workers=args.workers)
+    else:
+        parser.error("an app (module:attribute) or --report is required")
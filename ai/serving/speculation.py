@@ -0,0 +1,82 @@
+"""
+Speculative LLM calls: start a call that will probably be needed before the
+routing decision is final, then use it or cancel it.
+
+hybrid_rag_api.py starts the general Gemini call alongside retrieval for
+questions the router's early signal (`is_geolift_question`) predicts to be
+non-GeoLift. If the route turns out to be 'gemini', the answer is already on
+its way; otherwise the call is cancelled as soon as the route is known.
+
+Metrics for tuning the policy:
+    rag_speculative_calls_total{outcome}  used, failed (used but no answer), wasted (cancelled or unused)
+    rag_speculation_saved_ms              head start of used calls: time the call ran before it was needed
+    rag_speculation_wasted_ms             time wasted calls ran before they were cancelled
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from serving.metrics import REGISTRY
+from serving.tracing import annotate
+
+SPECULATIVE_CALLS = REGISTRY.counter("rag_speculative_calls_total", "Speculative LLM calls by outcome",
+                                     ["outcome"])
+SAVED_MS = REGISTRY.histogram("rag_speculation_saved_ms", "Latency saved by used speculative calls in ms")
+WASTED_MS = REGISTRY.histogram("rag_speculation_wasted_ms", "Time cancelled or unused speculative calls ran in ms")
+
+
+class SpeculativeCall:
+    """One speculative call running as a task; settle it with use() or cancel()"""
+
+    in_flight = 0  # running speculative calls in this process
+
+    def __init__(self, call: Awaitable, budget_decision: Optional[Dict[str, Any]] = None):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.budget_decision = budget_decision
+        self.settled = False
+        SpeculativeCall.in_flight += 1
+        self.task = asyncio.ensure_future(call)  # runs in a copy of the request's context (trace)
+        self.task.add_done_callback(self._done)
+
+    @classmethod
+    def has_capacity(cls, max_in_flight: Optional[int]) -> bool:
+        return max_in_flight is None or cls.in_flight < max_in_flight
+
+    def _done(self, task: asyncio.Future):
+        self.finished = time.perf_counter()
+        SpeculativeCall.in_flight -= 1
+        if not task.cancelled():
+            task.exception()  # retrieved, so an unused failure is not reported as never retrieved
+
+    async def use(self):
+        """The route needs the call: wait for its result"""
+        self.settled = True
+        needed_at = time.perf_counter()
+        result = await self.task
+        if result:
+            saved_ms = (min(needed_at, self.finished) - self.started) * 1000
+            SPECULATIVE_CALLS.labels("used").inc()
+            SAVED_MS.observe(saved_ms)
+            annotate(speculation="used", speculation_saved_ms=round(saved_ms, 1))
+        else:
+            SPECULATIVE_CALLS.labels("failed").inc()
+            annotate(speculation="failed")
+        return result
+
+    def cancel(self):
+        """The route went another way (or the request failed): stop the call if it is still running"""
+        if self.settled:
+            return
+        self.settled = True
+        ran_ms = ((self.finished or time.perf_counter()) - self.started) * 1000
+        if not self.task.done():
+            self.task.cancel()
+        SPECULATIVE_CALLS.labels("wasted").inc()
+        WASTED_MS.observe(ran_ms)
+        annotate(speculation="wasted", speculation_wasted_ms=round(ran_ms, 1))
+
+
+REGISTRY.gauge("rag_speculative_calls_in_flight", "Speculative LLM calls running",
+               fn=lambda: SpeculativeCall.in_flight)
@@ -0,0 +1,268 @@
+"""
+Structured logging and per-request tracing for the API servers.
+
+Every request gets a request id (the caller's X-Request-ID, or a new one,
+echoed in the response) and a Trace that collects timing spans for the
+pipeline steps it runs (`with span("embed"): ...`). Spans also feed the
+`rag_stage_duration_ms` histogram, so one timer serves both.
+
+Nothing is written per step. When a request finishes, its trace is logged as
+one JSON line if it was sampled (`tracing.sample_rate`), slower than
+`tracing.slow_ms`, or failed. Log records go through a QueueHandler to a
+listener thread, so request threads never wait on stdout; when the bounded
+queue is full, records are dropped and counted rather than blocking.
+
+The current trace lives in a context variable: it follows the request
+through awaits and tasks, and into the CPU pool when the callable is run
+inside a copied context (see `run_cpu_bound` in hybrid_rag_api.py).
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from serving.metrics import REGISTRY, STAGE_MS
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("rag_trace", default=None)
+
+LOGGER_NAME = "rag"
+_settings = {"sample_rate": 0.01, "slow_ms": 2000.0, "debug_spans": True}
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["DroppingQueueHandler"] = None
+_output: Optional[logging.Handler] = None
+_queue_size = 10000
+
+DROPPED_LOGS = REGISTRY.counter("rag_log_records_dropped_total", "Log records dropped because the log queue was full")
+TRACES_LOGGED = REGISTRY.counter("rag_traces_logged_total", "Request traces written to the log by reason",
+                                 ["reason"])
+
+
+class Trace:
+    """Spans and attributes of one request"""
+
+    __slots__ = ("request_id", "name", "started", "spans", "attrs", "error")
+
+    def __init__(self, name: str, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[tuple] = []  # (name, start offset ms, duration ms); appended from any thread
+        self.attrs: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def add_span(self, name: str, started: float, ended: Optional[float] = None):
+        ended = ended if ended is not None else time.perf_counter()
+        self.spans.append((name, (started - self.started) * 1000, (ended - started) * 1000))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        """Spans (in start order) and attributes, as attached to debug_info and logged"""
+        return {
+            "request_id": self.request_id,
+            "elapsed_ms": round(self.elapsed_ms(), 2),
+            "spans": [{"name": name, "start_ms": round(start, 2), "duration_ms": round(duration, 2)}
+                      for name, start, duration in sorted(self.spans, key=lambda s: s[1])],
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def annotate(**attrs):
+    """Attach attributes (route, scores, ...) to the current request's trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def span(name: str):
+    """Time a pipeline step: recorded on the current trace and in rag_stage_duration_ms"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        STAGE_MS.labels(name).observe((ended - started) * 1000)
+        trace = _current.get()
+        if trace is not None:
+            trace.add_span(name, started, ended)
+
+
+def record_span(name: str, started: float):
+    """Record a step that started at `started` (perf_counter) and ends now, e.g. a finished stream"""
+    ended = time.perf_counter()
+    STAGE_MS.labels(name).observe((ended - started) * 1000)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, started, ended)
+
+
+def debug_trace() -> Optional[Dict[str, Any]]:
+    """The current trace summary for debug_info, when `tracing.debug_spans` is on"""
+    trace = _current.get()
+    if trace is None or not _settings["debug_spans"]:
+        return None
+    return trace.summary()
+
+
+def finish_trace(trace: Trace, status: Optional[int] = None):
+    """Log the trace if it is sampled, slow or failed"""
+    elapsed_ms = trace.elapsed_ms()
+    if trace.error or (status is not None and status >= 500):
+        reason = "error"
+    elif elapsed_ms >= _settings["slow_ms"]:
+        reason = "slow"
+    elif _settings["sample_rate"] and random.random() < _settings["sample_rate"]:
+        reason = "sampled"
+    else:
+        return
+    TRACES_LOGGED.labels(reason).inc()
+    logging.getLogger(f"{LOGGER_NAME}.trace").info("trace", extra={"fields": {
+        "trace": trace.name, "reason": reason, "status": status, "error": trace.error, **trace.summary()}})
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any `fields`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: when the queue is full the record is dropped and counted"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        trace = _current.get()
+        if trace is not None and not hasattr(record, "request_id"):
+            record.request_id = trace.request_id
+        # Format args now, in the caller's thread, so the listener never sees mutable objects
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_LOGS.inc()
+
+
+def _start_listener():
+    global _listener, _handler
+    log_queue = queue.Queue(maxsize=_queue_size)
+    logger = logging.getLogger(LOGGER_NAME)
+    if _handler is not None:
+        logger.removeHandler(_handler)
+    _handler = DroppingQueueHandler(log_queue)
+    logger.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(log_queue, _output, respect_handler_level=False)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # Threads don't survive fork: each pre-forked worker gets its own queue and listener
+    if _listener is not None:
+        _start_listener()
+
+
+def setup_logging(tracing_config: Optional[dict] = None):
+    """
+    Configure the "rag" loggers from the `tracing` section of settings.yaml:
+    sample_rate, slow_ms, log_level, queue_size, debug_spans.
+    Safe to call more than once; later calls only update the settings.
+    """
+    global _output, _queue_size
+    tracing_config = tracing_config or {}
+    _settings["sample_rate"] = float(tracing_config.get("sample_rate", _settings["sample_rate"]))
+    _settings["slow_ms"] = float(tracing_config.get("slow_ms", _settings["slow_ms"]))
+    _settings["debug_spans"] = bool(tracing_config.get("debug_spans", _settings["debug_spans"]))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(str(tracing_config.get("log_level", "INFO")).upper())
+    logger.propagate = False
+    if _listener is not None:
+        return
+
+    _queue_size = int(tracing_config.get("queue_size", _queue_size))
+    _output = logging.StreamHandler(sys.stderr)
+    _output.setFormatter(JsonFormatter())
+    _start_listener()
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """A logger under "rag" (structured, queued); call setup_logging() once per process"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: one Trace per HTTP request (request id from X-Request-ID or
+    new), the id echoed in the response headers, the trace logged when the
+    response body (including a stream) is done.
+    """
+
+    def __init__(self, app, skip=("/metrics", "/health", "/ready")):
+        self.app = app
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        trace = Trace(f"{scope['method']} {scope['path']}", request_id)
+        status = {"code": None}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-request-id", trace.request_id.encode("latin-1"))]}
+            await send(message)
+
+        token = _current.set(trace)
+        try:
+            await self.app(scope, receive, send_with_id)
+        except BaseException as e:
+            trace.error = trace.error or type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            finish_trace(trace, status["code"])
+
+
+def install_tracing(app, tracing_config: Optional[dict] = None):
+    """Set up logging and add per-request tracing to a FastAPI app"""
+    setup_logging(tracing_config)
+    app.add_middleware(TracingMiddleware)
@@ -0,0 +1,457 @@
+"""
+Upstream LLM clients: pooled connections, per-call deadlines, jittered retries
+and a circuit breaker, shared by hybrid_rag_api.py (Gemini) and the RAG
+pipeline behind agent/QnA.py (OpenAI / Ollama).
+
+An Upstream wraps calls to one provider:
+- every call has a deadline (`deadline_s`) covering all its attempts, and
+  each attempt its own timeout (`attempt_timeout_s`);
+- transient failures (connection errors, timeouts, 429 and 5xx) are retried
+  with full-jitter exponential backoff while the deadline allows;
+- `breaker_failures` consecutive failures open the circuit: calls fail at
+  once with CircuitOpen for `breaker_reset_s`, then one probe is let through
+  (half-open) and its outcome closes or re-opens the circuit.
+Callers treat any UpstreamError as "no LLM answer" and serve the pure-RAG
+answer instead, so an unhealthy provider costs nothing once the circuit opens.
+Call latencies are kept per provider (`Upstream.latency`) for latency-budget
+routing (serving/budget.py); a caller with a budget passes it as `deadline_s`.
+
+Settings come from the `upstream` section of settings.yaml, one block per
+provider (`gemini`, `openai`).
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+from serving.budget import LatencyEstimator
+from serving.metrics import REGISTRY, record_llm_error
+from serving.tracing import annotate, get_logger
+
+log = get_logger("upstream")
+
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com"
+
+DEFAULTS = {
+    "deadline_s": 20.0,         # whole call, all attempts included
+    "attempt_timeout_s": 10.0,  # one attempt (for streams: until the first chunk, then between chunks)
+    "connect_timeout_s": 2.0,
+    "retries": 2,               # extra attempts after the first
+    "backoff_base_s": 0.2,
+    "backoff_max_s": 2.0,
+    "breaker_failures": 5,      # consecutive failures that open the circuit
+    "breaker_reset_s": 30.0,    # time open before a probe is let through
+    "max_connections": 32,
+    "max_keepalive": 16,
+    "latency_window": 200,      # recent successful calls kept for the latency percentiles
+    "latency_ewma_alpha": 0.2,
+    "latency_max_age_s": 60.0,  # older samples are dropped, so a slow provider gets measured again
+}
+
+_upstreams = {}  # provider -> Upstream, for the breaker state gauge
+_STATE_CODES = {"closed": 0, "half_open": 1, "open": 2}
+
+REGISTRY.gauge("rag_llm_circuit_state", "Circuit breaker state per provider (0 closed, 1 half-open, 2 open)",
+               ["provider"], fn=lambda: {(name,): _STATE_CODES[u.breaker.stats()["state"]] for name, u in _upstreams.items()})
+RETRIES = REGISTRY.counter("rag_llm_retries_total", "Retried upstream LLM attempts", ["provider"])
+REGISTRY.gauge("rag_llm_latency_estimate_ms", "Recent LLM call latency per provider (EWMA and window percentiles)",
+               ["provider", "stat"],
+               fn=lambda: {(name, stat): value for name, u in _upstreams.items()
+                           for stat, value in u.latency.stats().items() if stat != "samples" and value is not None})
+SHORT_CIRCUITS = REGISTRY.counter("rag_llm_short_circuits_total", "LLM calls skipped because the circuit was open",
+                                  ["provider"])
+
+
+class UpstreamError(Exception):
+    """An upstream LLM call gave no answer (after retries, or without trying)"""
+
+
+class CircuitOpen(UpstreamError):
+    """The provider's circuit is open; the call was not attempted"""
+
+
+class DeadlineExceeded(UpstreamError, TimeoutError):
+    """The call's deadline ran out"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout_s = float(reset_timeout_s)
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0  # times the circuit opened
+        self._probing = False
+
+    def _check_reset(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+            self.state = self.HALF_OPEN
+            self._probing = False
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would be let through now (does not claim the half-open probe)"""
+        with self._lock:
+            self._check_reset()
+            return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        """Claim permission for one call"""
+        with self._lock:
+            self._check_reset()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release(self):
+        """A call ended without a verdict (cancelled): free the half-open probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._check_reset()
+            return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened}
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an error from httpx, openai or a Gemini client, if it has one"""
+    response = getattr(error, "response", None)
+    for value in (getattr(error, "status_code", None), getattr(response, "status_code", None),
+                  getattr(error, "code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Transient failures worth another attempt: connection problems, timeouts, 408/429/5xx"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, httpx.TransportError)):
+        return True
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    name = type(error).__name__
+    return any(word in name for word in ("Timeout", "Connection", "Unavailable", "RateLimit", "Deadline"))
+
+
+def retry_after_s(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Upstream:
+    """Deadline, retry and circuit-breaker policy for calls to one provider"""
+
+    def __init__(self, provider: str, settings: Optional[dict] = None):
+        self.provider = provider
+        self.settings = {**DEFAULTS, **(settings or {})}
+        self.breaker = CircuitBreaker(self.settings["breaker_failures"], self.settings["breaker_reset_s"])
+        self.latency = LatencyEstimator(self.settings["latency_ewma_alpha"], self.settings["latency_window"],
+                                        self.settings["latency_max_age_s"])
+        _upstreams[provider] = self
+
+    @property
+    def available(self) -> bool:
+        return self.breaker.available
+
+    @property
+    def attempt_timeout_s(self) -> float:
+        return float(self.settings["attempt_timeout_s"])
+
+    def _backoff_s(self, attempt: int, error: BaseException) -> float:
+        cap = min(self.settings["backoff_max_s"], self.settings["backoff_base_s"] * 2 ** attempt)
+        return max(random.uniform(0, cap), retry_after_s(error) or 0.0)
+
+    def short_circuited(self):
+        """Count a call skipped because the circuit is open (by this class or a caller checking `available`)"""
+        SHORT_CIRCUITS.labels(self.provider).inc()
+        annotate(**{f"{self.provider}_circuit": "open"})
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self.short_circuited()
+            raise CircuitOpen(f"{self.provider} circuit open")
+
+    def _failed(self, error: BaseException, counts: bool = True):
+        record_llm_error(self.provider, error)
+        if counts:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()  # the provider answered; the request itself was bad
+
+    def _succeeded(self, started: Optional[float] = None):
+        self.breaker.record_success()
+        if started is not None:  # whole calls only; stream durations depend on the answer length
+            self.latency.observe((time.monotonic() - started) * 1000)
+
+    def _next_attempt(self, attempt: int, error: BaseException, deadline: float) -> Optional[float]:
+        """Backoff before the next attempt, or None when the call should give up"""
+        if attempt >= self.settings["retries"] or not is_retryable(error):
+            return None
+        delay = self._backoff_s(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            return None
+        RETRIES.labels(self.provider).inc()
+        return delay
+
+    def call(self, fn: Callable[[float], object]):
+        """Run fn(timeout_s) with retries; raises UpstreamError when no answer was obtained"""
+        started = time.monotonic()
+        deadline = started + self.settings["deadline_s"]
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                self._failed(e, is_retryable(e))
+                delay = self._next_attempt(attempt, e, deadline)
+                if delay is None:
+                    raise UpstreamError(f"{self.provider} call failed: {e}") from e
+                log.info("Retrying %s in %.2fs after %s", self.provider, delay, type(e).__name__)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(started)
+            return result
+
+    async def acall(self, make_call: Callable[[], "asyncio.Future"], deadline_s: Optional[float] = None):
+        """
+        Await make_call() with per-attempt timeouts and retries; raises UpstreamError.
+        `deadline_s` shortens the call's deadline (e.g. to a request's remaining
+        latency budget); running out of it gives the breaker no verdict.
+        """
+        started = time.monotonic()
+        caller_deadline = deadline_s is not None and deadline_s < self.settings["deadline_s"]
+        deadline = started + (deadline_s if caller_deadline else self.settings["deadline_s"])
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+            try:
+                result = await asyncio.wait_for(make_call(), timeout=timeout)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if self._budget_ran_out(e, caller_deadline, timeout):
+                    self.latency.observe((time.monotonic() - started) * 1000)  # the call took at least this long
+                    raise DeadlineExceeded(f"{self.provider} call ran out of its {deadline_s:.2f}s budget") from e
+                self._failed(e, is_retryable(e))
+                delay = self._next_attempt(attempt, e, deadline)
+                if delay is None:
+                    if timed_out:
+                        self.latency.observe((time.monotonic() - started) * 1000)  # at least this slow
+                        raise DeadlineExceeded(f"{self.provider} call timed out after {timeout:.1f}s") from e
+                    raise UpstreamError(f"{self.provider} call failed: {e}") from e
+                log.info("Retrying %s in %.2fs after %s", self.provider, delay, type(e).__name__)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(started)
+            return result
+
+    def _budget_ran_out(self, error: BaseException, caller_deadline: bool, timeout: float) -> bool:
+        """
+        Whether `error` is the caller's deadline running out rather than the provider's
+        time: such a timeout is recorded, but gives the breaker no verdict.
+        """
+        if not (isinstance(error, asyncio.TimeoutError) and caller_deadline and timeout < self.attempt_timeout_s):
+            return False
+        record_llm_error(self.provider, error)
+        self.breaker.release()
+        return True
+
+    async def astream(self, open_stream: Callable[[], "asyncio.Future"],
+                      deadline_s: Optional[float] = None) -> AsyncIterator:
+        """
+        Iterate the chunks of `await open_stream()` (an async iterable).
+        Opening and the first chunk are retried like acall; after the first chunk
+        has been yielded a failure is final. Each chunk must arrive within
+        attempt_timeout_s of the previous one. `deadline_s` (e.g. a request's
+        remaining latency budget) bounds the whole stream, as it does for acall.
+        """
+        caller_deadline = deadline_s is not None and deadline_s < self.settings["deadline_s"]
+        deadline = time.monotonic() + (deadline_s if caller_deadline else self.settings["deadline_s"])
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+            try:
+                stream = await asyncio.wait_for(open_stream(), timeout=timeout)
+                iterator = stream.__aiter__()
+                first = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+                break
+            except StopAsyncIteration:
+                self._succeeded()
+                return
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if self._budget_ran_out(e, caller_deadline, timeout):
+                    raise DeadlineExceeded(f"{self.provider} stream ran out of its {deadline_s:.2f}s budget") from e
+                self._failed(e, is_retryable(e))
+                delay = self._next_attempt(attempt, e, deadline)
+                if delay is None:
+                    raise UpstreamError(f"{self.provider} stream failed: {e}") from e
+                log.info("Retrying %s stream in %.2fs after %s", self.provider, delay, type(e).__name__)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        yield first
+        while True:
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic()) if caller_deadline \
+                else self.attempt_timeout_s
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if self._budget_ran_out(e, caller_deadline, timeout):
+                    raise DeadlineExceeded(f"{self.provider} stream ran out of its {deadline_s:.2f}s budget") from e
+                self._failed(e, is_retryable(e))
+                raise UpstreamError(f"{self.provider} stream interrupted: {e}") from e
+            yield chunk
+        self._succeeded()
+
+    def stats(self) -> dict:
+        return {"provider": self.provider, **self.breaker.stats(), "latency": self.latency.stats()}
+
+
+def http_limits(settings: dict) -> httpx.Limits:
+    return httpx.Limits(max_connections=settings["max_connections"],
+                        max_keepalive_connections=settings["max_keepalive"], keepalive_expiry=60.0)
+
+
+def http_timeout(settings: dict) -> httpx.Timeout:
+    return httpx.Timeout(settings["attempt_timeout_s"], connect=settings["connect_timeout_s"])
+
+
+class GeminiText:
+    """A Gemini response or stream chunk (`.text`, like the google-generativeai SDK)"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def gemini_text(payload: dict) -> str:
+    candidates = payload.get("candidates") or []
+    if not candidates:
+        raise ValueError(f"Gemini returned no candidates: {payload.get('promptFeedback')}")
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+class GeminiClient:
+    """
+    Gemini REST client over pooled keep-alive connections, with the same calls
+    the google-generativeai GenerativeModel offers here: generate_content(prompt)
+    and generate_content_async(prompt, stream=False). Timeouts come from the
+    Upstream settings (generate_content also takes the caller's per-attempt
+    `timeout`); retries and the circuit breaker are applied by the caller.
+    """
+
+    def __init__(self, api_key: str, model: str, base_url: Optional[str] = None, settings: Optional[dict] = None):
+        settings = {**DEFAULTS, **(settings or {})}
+        self.model = model
+        self.base_url = (base_url or GEMINI_API_BASE).rstrip("/")
+        self._headers = {"x-goog-api-key": api_key, "content-type": "application/json"}
+        self._limits = http_limits(settings)
+        self._timeout = http_timeout(settings)
+        self._connect_timeout = float(settings["connect_timeout_s"])
+        self._client = httpx.Client(base_url=self.base_url, headers=self._headers,
+                                    limits=self._limits, timeout=self._timeout)
+        self._async_clients = {}  # event loop -> AsyncClient (connections belong to one loop)
+
+    def _url(self, method: str) -> str:
+        return f"/v1beta/models/{self.model}:{method}"
+
+    @staticmethod
+    def _body(prompt: str) -> dict:
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    def _async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                base_url=self.base_url, headers=self._headers, limits=self._limits, timeout=self._timeout)
+        return client
+
+    def generate_content(self, prompt: str, timeout: Optional[float] = None) -> GeminiText:
+        """`timeout` (s) bounds this request, e.g. the attempt timeout Upstream.call passes in"""
+        request_timeout = (httpx.Timeout(timeout, connect=min(self._connect_timeout, timeout))
+                           if timeout is not None else self._timeout)
+        response = self._client.post(self._url("generateContent"), json=self._body(prompt), timeout=request_timeout)
+        response.raise_for_status()
+        return GeminiText(gemini_text(response.json()))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        if stream:
+            return self._stream(prompt)
+        response = await self._async_client().post(self._url("generateContent"), json=self._body(prompt))
+        response.raise_for_status()
+        return GeminiText(gemini_text(response.json()))
+
+    async def _stream(self, prompt: str) -> AsyncIterator[GeminiText]:
+        async with self._async_client().stream("POST", self._url("streamGenerateContent"),
+                                               params={"alt": "sse"}, json=self._body(prompt)) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    yield GeminiText(gemini_text(json.loads(line[5:])))
+
+
+def make_openai_client(base_url: Optional[str] = None, api_key: Optional[str] = None,
+                       settings: Optional[dict] = None):
+    """OpenAI client on a pooled httpx client; its own retries are off (Upstream retries with jitter)"""
+    from openai import OpenAI
+
+    settings = {**DEFAULTS, **(settings or {})}
+    http_client = httpx.Client(limits=http_limits(settings), timeout=http_timeout(settings))
+    kwargs = {"base_url": base_url, "api_key": api_key} if base_url else {}
+    return OpenAI(max_retries=0, timeout=http_timeout(settings), http_client=http_client, **kwargs)
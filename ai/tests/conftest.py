@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules read config/settings.yaml relative to ai/, as when the servers and build_index.py run
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AI_DIR)
+os.chdir(AI_DIR)
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import hybrid_rag_api as api
+from serving.admission import AdmissionController, Overloaded
+
+
+async def hold(admission, release: asyncio.Event):
+    async with admission.slot():
+        await release.wait()
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout_s=5)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(admission, release))
+        waiter = asyncio.ensure_future(hold(admission, release))
+        await asyncio.sleep(0.01)
+        assert (admission.in_flight, admission.waiting) == (1, 1)
+
+        with pytest.raises(Overloaded) as e:
+            async with admission.slot():
+                pass
+        assert e.value.status_code == 429
+        assert admission.rejected_queue_full == 1
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert (admission.in_flight, admission.waiting, admission.admitted) == (0, 0, 2)
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def run():
+        admission = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout_s=0.05)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(admission, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as e:
+            async with admission.slot():
+                pass
+        assert e.value.status_code == 503
+        assert e.value.retry_after == 0.05
+        assert (admission.waiting, admission.rejected_timeout) == (0, 1)
+
+        release.set()
+        await holder
+
+    asyncio.run(run())
+
+
+def test_slot_released_when_the_request_fails():
+    async def run():
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        with pytest.raises(RuntimeError):
+            async with admission.slot():
+                raise RuntimeError("handler failed")
+        assert admission.in_flight == 0
+        async with admission.slot():  # the slot is free again
+            assert admission.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_slot_released_when_the_request_is_cancelled():
+    async def run():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout_s=5)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(admission, release))
+        waiter = asyncio.ensure_future(hold(admission, release))
+        await asyncio.sleep(0.01)
+
+        waiter.cancel()  # cancelled while queued
+        holder.cancel()  # cancelled while holding the slot
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+        assert (admission.in_flight, admission.waiting) == (0, 0)
+        async with admission.slot():
+            pass
+
+    asyncio.run(run())
+
+
+def test_ask_maps_overload_to_http_status(monkeypatch):
+    monkeypatch.setitem(api.startup_state, "ready", True)
+
+    async def run():
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        monkeypatch.setattr(api, "admission", admission)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(admission, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as e:
+            await api.ask_question(api.QueryRequest(query="what is a holdout?"))
+        assert e.value.status_code == 429
+        assert e.value.headers["Retry-After"] == "1"
+
+        release.set()
+        await holder
+
+    asyncio.run(run())
+
+
+def test_run_cpu_bound_runs_off_the_loop_in_the_request_context():
+    request_id = contextvars.ContextVar("request_id")
+
+    def work():
+        return threading.current_thread().name, request_id.get()
+
+    def fail():
+        raise ValueError("bad input")
+
+    async def run():
+        request_id.set("req-1")
+        thread, seen = await api.run_cpu_bound(work)
+        assert thread.startswith("rag-cpu") and seen == "req-1"
+        with pytest.raises(ValueError):
+            await api.run_cpu_bound(fail)
+
+    asyncio.run(run())
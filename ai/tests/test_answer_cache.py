@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from RAG.answer_cache import AnswerCache, MemoryAnswerBackend, SQLiteAnswerBackend
+
+N = 20
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return AnswerCache(MemoryAnswerBackend())
+    return AnswerCache(SQLiteAnswerBackend(tmp_path / "answers.db"))
+
+
+class Upstream:
+    """Counts calls; each takes a little while, so identical requests overlap"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(0.05)
+        return "answer"
+
+    async def acall(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+
+
+def test_concurrent_async_requests_make_one_upstream_call(cache):
+    upstream = Upstream()
+
+    async def run():
+        return await asyncio.gather(*(cache.aget_or_compute("key", upstream.acall) for _ in range(N)))
+
+    assert asyncio.run(run()) == ["answer"] * N
+    assert upstream.calls == 1
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_concurrent_threads_make_one_upstream_call(cache):
+    upstream = Upstream()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", upstream)))
+               for _ in range(N)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ["answer"] * N
+    assert upstream.calls == 1
+
+
+def test_threads_and_event_loop_share_a_flight(cache):
+    upstream = Upstream()
+    results = []
+
+    async def run():
+        leader = asyncio.ensure_future(cache.aget_or_compute("key", upstream.acall))
+        await asyncio.sleep(0.01)  # the async call is in flight
+        thread = threading.Thread(target=lambda: results.append(cache.get_or_compute("key", upstream)))
+        thread.start()
+        results.append(await leader)
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(run())
+    assert results == ["answer", "answer"]
+    assert upstream.calls == 1
+
+
+def test_failure_reaches_every_waiter(cache):
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(cache.aget_or_compute("key", failing) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_sqlite_hits_do_no_io(tmp_path):
+    backend = SQLiteAnswerBackend(tmp_path / "answers.db")
+    cache = AnswerCache(backend)
+    upstream = Upstream()
+
+    async def run():
+        await cache.aget_or_compute("key", upstream.acall)
+
+        def no_io():
+            raise AssertionError("SQLite opened on a cache hit")
+
+        backend._connect = no_io
+        assert await cache.aget_or_compute("key", upstream.acall) == "answer"
+        assert cache.contains("key")
+        assert cache.stats()["entries"] == 1
+
+    asyncio.run(run())
+    assert upstream.calls == 1
+
+
+def test_sqlite_answers_survive_a_new_process(tmp_path):
+    SQLiteAnswerBackend(tmp_path / "answers.db").put("key", "answer")
+
+    backend = SQLiteAnswerBackend(tmp_path / "answers.db")
+    assert backend.size() == 1
+    assert backend.peek("key") is None  # not read by this process yet
+    assert backend.get("key") == "answer"
+    assert backend.peek("key") == "answer"
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+
+import hybrid_rag_api as api
+from RAG.answer_cache import AnswerCache, MemoryAnswerBackend
+from RAG.hits import DocView, SearchHit
+from serving.budget import Budget, LatencyEstimator, decide
+from serving.upstream import GeminiText
+
+QUERY = "how long should the holdout test run?"
+
+
+class FixedEstimator(LatencyEstimator):
+    """Always estimates `ms` (None: no recent calls)"""
+
+    def __init__(self, ms):
+        super().__init__()
+        self.ms = ms
+
+    def estimate_ms(self, q=0.9, min_samples=10):
+        return self.ms
+
+
+class FakeGemini:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        return GeminiText("enhanced answer")
+
+
+def hits(score=0.6):
+    doc = DocView(0, "doc-0", "holdout\nShare of markets kept out of the test.",
+                  {"section": "input", "param": "holdout", "function": "GeoLiftMarketSelection", "package": "GeoLift"})
+    return [SearchHit(doc, score)]
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    model = FakeGemini()
+    monkeypatch.setattr(api, "gemini_model", model)
+    monkeypatch.setattr(api, "answer_cache", AnswerCache(MemoryAnswerBackend()))
+    monkeypatch.setattr(api, "BUDGET_HEADROOM_MS", 0)
+    return model
+
+
+def use_estimate(monkeypatch, ms):
+    monkeypatch.setattr(api.gemini_upstream, "latency", FixedEstimator(ms))
+
+
+def budget(ms):
+    return Budget(ms, started=time.perf_counter())
+
+
+def test_estimator_uses_ewma_until_enough_samples_then_percentile():
+    estimator = LatencyEstimator(alpha=0.5, window=100)
+    for ms in (100, 200):
+        estimator.observe(ms)
+    assert estimator.estimate_ms(q=0.9, min_samples=3) == 150  # EWMA
+    for ms in range(1, 11):
+        estimator.observe(ms * 100)
+    assert estimator.estimate_ms(q=0.9, min_samples=3) == 900  # nearest-rank p90 of 12 samples
+
+
+def test_estimator_samples_expire():
+    estimator = LatencyEstimator(max_age_s=0.05)
+    estimator.observe(500)
+    time.sleep(0.06)
+    assert estimator.estimate_ms(min_samples=1) is None
+    assert estimator.stats()["samples"] == 0
+
+
+@pytest.mark.parametrize("budget_ms, estimate, expected", [
+    (None, 500, "unbounded"),
+    (1000, None, "no_estimate"),
+    (1000, 500, "within_budget"),
+    (1000, 1500, "over_budget"),
+])
+def test_decide(budget_ms, estimate, expected):
+    decision = decide(budget(budget_ms) if budget_ms is not None else None, FixedEstimator(estimate), "gemini")
+    assert decision["decision"] == expected
+
+
+def test_llm_that_does_not_fit_falls_back_to_rag(monkeypatch, gemini):
+    use_estimate(monkeypatch, 5000)
+    plan = api.plan_route(QUERY, hits(), api.format_rag_answer(QUERY, hits()), budget(1000))
+    assert plan["route"] == "rag_confident"
+    assert plan["budget"]["decision"] == "over_budget"
+
+    response = asyncio.run(api.answer_from_results(QUERY, hits(), budget=budget(1000)))
+    assert response.method == "rag"
+    assert response.budget_decision == "over_budget"
+    assert gemini.calls == 0
+
+
+def test_llm_that_fits_is_called_within_the_remaining_budget(monkeypatch, gemini):
+    use_estimate(monkeypatch, 200)
+    request_budget = budget(1000)
+    plan = api.plan_route(QUERY, hits(), api.format_rag_answer(QUERY, hits()), request_budget)
+    assert plan["route"] == "rag_enhanced"
+    assert plan["budget"]["decision"] == "within_budget"
+    assert 0 < api.llm_deadline_s(plan, request_budget) <= 1.0
+
+    response = asyncio.run(api.answer_from_results(QUERY, hits(), budget=budget(1000)))
+    assert response.method == "rag_enhanced"
+    assert gemini.calls == 1
+
+
+def test_cached_answer_is_served_even_over_budget(monkeypatch, gemini):
+    plan = api.plan_route(QUERY, hits(), api.format_rag_answer(QUERY, hits()))
+    api.answer_cache.put(api.gemini_answer_key(QUERY, plan["rag_context"], plan["doc_ids"]), "cached answer")
+    use_estimate(monkeypatch, 5000)
+
+    request_budget = budget(1000)
+    plan = api.plan_route(QUERY, hits(), api.format_rag_answer(QUERY, hits()), request_budget)
+    assert plan["route"] == "rag_enhanced"
+    assert plan["budget"]["decision"] == "cached"
+    assert api.llm_deadline_s(plan, request_budget) is None  # not cut short by the budget
+
+    response = asyncio.run(api.answer_from_results(QUERY, hits(), budget=budget(1000)))
+    assert response.answer == "cached answer"
+    assert response.budget_decision == "cached"
+    assert gemini.calls == 0
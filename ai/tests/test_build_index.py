@@ -0,0 +1,58 @@
+import numpy as np
+from langchain.schema import Document
+
+from RAG.build_index import build_index
+from RAG.documents import content_hash
+from RAG.embeddings import cache_revision
+
+
+class FakeEmbeddings:
+    """Deterministic vectors; counts the texts it embeds"""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return [np.random.default_rng(len(t)).random(8).tolist() for t in texts]
+
+
+def make_docs(texts):
+    return [Document(page_content=t, metadata={"doc_id": f"doc-{i}", "content_hash": content_hash(t)})
+            for i, t in enumerate(texts)]
+
+
+TORCH = {"embedding_revision": "main", "backend": "torch"}
+ONNX_INT8 = {"embedding_revision": "main", "backend": "onnx", "onnx": {"quantize": True}}
+
+
+def test_unchanged_docs_are_reused_with_the_same_revision(tmp_path):
+    docs = make_docs(["alpha", "beta", "gamma"])
+    build_index(docs, tmp_path / "store", FakeEmbeddings(), "model", embedding_revision=cache_revision(TORCH))
+
+    embeddings = FakeEmbeddings()
+    manifest, log = build_index(docs, tmp_path / "store", embeddings, "model",
+                                embedding_revision=cache_revision(TORCH))
+    assert log["mode"] == "incremental"
+    assert embeddings.embedded == 0
+    assert manifest["embedding_revision"] == "main"
+
+
+def test_backend_change_forces_full_rebuild(tmp_path):
+    docs = make_docs(["alpha", "beta", "gamma"])
+    build_index(docs, tmp_path / "store", FakeEmbeddings(), "model", embedding_revision=cache_revision(TORCH))
+
+    embeddings = FakeEmbeddings()
+    manifest, log = build_index(docs, tmp_path / "store", embeddings, "model",
+                                embedding_revision=cache_revision(ONNX_INT8))
+    assert log["mode"] == "full"
+    assert embeddings.embedded == len(docs)
+    assert manifest["embedding_revision"] == "main+onnx-int8"
+
+
+def test_artifact_without_revision_is_rebuilt(tmp_path):
+    docs = make_docs(["alpha", "beta"])
+    build_index(docs, tmp_path / "store", FakeEmbeddings(), "model")  # as written before revisions were recorded
+
+    _, log = build_index(docs, tmp_path / "store", FakeEmbeddings(), "model", embedding_revision=cache_revision(TORCH))
+    assert log["mode"] == "full"
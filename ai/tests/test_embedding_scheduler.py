@@ -0,0 +1,99 @@
+import os
+import select
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from RAG.embedding_scheduler import MicroBatchEmbedder, make_query_embedder
+
+
+class StubEmbeddings:
+    """Vector = [len(text)]; records every embed_documents batch"""
+
+    def __init__(self, delay_s=0.0, fail=False):
+        self.delay_s = delay_s
+        self.fail = fail
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(self.delay_s)
+        if self.fail:
+            raise RuntimeError("model failed")
+        return [[float(len(t))] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def embed_concurrently(embedder, texts):
+    with ThreadPoolExecutor(len(texts)) as pool:
+        futures = [pool.submit(embedder.embed_query, t) for t in texts]
+        return [f.exception() or f.result() for f in futures]
+
+
+TEXTS = ["q" * n for n in range(1, 17)]
+
+
+def test_concurrent_queries_are_coalesced():
+    stub = StubEmbeddings(delay_s=0.02)
+    embedder = MicroBatchEmbedder(stub, max_batch_size=32, max_wait_ms=20)
+
+    vectors = embed_concurrently(embedder, TEXTS)
+    assert vectors == [[float(len(t))] for t in TEXTS]  # every caller gets its own vector
+    assert len(stub.batches) < len(TEXTS)
+    assert sorted(t for batch in stub.batches for t in batch) == sorted(TEXTS)
+    assert embedder.stats()["batch_size"]["count"] == len(stub.batches)
+
+
+def test_batches_respect_max_batch_size():
+    stub = StubEmbeddings(delay_s=0.02)
+    embedder = MicroBatchEmbedder(stub, max_batch_size=4, max_wait_ms=20)
+
+    embed_concurrently(embedder, TEXTS)
+    assert max(len(batch) for batch in stub.batches) <= 4
+
+
+def test_errors_reach_every_waiter_and_the_worker_keeps_going():
+    stub = StubEmbeddings(delay_s=0.02, fail=True)
+    embedder = MicroBatchEmbedder(stub, max_batch_size=32, max_wait_ms=20)
+
+    results = embed_concurrently(embedder, TEXTS[:8])
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    stub.fail = False
+    assert embedder.embed_query("after") == [5.0]
+
+
+def test_disabled_micro_batching_returns_the_model():
+    stub = StubEmbeddings()
+    assert make_query_embedder(stub, {"enabled": False}) is stub
+    assert isinstance(make_query_embedder(stub, None), MicroBatchEmbedder)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_worker_restarts_in_a_forked_child():
+    embedder = MicroBatchEmbedder(StubEmbeddings(), max_wait_ms=1)
+    assert embedder.embed_query("parent") == [6.0]  # the parent's worker is running
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child: the parent's worker thread did not survive the fork
+        try:
+            os.write(write_fd, str(embedder.embed_query("child")[0]).encode())
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    ready = []
+    try:
+        ready, _, _ = select.select([read_fd], [], [], 10)
+        assert ready, "the child hung waiting for the parent's worker"
+        assert os.read(read_fd, 64) == b"5.0"
+    finally:
+        os.close(read_fd)
+        if not ready:
+            os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    assert embedder.embed_query("parent again") == [12.0]
@@ -0,0 +1,132 @@
+import sqlite3
+
+import numpy as np
+
+import hybrid_rag_api as api
+from RAG.cache import LRUCache
+from RAG.embedding_store import EmbeddingStore, ServingEmbeddingCache, text_hash
+from RAG.embeddings import serving_embedding_cache
+
+
+def row(path, text):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT last_used FROM embeddings WHERE text_hash = ?", (text_hash(text),)).fetchone()
+    finally:
+        conn.close()
+
+
+def lookups(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT hits, misses FROM lookup_stats").fetchone()
+    finally:
+        conn.close()
+
+
+def test_serving_lookups_never_write(tmp_path):
+    path = tmp_path / "embeddings.db"
+    store = EmbeddingStore(path)
+    store.put_many("model", "main", [(text_hash("what is a holdout"), [0.1, 0.2])])
+    written = row(path, "what is a holdout")
+
+    cache = ServingEmbeddingCache(store, "model", "main", flush_s=3600)
+    for _ in range(3):
+        assert cache.get("what is a holdout").tolist() == np.float32([0.1, 0.2]).tolist()
+    assert cache.get("unknown query") is None
+    cache.put("new query", [0.3, 0.4])
+    assert cache.get("new query") is not None  # served from the write-behind queue
+
+    assert row(path, "what is a holdout") == written
+    assert row(path, "new query") is None
+    assert lookups(path) is None
+
+    cache.flush()
+    assert row(path, "what is a holdout")[0] > written[0]
+    assert row(path, "new query") is not None
+    assert lookups(path) == (4, 1)
+    assert cache.stats()["pending"] == 0
+
+
+def test_flushed_vectors_are_shared_with_other_workers_and_builds(tmp_path):
+    path = tmp_path / "embeddings.db"
+    worker = ServingEmbeddingCache(EmbeddingStore(path), "model", "main+onnx-int8")
+    worker.put("what is a holdout", [1.0, 2.0])
+    worker.flush()
+
+    other = ServingEmbeddingCache(EmbeddingStore(path), "model", "main+onnx-int8")
+    assert other.get("what is a holdout").tolist() == [1.0, 2.0]
+    assert ServingEmbeddingCache(EmbeddingStore(path), "model", "main").get("what is a holdout") is None
+
+    found = EmbeddingStore(path).get_many("model", "main+onnx-int8", [text_hash("what is a holdout")])
+    assert list(found) == [text_hash("what is a holdout")]
+
+
+def test_serving_cache_follows_settings(tmp_path):
+    config = {"paths": {"embedding_store": str(tmp_path / "embeddings.db")},
+              "retrieval": {"embedding_model": "model", "embedding_cache": {"flush_s": 1}}}
+    assert serving_embedding_cache(config).flush_s == 1
+    config["retrieval"]["embedding_cache"]["serving"] = False
+    assert serving_embedding_cache(config) is None
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [0.5, 0.5]
+
+
+class FakeStore:
+    def __len__(self):
+        return 1
+
+    def search_hits(self, matrix, k):
+        return [[] for _ in matrix]
+
+
+def test_semantic_search_reads_through_the_store(tmp_path, monkeypatch):
+    cache = ServingEmbeddingCache(EmbeddingStore(tmp_path / "embeddings.db"), "model", "main", flush_s=3600)
+    embedder = CountingEmbedder()
+    monkeypatch.setattr(api, "persistent_embeddings", cache)
+    monkeypatch.setattr(api, "query_embedder", embedder)
+    monkeypatch.setattr(api, "vector_store", FakeStore())
+    monkeypatch.setattr(api, "SEARCH_MODE", "dense")
+    monkeypatch.setattr(api, "embedding_cache", LRUCache())
+    monkeypatch.setattr(api, "search_cache", LRUCache())
+
+    api.semantic_search("What is a holdout?")
+    assert embedder.calls == 1
+    cache.flush()
+
+    # Another worker (or a restart): empty in-process caches, same store
+    monkeypatch.setattr(api, "embedding_cache", LRUCache())
+    monkeypatch.setattr(api, "search_cache", LRUCache())
+    api.semantic_search("what is a holdout")
+    assert embedder.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_query_embeddings_survive_an_index_rebuild_but_not_a_model_change(monkeypatch):
+    embedder = CountingEmbedder()
+    monkeypatch.setattr(api, "persistent_embeddings", None)
+    monkeypatch.setattr(api, "query_embedder", embedder)
+    monkeypatch.setattr(api, "vector_store", FakeStore())
+    monkeypatch.setattr(api, "SEARCH_MODE", "dense")
+    monkeypatch.setattr(api, "embedding_cache", LRUCache())
+    monkeypatch.setattr(api, "search_cache", LRUCache())
+    monkeypatch.setattr(api, "INDEX_VERSION", "build-1")
+    monkeypatch.setattr(api, "EMBEDDING_REVISION", "main")
+    api.semantic_search("what is a holdout")
+
+    monkeypatch.setattr(api, "INDEX_VERSION", "build-2")
+    api.semantic_search("what is a holdout")
+    assert embedder.calls == 1
+    assert api.search_cache.stats()["invalidations"] == 1
+
+    monkeypatch.setattr(api, "EMBEDDING_REVISION", "main+onnx-int8")
+    monkeypatch.setattr(api, "search_cache", LRUCache())
+    api.semantic_search("what is a holdout")
+    assert embedder.calls == 2
@@ -0,0 +1,62 @@
+"""
+ONNX Runtime vs torch parity on params.db documents (the check benchmarks/embedding_bench.py
+gates a backend switch on). Skipped unless onnxruntime is installed and the embedding model is
+already in the local Hugging Face cache: the test never downloads it.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("langchain_huggingface")
+
+from benchmarks.common import load_config, load_corpus
+from RAG.onnx_embeddings import OnnxEmbeddings, export_onnx, model_dir
+
+MIN_COSINE = 0.99  # embedding_bench.py --min-cosine default
+DOCUMENTS = 8
+
+CONFIG = load_config()
+RETRIEVAL = CONFIG["retrieval"]
+MODEL_NAME = RETRIEVAL["embedding_model"]
+REVISION = RETRIEVAL.get("embedding_revision") or "main"
+
+
+def cached_model():
+    from huggingface_hub import snapshot_download
+
+    try:
+        return snapshot_download(MODEL_NAME, revision=REVISION, local_files_only=True)
+    except Exception:
+        return None
+
+
+pytestmark = pytest.mark.skipif(cached_model() is None, reason=f"{MODEL_NAME}@{REVISION} is not in the local cache")
+
+
+def normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return [doc.page_content for doc in load_corpus(CONFIG)[:DOCUMENTS]]
+
+
+@pytest.fixture(scope="module")
+def reference(texts):
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    torch_model = HuggingFaceEmbeddings(model_name=cached_model(), model_kwargs={"device": "cpu"})
+    return normalized(torch_model.embed_documents(texts))
+
+
+@pytest.mark.parametrize("quantize", [False, True], ids=["fp32", "int8"])
+def test_onnx_matches_torch(texts, reference, quantize):
+    directory = model_dir((RETRIEVAL.get("onnx") or {}).get("path", "RAG/onnx_models"), MODEL_NAME, REVISION)
+    model = OnnxEmbeddings(export_onnx(MODEL_NAME, directory, REVISION, quantize=quantize), directory, threads=1)
+
+    cosine = np.sum(normalized(model.embed_documents(texts)) * reference, axis=1)
+    assert len(cosine) == len(texts) > 0
+    assert cosine.min() >= MIN_COSINE
@@ -0,0 +1,66 @@
+import contextlib
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import hybrid_rag_api as api
+
+
+class FakeStore:
+    def __len__(self):
+        return 1
+
+
+@pytest.fixture
+def startup(monkeypatch):
+    """Runs the app's lifespan with `load_components` replaced by one that loads `store`"""
+    monkeypatch.setattr(api, "startup_state", {"ready": False, "loaded": False, "phase": "pending",
+                                               "timings_ms": {}, "error": None})
+    monkeypatch.setattr(api, "WARMUP_QUERIES", [])
+
+    with contextlib.ExitStack() as stack:
+        def run(store):
+            def load():
+                api.vector_store = store
+                api.startup_state["loaded"] = True
+
+            monkeypatch.setattr(api, "vector_store", None)
+            monkeypatch.setattr(api, "load_components", load)
+            client = stack.enter_context(TestClient(api.app))
+            deadline = time.monotonic() + 5
+            while api.startup_state["phase"] == "pending" and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return client
+
+        yield run
+
+
+def test_ready_once_the_store_is_loaded(startup):
+    client = startup(FakeStore())
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["phase"] == "ready"
+
+
+def test_missing_store_is_degraded_not_ready(startup):
+    client = startup(None)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+    assert response.json()["phase"] == "degraded"
+    assert "vector store" in response.json()["error"]
+    assert client.get("/health").json()["vector_store_loaded"] is False
+    api._require_ready()  # Gemini-only answers are still served
+
+
+def test_index_size_is_measured_at_load_not_per_scrape(tmp_path, monkeypatch):
+    (tmp_path / "vectors.npy").write_bytes(b"\0" * 1000)
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "text.bin").write_bytes(b"\0" * 24)
+    monkeypatch.setattr(api, "STORE_PATH", tmp_path)
+    monkeypatch.setattr(api, "INDEX_BYTES", api._index_bytes())
+    assert api.INDEX_BYTES == 1024
+
+    monkeypatch.setattr(api, "STORE_PATH", None)  # a scrape that touched the disk would fail
+    assert "rag_index_bytes 1024" in api.REGISTRY.render()
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+import hybrid_rag_api as api
+from serving.upstream import DeadlineExceeded, Upstream
+
+SCOPE = {"type": "http", "method": "POST", "path": "/ask/stream", "headers": []}
+
+
+@pytest.fixture(autouse=True)
+def ready(monkeypatch):
+    monkeypatch.setitem(api.startup_state, "ready", True)
+    yield
+    assert api.admission.in_flight == 0
+
+
+async def open_stream():
+    response = await api.ask_stream(api.QueryRequest(query="what is a holdout?"))
+    assert api.admission.in_flight == 1
+    return response
+
+
+async def wait_for_disconnect():
+    await asyncio.Event().wait()
+
+
+def test_slot_released_after_a_complete_stream():
+    events = []
+
+    async def send(message):
+        events.append(message)
+
+    async def run():
+        response = await open_stream()
+        await response(SCOPE, wait_for_disconnect, send)
+        assert api.admission.in_flight == 0
+
+    asyncio.run(run())
+    body = b"".join(m.get("body", b"") for m in events)
+    assert b"event: done" in body
+
+
+def test_slot_released_when_the_stream_never_starts():
+    async def send(message):
+        raise OSError("client went away before the response started")
+
+    async def run():
+        response = await open_stream()
+        with pytest.raises(OSError):
+            await response(SCOPE, wait_for_disconnect, send)
+        assert api.admission.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_slot_released_when_the_client_disconnects_mid_stream():
+    async def run():
+        sent = asyncio.Event()
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                sent.set()
+                await asyncio.Event().wait()  # the client stops reading
+
+        async def receive():
+            await sent.wait()
+            return {"type": "http.disconnect"}
+
+        response = await open_stream()
+        await response(SCOPE, receive, send)
+        assert api.admission.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_slot_released_when_the_request_is_cancelled():
+    async def run():
+        response = await open_stream()
+
+        async def send(message):
+            await asyncio.Event().wait()
+
+        task = asyncio.ensure_future(response(SCOPE, wait_for_disconnect, send))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert api.admission.in_flight == 0
+
+    asyncio.run(run())
+
+
+class SlowStream:
+    def __init__(self, delay_s):
+        self.delay_s = delay_s
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay_s)
+        return "chunk"
+
+
+def test_astream_stops_at_the_callers_deadline():
+    upstream = Upstream("stream-test", {"attempt_timeout_s": 5.0, "retries": 0})
+
+    async def open_slow():
+        return SlowStream(0.05)
+
+    async def run():
+        chunks = []
+        with pytest.raises(DeadlineExceeded):
+            async for chunk in upstream.astream(open_slow, deadline_s=0.2):
+                chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(run())
+    assert 1 <= len(chunks) < 5
+    assert upstream.breaker.stats()["consecutive_failures"] == 0  # the budget, not the provider, ran out
+
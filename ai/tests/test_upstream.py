@@ -0,0 +1,199 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from benchmarks.fake_llm import FakeLLMSettings, create_app
+from serving.upstream import (CircuitBreaker, CircuitOpen, DeadlineExceeded, GeminiClient, Upstream, UpstreamError,
+                              is_retryable, retry_after_s, status_code)
+
+FAST = {"backoff_base_s": 0.001, "backoff_max_s": 0.002}
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.available and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.stats()["state"] == "half_open" and breaker.available
+    assert breaker.allow()      # the single probe
+    assert not breaker.allow()  # everyone else waits for its outcome
+    breaker.record_success()
+    assert breaker.stats() == {"state": "closed", "consecutive_failures": 0, "opened": 1}
+
+
+def test_failed_probe_reopens_and_cancelled_probe_is_freed():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()  # cancelled without a verdict
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.opened == 2
+
+
+def test_transient_errors_are_retried():
+    upstream = Upstream("retry-test", {**FAST, "retries": 2})
+    attempts = []
+
+    def fn(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("refused")
+        return "answer"
+
+    assert upstream.call(fn) == "answer"
+    assert len(attempts) == 3
+    assert all(t <= upstream.attempt_timeout_s for t in attempts)
+    assert upstream.breaker.stats()["consecutive_failures"] == 0
+
+
+def test_permanent_errors_are_not_retried():
+    upstream = Upstream("no-retry-test", {**FAST, "retries": 5})
+    attempts = []
+
+    def fn(timeout):
+        attempts.append(timeout)
+        raise ValueError("bad request")
+
+    with pytest.raises(UpstreamError):
+        upstream.call(fn)
+    assert len(attempts) == 1
+
+
+def test_retries_stop_at_the_deadline():
+    upstream = Upstream("deadline-test", {"retries": 100, "deadline_s": 0.3, "attempt_timeout_s": 0.1,
+                                          "backoff_base_s": 0.05, "backoff_max_s": 0.05, "breaker_failures": 1000})
+    attempts = []
+
+    def fn(timeout):
+        attempts.append(timeout)
+        time.sleep(timeout)
+        raise TimeoutError("slow")
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamError):
+        upstream.call(fn)
+    assert time.monotonic() - started < 0.45
+    assert 1 < len(attempts) < 5
+    assert all(t <= 0.1 for t in attempts)
+
+
+def test_acall_stops_at_the_callers_deadline_without_a_breaker_verdict():
+    upstream = Upstream("budget-test", {"attempt_timeout_s": 5.0, "breaker_failures": 1})
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(upstream.acall(slow, deadline_s=0.05))
+    assert time.monotonic() - started < 0.5
+    assert upstream.breaker.stats()["state"] == "closed"
+    assert upstream.latency.stats()["samples"] == 1  # observed as a lower bound
+
+
+def test_open_circuit_short_circuits_calls():
+    upstream = Upstream("open-test", {**FAST, "retries": 0, "breaker_failures": 2, "breaker_reset_s": 60})
+    calls = []
+
+    def failing(timeout):
+        calls.append(timeout)
+        raise httpx.ConnectError("refused")
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            upstream.call(failing)
+    assert not upstream.available
+
+    with pytest.raises(CircuitOpen):
+        upstream.call(failing)
+    with pytest.raises(CircuitOpen):
+        asyncio.run(upstream.acall(lambda: asyncio.sleep(0)))
+    assert len(calls) == 2  # neither short-circuited call reached the provider
+
+
+def mock_gemini(handler):
+    client = GeminiClient("test-key", "gemini-test", base_url="http://gemini.test")
+    client._client = httpx.Client(base_url=client.base_url, headers=client._headers,
+                                  transport=httpx.MockTransport(handler))
+    return client
+
+
+def gemini_payload(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+def test_gemini_request_and_response_shape():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=gemini_payload("four"))
+
+    client = mock_gemini(handler)
+    assert client.generate_content("what is 2+2?", timeout=1.5).text == "four"
+
+    request = requests[0]
+    assert request.method == "POST"
+    assert request.url.path == "/v1beta/models/gemini-test:generateContent"
+    assert request.headers["x-goog-api-key"] == "test-key"
+    assert json.loads(request.content) == {"contents": [{"role": "user", "parts": [{"text": "what is 2+2?"}]}]}
+    assert request.extensions["timeout"]["read"] == 1.5
+
+
+def test_gemini_errors_map_to_the_retry_policy():
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": "0.01"}, json={"error": {"code": 429}}),
+        httpx.Response(503, json={"error": {"code": 503}}),
+        httpx.Response(200, json=gemini_payload("ok")),
+    ])
+    errors = []
+    client = mock_gemini(lambda request: next(responses))
+    upstream = Upstream("gemini-retry-test", {**FAST, "retries": 2})
+
+    def call(timeout):
+        try:
+            return client.generate_content("q", timeout=timeout)
+        except Exception as e:
+            errors.append(e)
+            raise
+
+    assert upstream.call(call).text == "ok"
+    assert [status_code(e) for e in errors] == [429, 503]
+    assert retry_after_s(errors[0]) == 0.01
+
+    bad_request = mock_gemini(lambda request: httpx.Response(400, json={"error": {"code": 400}}))
+    with pytest.raises(httpx.HTTPStatusError) as e:
+        bad_request.generate_content("q")
+    assert not is_retryable(e.value)
+
+
+def test_gemini_without_candidates_is_an_error():
+    blocked = mock_gemini(lambda request: httpx.Response(200, json={"promptFeedback": {"blockReason": "SAFETY"}}))
+    with pytest.raises(ValueError, match="no candidates"):
+        blocked.generate_content("q")
+
+
+def test_gemini_async_and_streaming_against_the_fake_server():
+    app = create_app(FakeLLMSettings(token_ms=0, tokens=6))
+    client = GeminiClient("test-key", "gemini-test", base_url="http://fake-llm")
+    client._async_client = lambda: httpx.AsyncClient(base_url=client.base_url, headers=client._headers,
+                                                     transport=httpx.ASGITransport(app=app))
+
+    async def run():
+        answer = await client.generate_content_async("what is a holdout?")
+        stream = await client.generate_content_async("what is a holdout?", stream=True)
+        chunks = [chunk.text async for chunk in stream]
+        return answer.text, chunks
+
+    answer, chunks = asyncio.run(run())
+    assert answer.startswith("Stub answer for:")
+    assert len(chunks) == 6
+    assert "".join(chunks) == answer
@@ -4,6 +4,8 @@
  */
 
 const RAG_API_BASE_URL = process.env.REACT_APP_RAG_API_URL || 'https://142.93.8.101.sslip.io/api/rag';
+// debug_info (routing factors, documents used) is only returned when requested
+const RAG_API_DEBUG = process.env.NODE_ENV === 'development' || process.env.REACT_APP_RAG_API_DEBUG === 'true';
 
 class RAGAPIError extends Error {
   constructor(message, status, data) {
@@ -68,7 +70,7 @@ export const ragAPI = {
     try {
       const response = await ragApiRequest('/ask', {
         method: 'POST',
-        body: JSON.stringify({ query })
+        body: JSON.stringify({ query, debug: RAG_API_DEBUG })
       });
       
       const endTime = performance.now();